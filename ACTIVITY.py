@@ -0,0 +1,336 @@
+import argparse
+import bisect
+import gzip
+import json
+import mmap
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+from METRICS import METRICS
+
+
+def parse_line(line):
+    # "YYYY-MM-DD HH:MM:SS - user: message"
+    timestamp, separator, rest = line.partition(' - ')
+    user, separator, message = rest.partition(': ')
+    return timestamp, user, message
+
+
+def time_key(value, pad):
+    # Lets "2024-12-08", "2024-12-08 21" or "2024-12-08 21:25" bound a query
+    return value + pad[len(value):] if value else None
+
+
+class ActivityIndex:
+    # Sidecar index for one log segment, appended to as lines are written: the byte offset at
+    # which each minute starts, and which minutes each user was active in. Only the log writer's
+    # index is writable; query-side indexes catch up in memory and never touch the .idx file.
+    def __init__(self, path, writable=True):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.writable = writable
+        self.buckets = []
+        self.offsets = []
+        self.user_buckets = {}
+        self.size = 0
+        self.load()
+
+    def reset(self):
+        self.buckets = []
+        self.offsets = []
+        self.user_buckets = {}
+        self.size = 0
+        if self.writable and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def load(self):
+        # Each batch ends with its 's' entry; anything after the last one is a batch still being
+        # written (or torn by a crash) and is left for catch_up to index from the log itself
+        committed = 0
+        try:
+            with open(self.index_path, 'rb') as f:
+                position = 0
+                pending = []
+                for line in f:
+                    position += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    pending.append(entry)
+                    if 's' not in entry:
+                        continue
+                    for entry in pending:
+                        if 'b' in entry and 'o' in entry:
+                            self.buckets.append(entry['b'])
+                            self.offsets.append(entry['o'])
+                        elif 'u' in entry:
+                            self.user_buckets.setdefault(entry['u'], []).append(entry['i'])
+                        elif 's' in entry:
+                            self.size = entry['s']
+                    pending = []
+                    committed = position
+            if self.writable and committed < position:
+                with open(self.index_path, 'r+b') as f:
+                    f.truncate(committed)
+        except FileNotFoundError:
+            pass
+        try:
+            log_size = os.path.getsize(self.path)
+        except OSError:
+            log_size = 0
+        if log_size < self.size:
+            # The log was replaced or truncated behind our back
+            self.reset()
+        self.catch_up()
+
+    def add(self, lines, offset):
+        entries = []
+        for line in lines:
+            timestamp, user, message = parse_line(line.decode('utf-8', 'replace'))
+            bucket = timestamp[:16]
+            if not self.buckets or bucket != self.buckets[-1]:
+                self.buckets.append(bucket)
+                self.offsets.append(offset)
+                entries.append({'b': bucket, 'o': offset})
+            index = len(self.buckets) - 1
+            seen = self.user_buckets.setdefault(user, [])
+            if not seen or seen[-1] != index:
+                seen.append(index)
+                entries.append({'u': user, 'i': index})
+            offset += len(line)
+        self.size = offset
+        if self.writable:
+            entries.append({'s': offset})
+            with open(self.index_path, 'a') as f:
+                f.write(''.join(json.dumps(entry) + "\n" for entry in entries))
+
+    def catch_up(self):
+        # Index whatever was appended since the last recorded size, e.g. lines from older versions
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.size)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1
+        if end:
+            self.add(data[:end].splitlines(keepends=True), self.size)
+
+    def byte_range(self, first, last):
+        # Offsets spanning buckets first..last inclusive
+        start = self.offsets[first]
+        end = self.offsets[last + 1] if last + 1 < len(self.offsets) else self.size
+        return start, end
+
+    def bucket_range(self, start=None, end=None):
+        first = bisect.bisect_right(self.buckets, start[:16]) - 1 if start else 0
+        last = bisect.bisect_right(self.buckets, end[:16]) - 1 if end else len(self.buckets) - 1
+        return max(first, 0), last
+
+    def query(self, start=None, end=None, user=None, device=None):
+        self.catch_up()
+        if not self.buckets or self.size == 0:
+            return
+        first, last = self.bucket_range(start, end)
+        if last < first:
+            return
+        if user is not None:
+            user_buckets = self.user_buckets.get(user, [])
+            low = bisect.bisect_left(user_buckets, first)
+            high = bisect.bisect_right(user_buckets, last)
+            ranges = [self.byte_range(index, index) for index in user_buckets[low:high]]
+        else:
+            ranges = [self.byte_range(first, last)]
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for range_start, range_end in ranges:
+                for raw in mm[range_start:range_end].splitlines():
+                    line = raw.decode('utf-8', 'replace')
+                    if matches(line, start, end, user, device):
+                        yield line
+
+
+def matches(line, start=None, end=None, user=None, device=None):
+    timestamp, line_user, message = parse_line(line)
+    if start and timestamp < start:
+        return False
+    if end and timestamp > end:
+        return False
+    if user is not None and line_user != user:
+        return False
+    if device and device not in message:
+        return False
+    return True
+
+
+def query_activity(path, start=None, end=None, user=None, device=None):
+    # Oldest rotated segment first; compressed segments have no index and are scanned
+    start = time_key(start, '0000-00-00 00:00:00')
+    end = time_key(end, '9999-99-99 99:99:99')
+    segments = []
+    number = 1
+    while os.path.exists(f"{path}.{number}") or os.path.exists(f"{path}.{number}.gz"):
+        segments.append(f"{path}.{number}" if os.path.exists(f"{path}.{number}") else f"{path}.{number}.gz")
+        number += 1
+    for segment in reversed(segments):
+        if segment.endswith('.gz'):
+            with gzip.open(segment, 'rt') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if matches(line, start, end, user, device):
+                        yield line
+        else:
+            yield from ActivityIndex(segment, writable=False).query(start, end, user, device)
+    if os.path.exists(path):
+        yield from ActivityIndex(path, writable=False).query(start, end, user, device)
+
+
+class ActivityLog:
+    def __init__(self, directory='data', filename='status_report.txt', structured=True,
+                 max_bytes=5 * 1024 * 1024, rotate_interval=None, backups=5, compress=False,
+                 flush_interval=0.5, batch_size=500):
+        self.directory = directory
+        self.path = os.path.join(directory, filename)
+        self.structured_path = os.path.splitext(self.path)[0] + '.jsonl' if structured else None
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.records = queue.Queue()
+        self.opened_at = time.time()
+        os.makedirs(directory, exist_ok=True)
+        self.index = ActivityIndex(self.path)
+        self.thread = threading.Thread(target=self._run, name="activity-log", daemon=True)
+        self.thread.start()
+
+    def log(self, user, message, **fields):
+        self.records.put((datetime.now(), user, message, fields))
+
+    def format_line(self, record):
+        timestamp, user, message, fields = record
+        return f"{timestamp.strftime('%Y-%m-%d %H:%M:%S')} - {user}: {message}\n"
+
+    def format_structured(self, record):
+        timestamp, user, message, fields = record
+        return json.dumps({'time': timestamp.isoformat(timespec='seconds'), 'user': user,
+                           'message': message, **fields}) + "\n"
+
+    def _run(self):
+        while True:
+            try:
+                first = self.records.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            records = [record for record in batch if record is not None]
+            try:
+                if records:
+                    self.write(records)
+            except Exception as e:
+                print(f"Failed to log status: {str(e)}")
+            for _ in batch:
+                self.records.task_done()
+            if stop:
+                return
+
+    def write(self, records):
+        if self.should_rotate():
+            self.rotate()
+        # One open and one write per batch instead of per event
+        lines = [self.format_line(record).encode('utf-8') for record in records]
+        with open(self.path, 'ab') as f:
+            offset = f.tell()
+            f.write(b''.join(lines))
+        self.index.add(lines, offset)
+        METRICS.count('activity.bytes_written', sum(len(line) for line in lines))
+        if self.structured_path:
+            structured = ''.join(self.format_structured(record) for record in records)
+            with open(self.structured_path, 'a') as f:
+                f.write(structured)
+            METRICS.count('activity.bytes_written', len(structured.encode('utf-8')))
+
+    def should_rotate(self):
+        if self.rotate_interval is not None and time.time() - self.opened_at >= self.rotate_interval:
+            return os.path.exists(self.path)
+        try:
+            return os.path.getsize(self.path) >= self.max_bytes
+        except OSError:
+            return False
+
+    def segment_path(self, path, number):
+        return f"{path}.{number}.gz" if self.compress else f"{path}.{number}"
+
+    def rotate(self):
+        for path in filter(None, (self.path, self.structured_path)):
+            if not os.path.exists(path):
+                continue
+            oldest = self.segment_path(path, self.backups)
+            if os.path.exists(oldest):
+                os.remove(oldest)
+            for number in range(self.backups - 1, 0, -1):
+                source = self.segment_path(path, number)
+                if os.path.exists(source):
+                    os.replace(source, self.segment_path(path, number + 1))
+            if self.compress:
+                with open(path, 'rb') as src, gzip.open(self.segment_path(path, 1), 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(path)
+            else:
+                os.replace(path, self.segment_path(path, 1))
+            # Indexes follow their segment; compressed segments are scanned instead
+            for number in range(self.backups, 0, -1):
+                index_path = f"{path}.{number}.idx"
+                if os.path.exists(index_path):
+                    if number == self.backups or self.compress:
+                        os.remove(index_path)
+                    else:
+                        os.replace(index_path, f"{path}.{number + 1}.idx")
+            if os.path.exists(path + '.idx'):
+                if self.compress:
+                    os.remove(path + '.idx')
+                else:
+                    os.replace(path + '.idx', f"{path}.1.idx")
+        self.opened_at = time.time()
+        self.index = ActivityIndex(self.path)
+
+    def flush(self):
+        self.records.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the Smart Home activity log")
+    add_query_arguments(parser)
+    run_query(parser.parse_args(argv))
+
+
+def add_query_arguments(parser):
+    parser.add_argument('--since', help="start time, e.g. '2024-12-08 02:00'")
+    parser.add_argument('--until', help="end time (inclusive), e.g. '2024-12-08 03:00'")
+    parser.add_argument('--user', help="only events by this user")
+    parser.add_argument('--device', help="only events mentioning this device name")
+    parser.add_argument('--log', default=os.path.join('data', 'status_report.txt'), help="log file to query")
+
+
+def run_query(args):
+    for line in query_activity(args.log, args.since, args.until, args.user, args.device):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
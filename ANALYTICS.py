@@ -0,0 +1,218 @@
+import operator
+import threading
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+OPS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+
+
+class Columns:
+    # One device type as columns: numbers (bools as 0/1) in array('d'), strings dictionary-encoded
+    # into array('i') codes. NumPy, when installed, reads them in place through the buffer protocol.
+    def __init__(self, device_class):
+        sample = device_class('', '', None).to_dict()
+        self.numeric = [key for key, value in sample.items() if isinstance(value, (bool, int, float))]
+        self.categorical = [key for key in sample if key != 'name' and key not in self.numeric]
+        self.names = []
+        self.rows = {}
+        self.values = {key: array('d') for key in self.numeric}
+        self.codes = {key: array('i') for key in self.categorical}
+        self.categories = {key: [] for key in self.categorical}
+        self.category_codes = {key: {} for key in self.categorical}
+
+    def __len__(self):
+        return len(self.names)
+
+    def code(self, column, value):
+        codes = self.category_codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.categories[column])
+            self.categories[column].append(value)
+        return code
+
+    def append(self, device):
+        self.rows[device.name] = len(self.names)
+        self.names.append(device.name)
+        for key, column in self.values.items():
+            column.append(float(getattr(device, key)))
+        for key, column in self.codes.items():
+            column.append(self.code(key, getattr(device, key)))
+
+    def update(self, row, device):
+        for key, column in self.values.items():
+            column[row] = float(getattr(device, key))
+        for key, column in self.codes.items():
+            column[row] = self.code(key, getattr(device, key))
+
+    def remove(self, name):
+        # Swap the last row into the hole so removal stays O(columns)
+        row = self.rows.pop(name)
+        last = len(self.names) - 1
+        if row != last:
+            moved = self.names[last]
+            self.names[row] = moved
+            self.rows[moved] = row
+            for column in list(self.values.values()) + list(self.codes.values()):
+                column[row] = column[last]
+        self.names.pop()
+        for column in list(self.values.values()) + list(self.codes.values()):
+            column.pop()
+
+
+class Analytics:
+    def __init__(self, device_manager):
+        self.device_manager = device_manager
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.dirty = {device_type: {} for device_type in device_manager.device_classes}
+        self.stale = set(device_manager.device_classes)
+        device_manager.events.subscribe(self.changed)
+
+    def changed(self, events):
+        with self.lock:
+            for event in events:
+                if event.name is None:
+                    # A whole type was reloaded
+                    self.stale.add(event.device_type)
+                else:
+                    self.dirty[event.device_type][event.name] = None
+
+    def table(self, device_type):
+        # Rebuilt after a load, otherwise only rows saved since the last call are refreshed
+        self.device_manager.ensure_loaded(device_type)
+        with self.lock:
+            if device_type in self.stale:
+                self.stale.discard(device_type)
+                self.dirty[device_type] = {}
+                table = Columns(self.device_manager.device_classes[device_type])
+                for device in self.device_manager.snapshot(device_type).values():
+                    table.append(device)
+                self.tables[device_type] = table
+                return table
+            table = self.tables[device_type]
+            dirty, self.dirty[device_type] = self.dirty[device_type], {}
+            devices = self.device_manager.devices[device_type]
+            for name in dirty:
+                device = devices.get(name)
+                row = table.rows.get(name)
+                if device is None:
+                    if row is not None:
+                        table.remove(name)
+                elif row is None:
+                    table.append(device)
+                else:
+                    table.update(row, device)
+            return table
+
+    def aggregate(self, device_type, how='count', value=None, by=None, where=()):
+        # how: count, sum, mean, min or max of column value, optionally grouped by a string column.
+        # where: (column, op, operand) conditions, op one of OPS or 'in'. Returns a number, or
+        # {group: number} for groups that have at least one matching device.
+        with self.lock:
+            table = self.table(device_type)
+            if numpy is not None:
+                return numpy_aggregate(table, how, value, by, where)
+            return python_aggregate(table, how, value, by, where)
+
+    def count(self, device_type, where=(), by=None):
+        return self.aggregate(device_type, 'count', by=by, where=where)
+
+    def mean(self, device_type, value, by=None, where=()):
+        return self.aggregate(device_type, 'mean', value, by, where)
+
+
+def numpy_column(table, column):
+    if not len(table):
+        return numpy.empty(0, dtype=numpy.float64 if column in table.values else numpy.intc)
+    if column in table.values:
+        return numpy.frombuffer(table.values[column], dtype=numpy.float64, count=len(table))
+    return numpy.frombuffer(table.codes[column], dtype=numpy.intc, count=len(table))
+
+
+def numpy_mask(table, where):
+    mask = numpy.ones(len(table), dtype=bool)
+    for column, op, operand in where:
+        data = numpy_column(table, column)
+        if column in table.codes:
+            known = table.category_codes[column]
+            if op == 'in':
+                mask &= numpy.isin(data, [known[item] for item in operand if item in known])
+            elif operand in known:
+                mask &= OPS[op](data, known[operand])
+            else:
+                mask &= op == '!='
+        elif op == 'in':
+            mask &= numpy.isin(data, list(operand))
+        else:
+            mask &= OPS[op](data, operand)
+    return mask
+
+
+def numpy_aggregate(table, how, value, by, where):
+    mask = numpy_mask(table, where)
+    values = numpy_column(table, value)[mask] if value is not None else None
+    if by is None:
+        count = int(mask.sum())
+        if how == 'count':
+            return count
+        if count == 0:
+            return None
+        return float({'sum': numpy.sum, 'mean': numpy.mean, 'min': numpy.min, 'max': numpy.max}[how](values))
+    groups = numpy_column(table, by)[mask]
+    size = len(table.categories[by])
+    counts = numpy.bincount(groups, minlength=size)
+    if how == 'count':
+        result = counts
+    elif how in ('sum', 'mean'):
+        result = numpy.bincount(groups, weights=values, minlength=size)
+        if how == 'mean':
+            result = result / numpy.maximum(counts, 1)
+    else:
+        result = numpy.full(size, numpy.inf if how == 'min' else -numpy.inf)
+        (numpy.minimum if how == 'min' else numpy.maximum).at(result, groups, values)
+    return {table.categories[by][code]: (int(result[code]) if how == 'count' else float(result[code]))
+            for code in numpy.nonzero(counts)[0]}
+
+
+def python_aggregate(table, how, value, by, where):
+    tests = []
+    for column, op, operand in where:
+        if column in table.codes:
+            data, known = table.codes[column], table.category_codes[column]
+            if op == 'in':
+                wanted = {known[item] for item in operand if item in known}
+                tests.append(lambda row, data=data, wanted=wanted: data[row] in wanted)
+            elif operand in known:
+                tests.append(lambda row, data=data, test=OPS[op], code=known[operand]: test(data[row], code))
+            else:
+                tests.append(lambda row, result=op == '!=': result)
+        elif op == 'in':
+            tests.append(lambda row, data=table.values[column], wanted=set(operand): data[row] in wanted)
+        else:
+            tests.append(lambda row, data=table.values[column], test=OPS[op], operand=operand:
+                         test(data[row], operand))
+    rows = [row for row in range(len(table)) if all(test(row) for test in tests)]
+    values = table.values[value] if value is not None else None
+    if by is None:
+        if how == 'count':
+            return len(rows)
+        if not rows:
+            return None
+        picked = [values[row] for row in rows]
+        return {'sum': sum, 'min': min, 'max': max, 'mean': lambda items: sum(items) / len(items)}[how](picked)
+    groups = {}
+    codes = table.codes[by]
+    for row in rows:
+        groups.setdefault(codes[row], []).append(values[row] if values is not None else 1)
+    combine = {'count': len, 'sum': sum, 'min': min, 'max': max,
+               'mean': lambda items: sum(items) / len(items)}[how]
+    return {table.categories[by][code]: combine(items) for code, items in groups.items()}
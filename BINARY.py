@@ -0,0 +1,438 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import deque
+from collections.abc import Mapping
+from itertools import compress, islice, repeat
+from DEVICE import VERSIONS, intern
+from JOURNAL import DeviceJournal
+from SCENES import CHOICES
+
+# <type>.bin: header, field spec, then fixed-width slots of [flag, field...]. Enum fields are u8
+# indexes into CHOICES, bools u8, numbers f64, and every other string (name, location, owner,
+# color) a u32 offset into <type>.strings.<generation>, an append-only table of length-prefixed
+# UTF-8. A full rewrite moves to a new generation, so the .bin never points at a half-written table.
+MAGIC = b'SHDV'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIH')  # magic, version, slot size, capacity, strings generation, spec length
+LENGTH = struct.Struct('<I')
+SLOT_NAME = struct.Struct('<BI')
+FREE, LIVE = 0, 1
+NONE = 0xFFFFFFFF
+
+
+def enum_code(field, value):
+    try:
+        return CHOICES[field].index(value)
+    except ValueError:
+        raise ValueError(f"{field} {value!r} is not one of {', '.join(CHOICES[field])}; "
+                         f"the binary format can only store those") from None
+
+
+def layout(device_class):
+    sample = device_class('', '', None).to_dict()
+    fields = []
+    for key, value in sample.items():
+        if key in CHOICES:
+            fields.append((key, 'B'))
+        elif isinstance(value, bool):
+            fields.append((key, '?'))
+        elif isinstance(value, (int, float)):
+            fields.append((key, 'd'))
+        else:
+            fields.append((key, 'I'))
+    return fields
+
+
+class StringTable:
+    # Strings are decoded when a record refers to them; the reverse index that lets writes reuse
+    # an existing string is only built on the first write
+    def __init__(self, path):
+        self.path = path
+        self.data = b''
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.data = f.read()
+        self.values = {NONE: None}
+        self.refs = None
+        self.size = len(self.data)
+        self.file = None
+
+    def get(self, ref):
+        value = self.values.get(ref)
+        if value is None and ref != NONE:
+            length, = LENGTH.unpack_from(self.data, ref)
+            start = ref + LENGTH.size
+            value = self.values[ref] = self.data[start:start + length].decode()
+        return value
+
+    def index(self):
+        self.refs = {}
+        self.size = 0
+        while self.size + LENGTH.size <= len(self.data):
+            length, = LENGTH.unpack_from(self.data, self.size)
+            end = self.size + LENGTH.size + length
+            if end > len(self.data):
+                break
+            self.refs[self.get(self.size)] = self.size
+            self.size = end
+        self.data = self.data[:self.size]
+        self.file = open(self.path, 'ab')
+        # Drop a torn tail left by a crash mid-append
+        self.file.truncate(self.size)
+
+    def ref(self, value):
+        if value is None:
+            return NONE
+        if self.refs is None:
+            self.index()
+        ref = self.refs.get(value)
+        if ref is None:
+            encoded = value.encode()
+            self.file.write(LENGTH.pack(len(encoded)) + encoded)
+            # On disk before any slot refers to it
+            self.file.flush()
+            ref = self.refs[value] = self.size
+            self.values[ref] = value
+            self.size += LENGTH.size + len(encoded)
+        return ref
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class RecordView(Mapping):
+    # name -> record dict, decoded from the mapped file only when a record is read
+    def __init__(self, device_file):
+        self.device_file = device_file
+        self.names = list(device_file.slots)
+
+    def __getitem__(self, name):
+        record = self.device_file.get(name)
+        if record is None:
+            raise KeyError(name)
+        return record
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def items(self):
+        # Loading a whole type decodes every record in one pass
+        return self.device_file.decode_all(self.names)
+
+
+class DeviceFile:
+    def __init__(self, path, device_class):
+        self.path = path
+        self.fields = layout(device_class)
+        self.record = struct.Struct('<B' + ''.join(code for field, code in self.fields))
+        self.slot_name = struct.Struct(f'{SLOT_NAME.format}{self.record.size - SLOT_NAME.size}x')
+        # The choices are part of the spec: enum codes are positions in them, so a file written
+        # against a different list must not open
+        spec = [[field, code, CHOICES[field]] if code == 'B' else [field, code] for field, code in self.fields]
+        self.spec = json.dumps(spec, separators=(',', ':')).encode()
+        self.lock = threading.Lock()
+        if not os.path.exists(path):
+            self.create(path, 0, 0)
+        self.open()
+
+    def strings_path(self, generation):
+        return f'{os.path.splitext(self.path)[0]}.strings.{generation}'
+
+    def create(self, path, capacity, generation):
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.record.size, capacity, generation, len(self.spec)))
+            f.write(self.spec)
+            f.truncate(HEADER.size + len(self.spec) + capacity * self.record.size)
+
+    def open(self):
+        self.file = open(self.path, 'r+b')
+        magic, version, size, self.capacity, self.generation, spec_length = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} device file")
+        if size != self.record.size or self.file.read(spec_length) != self.spec:
+            raise ValueError(f"{self.path} was written with a different record layout; re-import it from JSON")
+        self.start = HEADER.size + spec_length
+        self.strings = StringTable(self.strings_path(self.generation))
+        self.mm = mmap.mmap(self.file.fileno(), 0) if self.capacity else None
+        self.decoders = [self.decoder(field, code) for field, code in self.fields]
+        # Only each slot's flag and name are read up front; records decode on access
+        self.slots = {}
+        self.free = []
+        if self.mm is not None:
+            end = self.start + self.capacity * self.record.size
+            for slot, (flag, name) in enumerate(self.slot_name.iter_unpack(memoryview(self.mm)[self.start:end])):
+                if flag == LIVE:
+                    self.slots[self.strings.get(name)] = slot
+                else:
+                    self.free.append(slot)
+            self.free.reverse()
+
+    def decoder(self, field, code):
+        if code == 'B':
+            return CHOICES[field].__getitem__
+        if code == 'd':
+            return lambda value: int(value) if value.is_integer() else value
+        if code == 'I':
+            return self.strings.get
+        return None
+
+    def encode(self, data):
+        values = [LIVE]
+        for field, code in self.fields:
+            value = data.get(field)
+            if code == 'B':
+                values.append(enum_code(field, value))
+            elif code == '?':
+                values.append(bool(value))
+            elif code == 'd':
+                values.append(float(value or 0))
+            else:
+                values.append(self.strings.ref(value))
+        return self.record.pack(*values)
+
+    def decode(self, slot):
+        values = self.record.unpack_from(self.mm, self.start + slot * self.record.size)
+        return {field: value if decode is None else decode(value)
+                for (field, code), decode, value in zip(self.fields, self.decoders, values[1:])}
+
+    def columns(self, names):
+        # Expects self.lock to be held. The live records among names as one column per field;
+        # each decoded column maps its distinct values once rather than decoding every cell
+        if self.mm is None:
+            return [], []
+        wanted = {self.slots[name]: name for name in names if name in self.slots}
+        end = self.start + self.capacity * self.record.size
+        keep = list(map(wanted.__contains__, range(self.capacity)))
+        rows = list(compress(self.record.iter_unpack(memoryview(self.mm)[self.start:end]), keep))
+        if not rows:
+            return [], []
+        names = list(map(wanted.__getitem__, compress(range(self.capacity), keep)))
+        columns = []
+        for (field, code), decode, column in zip(self.fields, self.decoders, list(zip(*rows))[1:]):
+            if field == 'name':
+                # Already known from the slot index
+                column = names
+            elif decode is not None:
+                table = {value: intern(decode(value)) for value in set(column)}
+                column = map(table.__getitem__, column)
+            columns.append(column)
+        return names, columns
+
+    def decode_all(self, names):
+        with self.lock:
+            names, columns = self.columns(names)
+            fields = [field for field, code in self.fields]
+            return list(zip(names, map(dict, map(zip, repeat(fields), zip(*columns)))))
+
+    def devices(self, device_class):
+        # Every device of the type, built straight from the columns: bare instances get a version
+        # and no bus as __init__ would, then each field is set under its to_dict() name (Light.color
+        # through its property) a column at a time, with map(setattr) doing the per-device loop
+        with self.lock:
+            names, columns = self.columns(list(self.slots))
+            new = device_class.__new__
+            devices = [new(device_class) for _ in names]
+            deque(map(setattr, devices, repeat('version'), islice(VERSIONS, len(devices))), 0)
+            deque(map(setattr, devices, repeat('bus'), repeat(None)), 0)
+            for (field, code), column in zip(self.fields, columns):
+                deque(map(setattr, devices, repeat(field), column), 0)
+            return dict(zip(names, devices))
+
+    def grow(self):
+        old = self.capacity
+        self.capacity = max(64, old * 2)
+        if self.mm is not None:
+            self.mm.close()
+        self.file.truncate(self.start + self.capacity * self.record.size)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.record.size, self.capacity, self.generation, len(self.spec)))
+        self.file.flush()
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.free.extend(range(self.capacity - 1, old - 1, -1))
+
+    def write(self, slot, data):
+        offset = self.start + slot * self.record.size
+        self.mm[offset:offset + self.record.size] = self.encode(data)
+
+    def records(self):
+        with self.lock:
+            return RecordView(self)
+
+    def get(self, name):
+        with self.lock:
+            slot = self.slots.get(name)
+            return self.decode(slot) if slot is not None else None
+
+    # put_slot, patch_slot and free_slot expect self.lock to be held
+    def put_slot(self, name, data):
+        # An existing device is overwritten in its slot; a new one takes a free slot
+        slot = self.slots.get(name)
+        if slot is None:
+            if not self.free:
+                self.grow()
+            slot = self.slots[name] = self.free.pop()
+        self.write(slot, {**data, 'name': name})
+
+    def patch_slot(self, name, changes):
+        slot = self.slots.get(name)
+        if slot is not None:
+            self.write(slot, {**self.decode(slot), **changes})
+
+    def free_slot(self, name):
+        slot = self.slots.pop(name, None)
+        if slot is not None:
+            self.mm[self.start + slot * self.record.size] = FREE
+            self.free.append(slot)
+
+    def put(self, name, data):
+        with self.lock:
+            self.put_slot(name, data)
+
+    def patch(self, name, changes):
+        with self.lock:
+            self.patch_slot(name, changes)
+
+    def remove(self, name):
+        with self.lock:
+            self.free_slot(name)
+
+    def write_batch(self, items, removed=(), patches=()):
+        # One lock for the whole batch
+        with self.lock:
+            for name, data in items:
+                self.put_slot(name, data)
+            for name, changes in patches:
+                self.patch_slot(name, changes)
+            for name in removed:
+                self.free_slot(name)
+
+    def rewrite(self, data):
+        # A compact copy with a fresh string table: the table is written first under the next
+        # generation, then the new .bin replaces the old one, then the old table is dropped
+        with self.lock:
+            generation = self.generation + 1
+            tmp_path = self.path + '.tmp'
+            self.create(tmp_path, len(data), generation)
+            if os.path.exists(self.strings_path(generation)):
+                os.remove(self.strings_path(generation))
+            strings = StringTable(self.strings_path(generation))
+            current = self.strings
+            self.strings = strings
+            try:
+                with open(tmp_path, 'r+b') as f:
+                    f.seek(self.start)
+                    f.write(b''.join(self.encode({**record, 'name': name}) for name, record in data.items()))
+            except Exception:
+                # The current file and table are untouched; drop the half-built copy
+                strings.close()
+                os.remove(tmp_path)
+                os.remove(self.strings_path(generation))
+                raise
+            finally:
+                self.strings = current
+                strings.close()
+            self.close_files()
+            os.replace(tmp_path, self.path)
+            old_strings = self.strings_path(generation - 1)
+            if os.path.exists(old_strings):
+                os.remove(old_strings)
+            self.open()
+            return os.path.getsize(self.path) + self.strings.size
+
+    def close_files(self):
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+        self.strings.close()
+
+    def close(self):
+        with self.lock:
+            self.close_files()
+
+
+def import_json(device_classes, directory='data'):
+    # The JSON snapshot plus its journal become the binary files. Every type is read and checked
+    # before any is written, so a value the format can't hold stops the import with nothing changed.
+    os.makedirs(directory, exist_ok=True)
+    journal = DeviceJournal(directory)
+    types = {}
+    try:
+        for device_type, device_class in device_classes.items():
+            try:
+                with open(os.path.join(directory, f'{device_type}.json'), 'r') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = {}
+            journal.replay(device_type, data)
+            # Through the class, as the manager would load it, so missing fields get their defaults
+            data = {name: device_class.from_dict({**record, 'name': name}).to_dict() for name, record in data.items()}
+            for name, record in data.items():
+                for field, code in layout(device_class):
+                    if code == 'B':
+                        try:
+                            enum_code(field, record[field])
+                        except ValueError as e:
+                            raise ValueError(f"{device_type} {name}: {e}") from None
+            types[device_type] = data
+    finally:
+        journal.close()
+    counts = {}
+    for device_type, data in types.items():
+        path = os.path.join(directory, f'{device_type}.bin')
+        try:
+            device_file = DeviceFile(path, device_classes[device_type])
+        except ValueError:
+            # Written with another layout or other choices; the JSON is the source, so start over
+            for name in os.listdir(directory):
+                if name == f'{device_type}.bin' or name.startswith(f'{device_type}.strings.'):
+                    os.remove(os.path.join(directory, name))
+            device_file = DeviceFile(path, device_classes[device_type])
+        device_file.rewrite(data)
+        device_file.close()
+        counts[device_type] = len(data)
+    return counts
+
+
+def export_json(device_classes, directory='data'):
+    # Writes the classic snapshots; their journals are older than the binary state, so they go
+    counts = {}
+    for device_type, device_class in device_classes.items():
+        device_file = DeviceFile(os.path.join(directory, f'{device_type}.bin'), device_class)
+        data = dict(device_file.records())
+        device_file.close()
+        filepath = os.path.join(directory, f'{device_type}.json')
+        with open(filepath + '.tmp', 'w') as f:
+            json.dump(data, f, indent=4)
+        os.replace(filepath + '.tmp', filepath)
+        for suffix in ('.log', '.log.1'):
+            path = os.path.join(directory, f'{device_type}{suffix}')
+            if os.path.exists(path):
+                os.remove(path)
+        counts[device_type] = len(data)
+    return counts
+
+
+if __name__ == '__main__':
+    from MANAGER import DeviceManager
+    parser = argparse.ArgumentParser(description="Convert device data between JSON and the binary format")
+    parser.add_argument('command', choices=['import', 'export'],
+                        help="import: JSON to binary (before --storage binary); export: binary back to JSON")
+    parser.add_argument('--directory', default='data')
+    args = parser.parse_args()
+    convert = import_json if args.command == 'import' else export_json
+    try:
+        counts = convert(DeviceManager.DEVICE_CLASSES, args.directory)
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    for device_type, count in counts.items():
+        print(f"{args.command.title()}ed {count} {device_type}")
@@ -1,16 +1,25 @@
-from DEVICE import Device
+from DEVICE import Device, intern
+
+RESOLUTIONS = ('720p', '1080p', '4K')
+
 
 class SecurityCamera(Device):
+    __slots__ = ('recording', 'resolution')
+
     def __init__(self, name, location, owner):
         super().__init__(name, location, owner)
         self.recording = False
         self.resolution = '1080p'
 
     def toggle_recording(self, status):
+        old = self.recording
         self.recording = status
+        self.changed('recording', old, status)
 
     def set_resolution(self, resolution):
-        self.resolution = resolution
+        old = self.resolution
+        self.resolution = intern(resolution)
+        self.changed('resolution', old, self.resolution)
 
     def to_dict(self):
         data = super().to_dict()
@@ -24,5 +33,5 @@ class SecurityCamera(Device):
     def from_dict(cls, data):
         camera = super().from_dict(data)
         camera.recording = data.get('recording', False)
-        camera.resolution = data.get('resolution', '1080p')
+        camera.resolution = intern(data.get('resolution', '1080p'))
         return camera
\ No newline at end of file
@@ -1,12 +1,42 @@
+import itertools
+import sys
+
+STATUSES = ('on', 'off')
+
+# One counter for every device, so a recreated device never reuses an old version number
+VERSIONS = itertools.count(1)
+
+
+def intern(value):
+    # Locations, owners and enum-like values repeat across a fleet, so every device shares one copy
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class Device:
+    __slots__ = ('name', 'location', 'status', 'owner', 'version', 'bus')
+
     def __init__(self, name, location, owner):
         self.name = name
-        self.location = location
+        self.location = intern(location)
         self.status = 'off'
-        self.owner = owner
+        self.owner = intern(owner)
+        self.version = next(VERSIONS)
+        # The owning DeviceManager's EventBus, set when the device is indexed
+        self.bus = None
+
+    def touch(self):
+        self.version = next(VERSIONS)
+
+    def changed(self, attribute, old, new):
+        # Every setter ends here, with the attribute as to_dict() names it
+        self.touch()
+        if self.bus is not None and old != new:
+            self.bus.publish(self, attribute, old, new)
 
     def toggle_power(self, status):
+        old = self.status
         self.status = 'on' if status else 'off'
+        self.changed('status', old, self.status)
         return True
 
     def to_dict(self):
@@ -20,5 +50,5 @@ class Device:
     @classmethod
     def from_dict(cls, data):
         device = cls(data['name'], data.get('location', 'Unknown'),data.get('owner'))
-        device.status = data.get('status', 'off')
+        device.status = 'on' if data.get('status', 'off') == 'on' else 'off'
         return device
\ No newline at end of file
@@ -0,0 +1,45 @@
+class Coalescer:
+    # Collapses rapid updates to the same key (e.g. one device attribute during a slider drag)
+    # into one applied update per interval. schedule(ms, callback) is root.after in the UI.
+    def __init__(self, schedule, interval=16):
+        self.schedule = schedule
+        self.interval = interval
+        self.pending = {}
+        self.scheduled = set()
+        self.applied = 0
+        self.coalesced = 0
+
+    def submit(self, key, apply, interval=None):
+        interval = self.interval if interval is None else interval
+        if not interval:
+            self.pending.pop(key, None)
+            self.run(apply)
+            return
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = (apply, interval)
+        if interval not in self.scheduled:
+            self.scheduled.add(interval)
+            self.schedule(interval, lambda: self.flush(interval))
+
+    def run(self, apply):
+        self.applied += 1
+        apply()
+
+    def flush(self, interval=None):
+        if interval is not None:
+            self.scheduled.discard(interval)
+        due = [key for key, (apply, key_interval) in self.pending.items()
+               if interval is None or key_interval == interval]
+        for key in due:
+            apply, key_interval = self.pending.pop(key)
+            self.run(apply)
+
+    def commit(self, key=None):
+        # Applies what is pending right away, e.g. when the slider is released
+        if key is None:
+            self.flush()
+            return
+        entry = self.pending.pop(key, None)
+        if entry is not None:
+            self.run(entry[0])
@@ -0,0 +1,88 @@
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Attribute names and values are the ones to_dict() uses, so a delta can be applied to a stored record.
+# Adding or removing a device is an event with attribute None and new set to ADDED or REMOVED;
+# reloading a whole type from storage is one with name None as well and new set to LOADED.
+# source names the automation that made the change, e.g. 'rule night-fan'; None is a direct change.
+ChangeEvent = namedtuple('ChangeEvent', ['device_type', 'name', 'attribute', 'old', 'new', 'version', 'source'],
+                         defaults=[None])
+ADDED = 'added'
+REMOVED = 'removed'
+LOADED = 'loaded'
+
+
+def deltas(events):
+    # {device_type: {name: {attribute: newest value}}}, or None for a device added or removed
+    # since the last flush. Later events win, so a burst collapses to one entry per attribute.
+    result = {}
+    for event in events:
+        if event.name is None:
+            continue
+        devices = result.setdefault(event.device_type, {})
+        if event.attribute is None:
+            devices[event.name] = None
+            continue
+        changes = devices.setdefault(event.name, {})
+        if changes is not None:
+            changes[event.attribute] = event.new
+    return result
+
+
+class EventBus:
+    def __init__(self, device_classes, error_handler=print):
+        self.types = {device_class: device_type for device_type, device_class in device_classes.items()}
+        self.error_handler = error_handler
+        self.subscribers = []
+        # Events wait per thread, like batches, until that thread's next commit point flushes them
+        self.state = threading.local()
+        self.stats = {'published': 0, 'flushes': 0}
+
+    def subscribe(self, callback):
+        # callback(events) is called once per flush with every event since the last one
+        self.subscribers = self.subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        self.subscribers = [subscriber for subscriber in self.subscribers if subscriber != callback]
+
+    @contextmanager
+    def source(self, name):
+        # Events published on this thread inside the block carry name as their source
+        previous = getattr(self.state, 'source', None)
+        self.state.source = name
+        try:
+            yield
+        finally:
+            self.state.source = previous
+
+    def publish(self, device, attribute, old, new):
+        pending = getattr(self.state, 'pending', None)
+        if pending is None:
+            pending = self.state.pending = []
+        pending.append(ChangeEvent(self.types[type(device)], device.name, attribute, old, new, device.version,
+                                   getattr(self.state, 'source', None)))
+
+    def pending(self):
+        return getattr(self.state, 'pending', None) or []
+
+    def flush(self):
+        events = getattr(self.state, 'pending', None)
+        if not events:
+            return []
+        self.state.pending = []
+        self.stats['published'] += len(events)
+        self.stats['flushes'] += 1
+        self.deliver(events)
+        return events
+
+    def announce(self, event):
+        # Delivered now rather than at this thread's next commit, which may be in the middle of a batch
+        self.deliver([event])
+
+    def deliver(self, events):
+        for callback in self.subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                self.error_handler(f"Change subscriber failed: {str(e)}")
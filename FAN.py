@@ -2,12 +2,16 @@ from DEVICE import Device
 
 
 class Fan(Device):
+    __slots__ = ('speed',)
+
     def __init__(self, name, location, owner):
         super().__init__(name, location, owner)
         self.speed = 0
 
     def set_speed(self, speed):
+        old = self.speed
         self.speed = speed
+        self.changed('speed', old, speed)
 
     def to_dict(self):
         data = super().to_dict()
@@ -1,16 +1,44 @@
 from DEVICE import Device
 
+
+def pack_color(color):
+    value = color.lstrip('#')
+    if len(value) == 3:
+        value = ''.join(c * 2 for c in value)
+    if len(value) != 6:
+        raise ValueError(f"Invalid color: {color}")
+    return int(value, 16)
+
+
+def unpack_color(rgb):
+    return f'#{rgb:06X}'
+
+
 class Light(Device):
+    __slots__ = ('brightness', 'rgb')
+
     def __init__(self, name, location, owner):
         super().__init__(name, location, owner)
         self.brightness = 100
-        self.color = '#FFFFFF'
+        self.rgb = 0xFFFFFF
+
+    @property
+    def color(self):
+        return unpack_color(self.rgb)
+
+    @color.setter
+    def color(self, color):
+        self.rgb = pack_color(color)
 
     def set_brightness(self, brightness):
+        old = self.brightness
         self.brightness = brightness
+        self.changed('brightness', old, brightness)
 
     def set_color(self, color):
+        old = self.color
         self.color = color
+        self.changed('color', old, self.color)
 
     def to_dict(self):
         data = super().to_dict()
@@ -0,0 +1,73 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    # Writer-preferring, and re-entrant per thread: a thread holding the write lock may take it
+    # again or read, and a thread already reading is never queued behind a waiting writer
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.writer_depth = 0
+        self.writers_waiting = 0
+        self.local = threading.local()
+
+    def read_depth(self):
+        return getattr(self.local, 'depth', 0)
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        depth = self.read_depth()
+        with self.condition:
+            if self.writer != me and depth == 0:
+                while self.writer is not None or self.writers_waiting:
+                    self.condition.wait()
+            self.readers += 1
+        self.local.depth = depth + 1
+
+    def release_read(self):
+        self.local.depth = self.read_depth() - 1
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.writer_depth += 1
+                return
+            # Upgrading from a read would deadlock against another upgrading reader
+            if self.read_depth():
+                raise RuntimeError("cannot take the write lock while holding the read lock")
+            self.writers_waiting += 1
+            while self.writer is not None or self.readers:
+                self.condition.wait()
+            self.writers_waiting -= 1
+            self.writer = me
+            self.writer_depth = 1
+
+    def release_write(self):
+        with self.condition:
+            self.writer_depth -= 1
+            if self.writer_depth == 0:
+                self.writer = None
+                self.condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -0,0 +1,349 @@
+import threading
+import time
+from contextlib import contextmanager
+from LIGHT import Light
+from THERMOSTAT import Thermostat
+from CAMERA import SecurityCamera
+from FAN import Fan
+from LOCKS import ReadWriteLock
+from METRICS import timed
+from EVENTS import ChangeEvent, EventBus, ADDED, LOADED, REMOVED, deltas
+from PERSISTENCE import WriteBehindFlusher
+from STORAGE import JsonBackend
+from SCENES import SceneStore
+from TABLE import DeviceTable
+
+
+class DeviceManager:
+    DEVICE_CLASSES = {
+        'lights': Light,
+        'thermostat': Thermostat,
+        'security_camera': SecurityCamera,
+        'fan': Fan,
+    }
+
+    def __init__(self, write_behind=False, flush_interval=1.0, flush_threshold=50,
+                 journal=False, compact_threshold=1000, storage=None, error_handler=None, lazy=False,
+                 telemetry=None, tables=False):
+        self.device_classes = dict(self.DEVICE_CLASSES)
+        # With tables=True each type's devices live in an array-backed DeviceTable (TABLE.py)
+        # instead of a dict of objects; lookups hand out views onto its rows
+        self.tables = tables
+        # Typed per-attribute ChangeEvents from device setters, delivered at each commit point:
+        # once per save outside a batch, once per outermost batch inside one. Rules, analytics,
+        # telemetry and the UI all listen here.
+        self.events = EventBus(self.device_classes, lambda message: self.report_error(message))
+        self.devices = {device_type: self.empty(device_type) for device_type in self.device_classes}
+        # Secondary indexes: dicts used as insertion-ordered sets of device names
+        self.owner_index = {device_type: {} for device_type in self.devices}
+        self.location_index = {device_type: {} for device_type in self.devices}
+        self.owner_location_index = {device_type: {} for device_type in self.devices}
+        # One reader/writer lock per type guards its device dict and indexes. versions counts
+        # structural changes so snapshot() can hand out a cached copy until the next add/remove.
+        self.locks = {device_type: ReadWriteLock() for device_type in self.devices}
+        self.versions = {device_type: 0 for device_type in self.devices}
+        self.snapshots = {}
+        # Called with a message when a save or load fails; the UI shows a dialog, the server reports it
+        self.error_handler = error_handler
+        # Optional TelemetryStore; each committed device state is appended to its history
+        self.telemetry = telemetry
+        if telemetry is not None:
+            self.events.subscribe(self.record_telemetry)
+        # Devices whose changes were flushed without a save; their next save writes a whole record
+        self.unsaved = {device_type: set() for device_type in self.devices}
+        self.flusher = None
+        # With lazy=True a type's devices are read from storage the first time anything touches it
+        self.loaded = set()
+        self.load_lock = threading.Lock()
+        self.load_times = {}
+        self.batch_state = threading.local()
+        self.scenes = SceneStore('data')
+        self.storage = storage or JsonBackend('data', journal=journal, compact_threshold=compact_threshold)
+        self.initialize_storage()
+        if not lazy:
+            self.load_devices()
+        if write_behind:
+            self.flusher = WriteBehindFlusher(self.write_devices, flush_interval, flush_threshold,
+                                              lambda message: self.report_error(message))
+
+    def report_error(self, message):
+        if self.error_handler:
+            self.error_handler(message)
+        else:
+            print(message)
+
+    def record_telemetry(self, events):
+        # One sample per changed or added device per commit; the store keeps only values that moved
+        changed = {(event.device_type, event.name): None for event in events
+                   if event.name is not None and event.new != REMOVED}
+        for device_type, name in changed:
+            device = self.devices[device_type].get(name)
+            if device is not None:
+                self.telemetry.record_device(device_type, device)
+
+    def empty(self, device_type):
+        if not self.tables:
+            return {}
+        table = DeviceTable(self.device_classes[device_type])
+        table.bus = self.events
+        # Views publish their changes like the devices they stand in for
+        self.events.types[table.view_class] = device_type
+        return table
+
+    def initialize_storage(self):
+        self.storage.initialize(self.device_classes)
+
+    def index_device(self, device_type, device):
+        name = device.name
+        device.bus = self.events
+        self.owner_index[device_type].setdefault(device.owner, {})[name] = None
+        self.location_index[device_type].setdefault(device.location, {})[name] = None
+        self.owner_location_index[device_type].setdefault((device.owner, device.location), {})[name] = None
+
+    def unindex_device(self, device_type, device):
+        name = device.name
+        for index, key in ((self.owner_index[device_type], device.owner),
+                           (self.location_index[device_type], device.location),
+                           (self.owner_location_index[device_type], (device.owner, device.location))):
+            names = index.get(key)
+            if names is not None:
+                names.pop(name, None)
+                if not names:
+                    del index[key]
+
+    def rebuild_indexes(self, device_type):
+        self.owner_index[device_type] = {}
+        self.location_index[device_type] = {}
+        self.owner_location_index[device_type] = {}
+        for device in self.devices[device_type].values():
+            self.index_device(device_type, device)
+
+    @timed('manager.remove_device')
+    def remove_device(self, device_type, name):
+        self.ensure_loaded(device_type)
+        with self.locks[device_type].write():
+            device = self.devices[device_type].pop(name, None)
+            if device is None:
+                return False
+            self.unindex_device(device_type, device)
+            self.versions[device_type] += 1
+        self.events.publish(device, None, None, REMOVED)
+        self.save_device(device_type, name)
+        return True
+
+    @timed('manager.get_device')
+    def get_device(self, device_type, name, username):
+        self.ensure_loaded(device_type)
+        with self.locks[device_type].read():
+            if name in self.owner_index[device_type].get(username, ()):
+                return self.devices[device_type].get(name)
+        return None
+
+    @timed('manager.add_device')
+    def add_device(self, device_type, name, location, owner):
+        device_class = self.device_classes[device_type]
+        device = device_class(name, location, owner)
+        self.ensure_loaded(device_type)
+        with self.locks[device_type].write():
+            existing = self.devices[device_type].get(name)
+            if existing is not None:
+                self.unindex_device(device_type, existing)
+            self.devices[device_type][name] = device
+            self.index_device(device_type, device)
+            self.versions[device_type] += 1
+        self.events.publish(device, None, None, ADDED)
+        self.save_device(device_type, name)
+
+    def lookup(self, device_type, index, key):
+        self.ensure_loaded(device_type)
+        with self.locks[device_type].read():
+            devices = self.devices[device_type]
+            return {name: devices[name] for name in index[device_type].get(key, ())}
+
+    @timed('manager.get_user_devices')
+    def get_user_devices(self, device_type, username):
+        return self.lookup(device_type, self.owner_index, username)
+
+    @timed('manager.get_devices_by_location')
+    def get_devices_by_location(self, device_type, location):
+        return self.lookup(device_type, self.location_index, location)
+
+    @timed('manager.get_user_devices_by_location')
+    def get_user_devices_by_location(self, device_type, username, location):
+        return self.lookup(device_type, self.owner_location_index, (username, location))
+
+    @timed('manager.snapshot')
+    def snapshot(self, device_type):
+        # A private copy of the type's devices; callers may iterate it while others add and remove
+        self.ensure_loaded(device_type)
+        version = self.versions[device_type]
+        cached = self.snapshots.get(device_type)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self.locks[device_type].read():
+            version = self.versions[device_type]
+            devices = dict(self.devices[device_type])
+        self.snapshots[device_type] = (version, devices)
+        return devices
+
+    def batch_pending(self):
+        return getattr(self.batch_state, 'pending', None)
+
+    def pend(self, device_type, name):
+        names = self.batch_state.pending.setdefault(device_type, {})
+        if names is not None:
+            names[name] = None
+
+    @contextmanager
+    def batch(self):
+        # Saves inside the block are collected and committed with one write per device type.
+        # Batches are per thread, so concurrent callers never commit each other's changes.
+        state = self.batch_state
+        outermost = getattr(state, 'pending', None) is None
+        if outermost:
+            state.pending = {}
+        try:
+            yield self
+        finally:
+            if outermost:
+                pending, state.pending = state.pending, None
+                self.commit_batch(pending)
+
+    @timed('manager.commit_batch')
+    def commit_batch(self, pending):
+        changes = self.take_changes(pending)
+        for device_type, names in pending.items():
+            if not self.storage.incremental or names is None:
+                self.save_devices(device_type)
+            else:
+                self.persist(device_type, names, changes.get(device_type))
+
+    def take_changes(self, pending):
+        # Delivers this thread's change events and returns them as deltas for the saves in pending
+        changes = deltas(self.events.flush())
+        for device_type, devices in changes.items():
+            saved = pending.get(device_type, {})
+            if saved is not None:
+                self.unsaved[device_type].update(name for name in devices if name not in saved)
+        return changes
+
+    @timed('manager.persist')
+    def persist(self, device_type, names, changes=None):
+        # Records are built from the live state and written under the type's write lock, so the
+        # storage sees changes to one device in the same order they were made in memory. Devices
+        # with only attribute changes since the last commit are written as patches of those.
+        self.ensure_loaded(device_type)
+        changes = changes or {}
+        unsaved = self.unsaved[device_type]
+        try:
+            with self.locks[device_type].write():
+                devices = self.devices[device_type]
+                items, removed, patches = [], [], []
+                for name in names:
+                    device = devices.get(name)
+                    if device is None:
+                        removed.append(name)
+                    elif changes.get(name) and name not in unsaved:
+                        patches.append((name, {attribute: getattr(device, attribute) for attribute in changes[name]}))
+                    else:
+                        items.append((name, device.to_dict()))
+                if len(items) + len(removed) + len(patches) == 1:
+                    if items:
+                        self.storage.put(device_type, *items[0])
+                    elif patches:
+                        self.storage.patch(device_type, *patches[0])
+                    else:
+                        self.storage.remove(device_type, removed[0])
+                else:
+                    self.storage.write_batch(device_type, items, removed, patches)
+                unsaved.difference_update(names)
+        except Exception as e:
+            self.report_error(f"Failed to save {device_type}: {str(e)}")
+            return
+        self.maybe_compact(device_type)
+
+    def save_device(self, device_type, name, device=None):
+        # device is the object the caller changed; this manager already holds it, but the sharded
+        # one hands out copies and writes back the one it is given
+        if self.batch_pending() is not None:
+            self.pend(device_type, name)
+        elif self.storage.incremental:
+            self.persist(device_type, (name,), self.take_changes({device_type: {name: None}}).get(device_type))
+        else:
+            self.events.flush()
+            self.save_devices(device_type)
+
+    def apply_scene(self, scene):
+        return scene.apply(self)
+
+    def maybe_compact(self, device_type):
+        if self.storage.needs_compaction(device_type):
+            self.save_devices(device_type)
+
+    @timed('manager.save_devices')
+    def save_devices(self, device_type):
+        pending = self.batch_pending()
+        if pending is not None:
+            # A full save supersedes any per-device records collected so far
+            pending[device_type] = None
+            return
+        if self.flusher:
+            self.flusher.mark_dirty(device_type)
+            return
+        try:
+            self.write_devices(device_type)
+        except Exception as e:
+            self.report_error(f"Failed to save {device_type}: {str(e)}")
+
+    @timed('manager.write_devices')
+    def write_devices(self, device_type):
+        self.ensure_loaded(device_type)
+        self.storage.save_all(device_type, lambda: self.snapshot(device_type))
+
+    def flush(self):
+        if self.flusher:
+            self.flusher.flush()
+
+    def close(self):
+        if self.flusher:
+            self.flusher.close()
+            self.flusher = None
+        self.storage.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+
+    def ensure_loaded(self, device_type):
+        if device_type in self.loaded:
+            return
+        with self.load_lock:
+            if device_type not in self.loaded:
+                self.load_type(device_type)
+
+    def load_devices(self):
+        with self.load_lock:
+            for device_type in self.device_classes:
+                self.load_type(device_type)
+
+    @timed('manager.load_type')
+    def load_type(self, device_type):
+        started = time.perf_counter()
+        device_class = self.device_classes[device_type]
+        try:
+            if self.tables:
+                devices = self.empty(device_type)
+                devices.load(self.storage.load(device_type))
+            else:
+                devices = self.storage.load_devices(device_type, device_class)
+        except FileNotFoundError:
+            devices = self.empty(device_type)
+        except Exception as e:
+            self.report_error(f"Failed to load {device_type}: {str(e)}")
+            devices = None
+        if devices is not None:
+            with self.locks[device_type].write():
+                self.devices[device_type] = devices
+                self.rebuild_indexes(device_type)
+                self.versions[device_type] += 1
+        self.loaded.add(device_type)
+        self.load_times[device_type] = time.perf_counter() - started
+        self.events.announce(ChangeEvent(device_type, None, None, None, LOADED, self.versions[device_type]))
@@ -0,0 +1,154 @@
+import bisect
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Latency bucket upper bounds in milliseconds, 1-2-5 steps from 10µs to 10s
+BUCKETS = [scale * step for scale in (0.01, 0.1, 1, 10, 100, 1000) for step in (1, 2, 5)] + [10000]
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def record(self, milliseconds):
+        self.count += 1
+        self.total += milliseconds
+        if milliseconds > self.max:
+            self.max = milliseconds
+        self.buckets[bisect.bisect_left(BUCKETS, milliseconds)] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of calls
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 4) if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max, 3),
+            'buckets': {f"<={bound}": count for bound, count in zip(BUCKETS + ['inf'], self.buckets) if count},
+        }
+
+
+class Metrics:
+    # Disabled by default: an instrumented call then costs one attribute check
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.profile_armed = False
+        self.profile_directory = 'data'
+        self.last_profile = None
+        self.profiling = threading.local()
+
+    def record(self, name, milliseconds):
+        with self.lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+            histogram.record(milliseconds)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def timed(self, name, profile=False):
+        # profile=True marks a user-facing entry point that "profile next action" may capture
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                if profile and self.profile_armed and not getattr(self.profiling, 'active', False):
+                    return self.run_profiled(name, function, args, kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, (time.perf_counter() - started) * 1000)
+            return wrapper
+        return decorate
+
+    def arm_profile(self):
+        self.profile_armed = True
+
+    def run_profiled(self, name, function, args, kwargs):
+        self.profile_armed = False
+        self.profiling.active = True
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+            self.profiling.active = False
+            self.last_profile = self.save_profile(name, profiler)
+
+    def save_profile(self, name, profiler):
+        os.makedirs(self.profile_directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(self.profile_directory, f"profile_{name}_{stamp}")
+        profiler.dump_stats(path + '.prof')
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(40)
+        with open(path + '.txt', 'w') as f:
+            f.write(text.getvalue())
+        return path + '.txt'
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'taken_at': datetime.now().isoformat(timespec='seconds'),
+                'timers': {name: histogram.to_dict() for name, histogram in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'last_profile': self.last_profile,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=4)
+        return path
+
+
+METRICS = Metrics()
+timed = METRICS.timed
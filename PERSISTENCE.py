@@ -0,0 +1,54 @@
+import threading
+
+
+class WriteBehindFlusher:
+    def __init__(self, write, interval=1.0, threshold=50, error_handler=print):
+        self.write = write
+        self.error_handler = error_handler
+        self.interval = interval
+        self.threshold = threshold
+        self.dirty = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def mark_dirty(self, device_type):
+        with self.lock:
+            self.dirty[device_type] = self.dirty.get(device_type, 0) + 1
+            pending = sum(self.dirty.values())
+        if pending >= self.threshold:
+            self.wake.set()
+
+    def pending(self):
+        with self.lock:
+            return dict(self.dirty)
+
+    def flush(self):
+        # Only one flush at a time, so an explicit flush() never races the background thread
+        with self.flush_lock:
+            with self.lock:
+                device_types = list(self.dirty)
+                self.dirty.clear()
+            for device_type in device_types:
+                try:
+                    self.write(device_type)
+                except Exception as e:
+                    self.error_handler(f"Failed to save {device_type}: {str(e)}")
+                    with self.lock:
+                        self.dirty[device_type] = self.dirty.get(device_type, 0) + 1
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def close(self):
+        if self.running:
+            self.running = False
+            self.wake.set()
+            self.thread.join()
+        self.flush()
@@ -0,0 +1,224 @@
+import csv
+import io
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from LIGHT import Light
+from THERMOSTAT import Thermostat
+from CAMERA import SecurityCamera
+from FAN import Fan
+
+DEVICE_TYPES = {
+    'lights': 'Lights',
+    'thermostat': 'Thermostat',
+    'security_camera': 'Security Camera',
+    'fan': 'Fan'
+}
+
+CSV_FIELDS = ['device_type', 'name', 'location', 'status', 'owner',
+              'brightness', 'color', 'temperature', 'mode', 'recording', 'resolution', 'speed']
+
+
+DETAIL_LINES = {
+    Light: lambda device: [
+        f"Brightness: {device.brightness}%",
+        f"Color: {device.color}"
+    ],
+    Thermostat: lambda device: [
+        f"Temperature: {device.temperature}°F",
+        f"Mode: {device.mode}"
+    ],
+    SecurityCamera: lambda device: [
+        f"Recording: {'Yes' if device.recording else 'No'}",
+        f"Resolution: {device.resolution}"
+    ],
+    Fan: lambda device: [
+        f"Speed: {device.speed}"
+    ],
+}
+
+
+def device_lines(name, device):
+    lines = [
+        f"\nDevice: {name}",
+        f"Location: {device.location}",
+        f"Status: {device.status}"
+    ]
+    details = DETAIL_LINES.get(type(device))
+    if details is None:
+        details = next((render for cls, render in DETAIL_LINES.items() if isinstance(device, cls)), None)
+    if details is not None:
+        lines.extend(details(device))
+    return lines
+
+
+class FragmentCache:
+    # Rendered report text per device, reused while the device's version is unchanged
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rerendered = 0
+        self.evictions = 0
+
+    def render(self, device_type, name, device):
+        key = (device_type, name)
+        version = device.version
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        text = "\n".join(device_lines(name, device))
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.rerendered += 1
+            self.entries[key] = (version, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return text
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'rerendered': self.rerendered,
+                'evictions': self.evictions,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+ANALYTICS_DETAILS = {
+    'lights': lambda analytics, where: [
+        f"average brightness {analytics.mean('lights', 'brightness', where=where):.0f}%"
+    ],
+    'thermostat': lambda analytics, where: [
+        f"average temperature {analytics.mean('thermostat', 'temperature', where=where):.1f}°F",
+        "modes: " + ", ".join(f"{mode} {count}" for mode, count in
+                              sorted(analytics.count('thermostat', where, by='mode').items()))
+    ],
+    'security_camera': lambda analytics, where: [
+        f"{analytics.count('security_camera', where + [('recording', '==', True)])} recording"
+    ],
+    'fan': lambda analytics, where: [
+        f"average speed {analytics.mean('fan', 'speed', where=where):.1f}"
+    ],
+}
+
+
+def analytics_lines(analytics, username):
+    lines = ["\n=== Analytics ==="]
+    mine = [('owner', '==', username)]
+    on_by_location = {}
+    for device_type, display_name in DEVICE_TYPES.items():
+        total = analytics.count(device_type, mine)
+        if not total:
+            continue
+        on = analytics.count(device_type, mine + [('status', '==', 'on')])
+        details = ANALYTICS_DETAILS[device_type](analytics, mine)
+        lines.append(f"{display_name}: {on} of {total} on, " + ", ".join(details))
+        for location, count in analytics.count(device_type, mine + [('status', '==', 'on')], by='location').items():
+            on_by_location[location] = on_by_location.get(location, 0) + count
+    if len(lines) == 1:
+        lines.append("No devices found")
+    elif on_by_location:
+        lines.append("On by location: " + ", ".join(
+            f"{location} {count}" for location, count in sorted(on_by_location.items())))
+    return lines
+
+
+def text_sections(device_manager, username, generated_at=None, chunk_size=200, cache=None, analytics=None):
+    # Yields pieces whose concatenation is the classic report text; large sections are split
+    # every chunk_size devices so neither the caller nor the UI has to hold the whole report
+    generated_at = generated_at or datetime.now()
+    yield "\n".join([
+        "=== Smart Home Status Report ===",
+        f"Generated on: {generated_at.strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Generated by: {username}\n"
+    ])
+    # A sharded manager renders each shard's devices in its own process
+    render = getattr(device_manager, 'render_user_devices', None)
+    for device_type, display_name in DEVICE_TYPES.items():
+        if render is not None:
+            texts = render(device_type, username)
+            empty = not texts
+        else:
+            devices = device_manager.get_user_devices(device_type, username)
+            empty = not devices
+            texts = (cache.render(device_type, name, device) if cache is not None
+                     else "\n".join(device_lines(name, device)) for name, device in devices.items())
+        parts = [f"\n=== {display_name} ==="]
+        if empty:
+            parts.append("No devices found")
+        for text in texts:
+            parts.append(text)
+            if len(parts) >= chunk_size:
+                yield "\n" + "\n".join(parts)
+                parts = []
+        if parts:
+            yield "\n" + "\n".join(parts)
+    if analytics is not None:
+        yield "\n" + "\n".join(analytics_lines(analytics, username))
+
+
+def device_records(device_manager, username):
+    for device_type in DEVICE_TYPES:
+        for device in device_manager.get_user_devices(device_type, username).values():
+            yield {'device_type': device_type, **device.to_dict()}
+
+
+def csv_sections(device_manager, username, generated_at=None, chunk_size=200):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for count, record in enumerate(device_records(device_manager, username), 1):
+        writer.writerow(record)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_sections(device_manager, username, generated_at=None, chunk_size=200):
+    lines = []
+    for record in device_records(device_manager, username):
+        lines.append(json.dumps(record) + "\n")
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+FORMATS = {
+    'text': ('.txt', text_sections),
+    'csv': ('.csv', csv_sections),
+    'jsonl': ('.jsonl', jsonl_sections),
+}
+
+
+def write_report(filepath, report_format, device_manager, username, generated_at=None, cache=None, analytics=None):
+    extension, sections = FORMATS[report_format]
+    options = {'cache': cache, 'analytics': analytics} if report_format == 'text' else {}
+    with open(filepath, 'w', newline='' if report_format == 'csv' else None) as f:
+        for chunk in sections(device_manager, username, generated_at, **options):
+            f.write(chunk)
+    return filepath
+
+
+def report_filename(report_format, generated_at=None):
+    extension = FORMATS[report_format][0]
+    return f"smart_home_report_{(generated_at or datetime.now()).strftime('%Y%m%d_%H%M%S')}{extension}"
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from ANALYTICS import OPS
+from SCENES import SETTERS, validate_change
+
+
+class Rule:
+    # conditions: {'device_type', 'device', 'attribute', 'op', 'value'}, all of which must hold.
+    # actions: {'device_type', 'device', 'attribute', 'value'}, applied as one batch.
+    def __init__(self, name, conditions, actions, owner=None, min_interval=1.0, enabled=True):
+        self.name = name
+        self.conditions = conditions
+        self.actions = actions
+        self.owner = owner
+        self.min_interval = min_interval
+        self.enabled = enabled
+        self.last_fired = None
+
+    def triggers(self):
+        return {(condition['device_type'], condition['device'], condition['attribute'])
+                for condition in self.conditions}
+
+    def validate(self, device_manager):
+        if not self.conditions or not self.actions:
+            raise ValueError("A rule needs at least one condition and one action")
+        for condition in self.conditions:
+            device_class = device_manager.device_classes.get(condition['device_type'])
+            if device_class is None:
+                raise ValueError(f"Unknown device type: {condition['device_type']}")
+            if condition['op'] not in OPS:
+                raise ValueError(f"Unknown operator: {condition['op']}")
+            if condition['attribute'] not in device_class('', '', None).to_dict():
+                raise ValueError(f"{device_class.__name__} has no attribute '{condition['attribute']}'")
+        for action in self.actions:
+            device_class = device_manager.device_classes.get(action['device_type'])
+            if device_class is None:
+                raise ValueError(f"Unknown device type: {action['device_type']}")
+            validate_change(device_class, action['attribute'], action['value'])
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'owner': self.owner,
+            'conditions': self.conditions,
+            'actions': self.actions,
+            'min_interval': self.min_interval,
+            'enabled': self.enabled,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data.get('conditions', []), data.get('actions', []), data.get('owner'),
+                   data.get('min_interval', 1.0), data.get('enabled', True))
+
+
+class RulesEngine:
+    MAX_DEPTH = 8
+
+    def __init__(self, device_manager, directory='data', clock=time.monotonic):
+        self.device_manager = device_manager
+        self.path = os.path.join(directory, 'rules.json') if directory else None
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.rules = {}
+        # (device_type, attribute) -> device name -> {rule name: Rule}; a change only looks at the
+        # rules listening to that device and attribute, however many rules exist
+        self.index = {}
+        self.cascade = threading.local()
+        self.stats = {'changes': 0, 'evaluated': 0, 'fired': 0, 'rate_limited': 0, 'loops_blocked': 0}
+        self.load()
+        # Change events only exist for attributes whose value actually changed, so a save that
+        # leaves a watched attribute alone (or a fresh start) never triggers a rule
+        device_manager.events.subscribe(self.changed)
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        for rule_data in data:
+            self.index_rule(Rule.from_dict(rule_data))
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = [rule.to_dict() for rule in self.rules.values()]
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=4)
+
+    def index_rule(self, rule):
+        with self.lock:
+            self.rules[rule.name] = rule
+            for device_type, name, attribute in rule.triggers():
+                self.index.setdefault((device_type, attribute), {}).setdefault(name, {})[rule.name] = rule
+
+    def add_rule(self, rule, save=True):
+        rule.validate(self.device_manager)
+        with self.lock:
+            if rule.name in self.rules:
+                self.unindex_rule(self.rules[rule.name])
+            self.index_rule(rule)
+        if save:
+            self.save()
+
+    def unindex_rule(self, rule):
+        del self.rules[rule.name]
+        for device_type, name, attribute in rule.triggers():
+            by_device = self.index.get((device_type, attribute), {})
+            listeners = by_device.get(name, {})
+            listeners.pop(rule.name, None)
+            if not listeners:
+                by_device.pop(name, None)
+
+    def remove_rule(self, name):
+        with self.lock:
+            rule = self.rules.get(name)
+            if rule is None:
+                return False
+            self.unindex_rule(rule)
+        self.save()
+        return True
+
+    def changed(self, events):
+        triggered = {}
+        with self.lock:
+            for event in events:
+                # Adds, removes and loads carry no attribute
+                if event.attribute is None:
+                    continue
+                listeners = self.index.get((event.device_type, event.attribute), {}).get(event.name)
+                if listeners:
+                    self.stats['changes'] += 1
+                    triggered.update(listeners)
+        if not triggered:
+            return
+        # Conditions may read other types; load them before taking the lock
+        for other_type in self.device_manager.device_classes:
+            self.device_manager.ensure_loaded(other_type)
+        with self.lock:
+            due = [rule for rule in triggered.values() if rule.enabled and self.holds(rule)]
+        for rule in due:
+            self.fire(rule)
+
+    def holds(self, rule):
+        self.stats['evaluated'] += 1
+        devices = self.device_manager.devices
+        for condition in rule.conditions:
+            device = devices[condition['device_type']].get(condition['device'])
+            if device is None or (rule.owner is not None and device.owner != rule.owner):
+                return False
+            if not OPS[condition['op']](getattr(device, condition['attribute']), condition['value']):
+                return False
+        return True
+
+    def fire(self, rule):
+        # A cascade is one outermost change plus everything rules do in response; a rule fires at
+        # most once per cascade and cascades stop at MAX_DEPTH, so A->B->A loops end
+        cascade = self.cascade
+        depth = getattr(cascade, 'depth', 0)
+        if depth == 0:
+            cascade.fired = set()
+        now = self.clock()
+        with self.lock:
+            if rule.name in cascade.fired or depth >= self.MAX_DEPTH:
+                self.stats['loops_blocked'] += 1
+                return
+            if rule.last_fired is not None and now - rule.last_fired < rule.min_interval:
+                self.stats['rate_limited'] += 1
+                return
+            rule.last_fired = now
+            cascade.fired.add(rule.name)
+            self.stats['fired'] += 1
+        cascade.depth = depth + 1
+        try:
+            with self.device_manager.events.source(f'rule {rule.name}'), self.device_manager.batch():
+                for action in rule.actions:
+                    device = self.device_manager.devices[action['device_type']].get(action['device'])
+                    if device is None or (rule.owner is not None and device.owner != rule.owner):
+                        continue
+                    SETTERS[action['attribute']](device, action['value'])
+                    self.device_manager.save_device(action['device_type'], device.name, device)
+        except Exception as e:
+            self.device_manager.report_error(f"Rule {rule.name} failed: {str(e)}")
+        finally:
+            cascade.depth = depth
@@ -0,0 +1,155 @@
+import json
+import os
+from DEVICE import STATUSES
+from LIGHT import pack_color
+from THERMOSTAT import MODES
+from CAMERA import RESOLUTIONS
+
+# Same ranges the control window sliders allow
+LIMITS = {'brightness': (0, 100), 'temperature': (60, 90), 'speed': (0, 5)}
+CHOICES = {'status': STATUSES, 'mode': MODES, 'resolution': RESOLUTIONS}
+
+SETTERS = {
+    'status': lambda device, value: device.toggle_power(value == 'on'),
+    'brightness': lambda device, value: device.set_brightness(float(value)),
+    'color': lambda device, value: device.set_color(value),
+    'temperature': lambda device, value: device.set_temperature(float(value)),
+    'mode': lambda device, value: device.set_mode(value),
+    'recording': lambda device, value: device.toggle_recording(bool(value)),
+    'resolution': lambda device, value: device.set_resolution(value),
+    'speed': lambda device, value: device.set_speed(float(value)),
+}
+
+
+def scene_attributes(device_class):
+    attributes = device_class('', '', None).to_dict()
+    return [attribute for attribute in attributes if attribute in SETTERS]
+
+
+def validate_change(device_class, attribute, value):
+    if attribute not in scene_attributes(device_class):
+        raise ValueError(f"{device_class.__name__} has no settable attribute '{attribute}'")
+    if attribute in CHOICES and value not in CHOICES[attribute]:
+        raise ValueError(f"Invalid {attribute}: {value}")
+    if attribute in LIMITS:
+        low, high = LIMITS[attribute]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+            raise ValueError(f"{attribute} must be between {low} and {high}")
+    if attribute == 'color':
+        pack_color(value)
+    if attribute == 'recording' and not isinstance(value, bool):
+        raise ValueError("recording must be true or false")
+
+
+def parse_value(attribute, text):
+    text = text.strip()
+    if attribute in LIMITS:
+        return float(text)
+    if attribute == 'recording':
+        return text.lower() in ('1', 'yes', 'true', 'on')
+    return text
+
+
+class Scene:
+    def __init__(self, name, owner=None, actions=None):
+        self.name = name
+        self.owner = owner
+        self.actions = actions or []
+
+    def add_action(self, device_type, changes, location=None, predicate=None):
+        self.actions.append({
+            'device_type': device_type,
+            'location': location,
+            'changes': dict(changes),
+            'predicate': predicate,
+        })
+        return self
+
+    def validate(self, device_manager):
+        for action in self.actions:
+            device_class = device_manager.device_classes.get(action['device_type'])
+            if device_class is None:
+                raise ValueError(f"Unknown device type: {action['device_type']}")
+            for attribute, value in action['changes'].items():
+                validate_change(device_class, attribute, value)
+
+    def select(self, device_manager, action):
+        device_type = action['device_type']
+        if self.owner is not None and action['location'] is not None:
+            devices = device_manager.get_user_devices_by_location(device_type, self.owner, action['location'])
+        elif self.owner is not None:
+            devices = device_manager.get_user_devices(device_type, self.owner)
+        elif action['location'] is not None:
+            devices = device_manager.get_devices_by_location(device_type, action['location'])
+        else:
+            devices = device_manager.snapshot(device_type)
+        predicate = action['predicate']
+        if predicate is not None:
+            devices = {name: device for name, device in devices.items() if predicate(device)}
+        return devices
+
+    def apply(self, device_manager):
+        # Validate everything up front so a bad change never leaves the scene half applied
+        self.validate(device_manager)
+        count = 0
+        with device_manager.batch():
+            for action in self.actions:
+                for name, device in self.select(device_manager, action).items():
+                    for attribute, value in action['changes'].items():
+                        SETTERS[attribute](device, value)
+                    device_manager.save_device(action['device_type'], name, device)
+                    count += 1
+        return count
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'owner': self.owner,
+            'actions': [{key: value for key, value in action.items() if key != 'predicate'}
+                        for action in self.actions],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        scene = cls(data['name'], data.get('owner'))
+        for action in data.get('actions', []):
+            scene.add_action(action['device_type'], action.get('changes', {}), action.get('location'))
+        return scene
+
+
+class SceneStore:
+    def __init__(self, directory='data'):
+        self.path = os.path.join(directory, 'scenes.json')
+        self.scenes = None
+
+    def load(self):
+        if self.scenes is None:
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = {}
+            self.scenes = {owner: {name: Scene.from_dict(scene) for name, scene in scenes.items()}
+                           for owner, scenes in data.items()}
+        return self.scenes
+
+    def save(self):
+        data = {owner: {name: scene.to_dict() for name, scene in scenes.items()}
+                for owner, scenes in self.load().items()}
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=4)
+
+    def user_scenes(self, owner):
+        return self.load().get(owner, {})
+
+    def add(self, scene):
+        self.load().setdefault(scene.owner, {})[scene.name] = scene
+        self.save()
+
+    def remove(self, owner, name):
+        scenes = self.load().get(owner, {})
+        if name in scenes:
+            del scenes[name]
+            self.save()
+            return True
+        return False
@@ -0,0 +1,228 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from SCENES import SETTERS, validate_change
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def parse_time(text):
+    hour, minute = (int(part) for part in text.split(':'))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time: {text}")
+    return hour, minute
+
+
+class Schedule:
+    # Runs at a local time of day ('HH:MM') on the given days (all when None), or every `every` seconds.
+    # actions: {'device_type', 'device', 'attribute', 'value'}, the same shape as rule actions.
+    def __init__(self, name, actions, owner=None, at=None, days=None, every=None, enabled=True):
+        self.name = name
+        self.actions = actions
+        self.owner = owner
+        self.at = at
+        self.days = days
+        self.every = every
+        self.enabled = enabled
+
+    def validate(self, device_manager):
+        if (self.at is None) == (self.every is None):
+            raise ValueError("A schedule needs either a time of day or an interval")
+        if self.at is not None:
+            parse_time(self.at)
+        elif isinstance(self.every, bool) or not isinstance(self.every, (int, float)) or self.every <= 0:
+            raise ValueError("every must be a positive number of seconds")
+        for day in self.days or []:
+            if day not in DAYS:
+                raise ValueError(f"Unknown day: {day}")
+        if not self.actions:
+            raise ValueError("A schedule needs at least one action")
+        for action in self.actions:
+            device_class = device_manager.device_classes.get(action['device_type'])
+            if device_class is None:
+                raise ValueError(f"Unknown device type: {action['device_type']}")
+            validate_change(device_class, action['attribute'], action['value'])
+
+    def next_run(self, now, due=None):
+        if self.every is not None:
+            # Stay on the original cadence, but skip runs missed while the app was closed
+            if due is not None and due + self.every > now:
+                return due + self.every
+            return now + self.every
+        hour, minute = parse_time(self.at)
+        moment = datetime.fromtimestamp(now).replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if moment.timestamp() <= now:
+            moment += timedelta(days=1)
+        for _ in range(7):
+            if not self.days or DAYS[moment.weekday()] in self.days:
+                break
+            moment += timedelta(days=1)
+        return moment.timestamp()
+
+    def describe(self):
+        if self.every is not None:
+            return f"every {self.every:g}s"
+        return f"{self.at} {','.join(self.days) if self.days else 'daily'}"
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'owner': self.owner,
+            'at': self.at,
+            'days': self.days,
+            'every': self.every,
+            'actions': self.actions,
+            'enabled': self.enabled,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data.get('actions', []), data.get('owner'), data.get('at'),
+                   data.get('days'), data.get('every'), data.get('enabled', True))
+
+
+class Scheduler:
+    # Longest sleep, so wall-clock jumps (DST, NTP) are noticed within a minute
+    MAX_WAIT = 60
+
+    def __init__(self, device_manager, directory='data', clock=time.time, start=True):
+        self.device_manager = device_manager
+        self.path = os.path.join(directory, 'schedules.json') if directory else None
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.schedules = {}
+        # Min-heap of (due, sequence, name). Replaced or removed schedules leave stale entries
+        # behind, recognised by sequence and skipped when popped, so every change is O(log n).
+        self.heap = []
+        self.due = {}
+        self.sequence = itertools.count()
+        self.stats = {'ticks': 0, 'fired': 0, 'changes': 0}
+        self.running = False
+        self.thread = None
+        self.load()
+        if start:
+            self.start()
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        now = self.clock()
+        with self.lock:
+            for schedule_data in data:
+                schedule = Schedule.from_dict(schedule_data)
+                self.schedules[schedule.name] = schedule
+                self.push(schedule, schedule.next_run(now))
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = [schedule.to_dict() for schedule in self.schedules.values()]
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=4)
+
+    def push(self, schedule, due):
+        entry = (due, next(self.sequence), schedule.name)
+        self.due[schedule.name] = entry
+        heapq.heappush(self.heap, entry)
+        if len(self.heap) > 2 * len(self.due) + 64:
+            # Mostly stale entries: rebuild from the live ones, amortised O(1) per change
+            self.heap = list(self.due.values())
+            heapq.heapify(self.heap)
+
+    def add(self, schedule, save=True):
+        schedule.validate(self.device_manager)
+        with self.wake:
+            self.schedules[schedule.name] = schedule
+            self.push(schedule, schedule.next_run(self.clock()))
+            self.wake.notify()
+        if save:
+            self.save()
+
+    def remove(self, name):
+        with self.lock:
+            if self.schedules.pop(name, None) is None:
+                return False
+            del self.due[name]
+        self.save()
+        return True
+
+    def next_due(self, name):
+        with self.lock:
+            entry = self.due.get(name)
+            return entry[0] if entry else None
+
+    def user_schedules(self, owner):
+        with self.lock:
+            return {name: schedule for name, schedule in self.schedules.items()
+                    if owner is None or schedule.owner == owner}
+
+    def run_due(self, now=None):
+        # Everything due by now fires together, so a tick with many schedules is one batch
+        now = self.clock() if now is None else now
+        fired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                entry = heapq.heappop(self.heap)
+                if self.due.get(entry[2]) is not entry:
+                    continue
+                schedule = self.schedules[entry[2]]
+                self.push(schedule, schedule.next_run(now, entry[0]))
+                if schedule.enabled:
+                    fired.append(schedule)
+        if fired:
+            self.apply(fired)
+        return len(fired)
+
+    def apply(self, schedules):
+        device_manager = self.device_manager
+        changes = 0
+        with device_manager.batch():
+            for schedule in schedules:
+                for action in schedule.actions:
+                    try:
+                        device_manager.ensure_loaded(action['device_type'])
+                        device = device_manager.devices[action['device_type']].get(action['device'])
+                        if device is None or (schedule.owner is not None and device.owner != schedule.owner):
+                            continue
+                        with device_manager.events.source(f'schedule {schedule.name}'):
+                            SETTERS[action['attribute']](device, action['value'])
+                            device_manager.save_device(action['device_type'], device.name, device)
+                        changes += 1
+                    except Exception as e:
+                        device_manager.report_error(f"Schedule {schedule.name} failed: {str(e)}")
+        with self.lock:
+            self.stats['ticks'] += 1
+            self.stats['fired'] += len(schedules)
+            self.stats['changes'] += changes
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            with self.wake:
+                delay = self.heap[0][0] - self.clock() if self.heap else self.MAX_WAIT
+                if delay > 0:
+                    self.wake.wait(min(delay, self.MAX_WAIT))
+                    continue
+            self.run_due()
+
+    def close(self):
+        if self.running:
+            self.running = False
+            with self.wake:
+                self.wake.notify()
+            self.thread.join()
@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import os
+import signal
+from MANAGER import DeviceManager
+from SCENES import SETTERS, validate_change
+from RULES import Rule, RulesEngine
+from SCHEDULER import Schedule, Scheduler
+from SHARDS import ShardedDeviceManager
+from STORAGE import create_backend
+
+# A client that sends this much without a newline is dropped rather than buffered forever
+MAX_LINE = 1 << 20
+
+
+class RequestError(Exception):
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+def ok(request_id, result=None):
+    return {'id': request_id, 'ok': True, 'result': result}
+
+
+def error(request_id, kind, message):
+    return {'id': request_id, 'ok': False, 'error': {'type': kind, 'message': message}}
+
+
+class ControlServer:
+    def __init__(self, device_manager, rules=None, scheduler=None):
+        self.device_manager = device_manager
+        self.rules = rules
+        self.scheduler = scheduler
+        self.storage_errors = []
+        device_manager.error_handler = self.storage_errors.append
+        # Handlers run here, off the event loop, so a slow save or scene doesn't stall other
+        # connections. One worker keeps reads handled one at a time, as they were on the loop.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='control')
+        self.handlers = {
+            'ping': self.ping,
+            'types': self.types,
+            'add_device': self.add_device,
+            'remove_device': self.remove_device,
+            'get_device': self.get_device,
+            'list_devices': self.list_devices,
+            'update_device': self.update_device,
+            'apply_scene': self.apply_scene,
+            'add_rule': self.add_rule,
+            'remove_rule': self.remove_rule,
+            'list_rules': self.list_rules,
+            'add_schedule': self.add_schedule,
+            'remove_schedule': self.remove_schedule,
+            'list_schedules': self.list_schedules,
+            'flush': self.flush,
+            'batch': self.batch,
+        }
+
+    def require(self, args, *names):
+        missing = [name for name in names if args.get(name) in (None, '')]
+        if missing:
+            raise RequestError('bad_request', f"Missing fields: {', '.join(missing)}")
+        return [args[name] for name in names]
+
+    def device_type(self, args):
+        device_type, = self.require(args, 'type')
+        if device_type not in self.device_manager.device_classes:
+            raise RequestError('bad_request', f"Unknown device type: {device_type}")
+        self.device_manager.ensure_loaded(device_type)
+        return device_type
+
+    def owned_device(self, args):
+        device_type = self.device_type(args)
+        name, = self.require(args, 'name')
+        if args.get('owner') is not None:
+            device = self.device_manager.get_device(device_type, name, args['owner'])
+        else:
+            device = self.device_manager.devices[device_type].get(name)
+        if device is None:
+            raise RequestError('not_found', f"No {device_type} named {name}")
+        return device_type, device
+
+    def ping(self, args):
+        return 'pong'
+
+    def types(self, args):
+        return list(self.device_manager.device_classes)
+
+    def add_device(self, args):
+        device_type = self.device_type(args)
+        name, location, owner = self.require(args, 'name', 'location', 'owner')
+        if name in self.device_manager.devices[device_type] and not args.get('replace'):
+            raise RequestError('conflict', f"{device_type} {name} already exists")
+        self.device_manager.add_device(device_type, name, location, owner)
+        return self.device_manager.devices[device_type][name].to_dict()
+
+    def remove_device(self, args):
+        device_type, device = self.owned_device(args)
+        return self.device_manager.remove_device(device_type, device.name)
+
+    def get_device(self, args):
+        device_type, device = self.owned_device(args)
+        return device.to_dict()
+
+    def list_devices(self, args):
+        device_type = self.device_type(args)
+        owner, location = args.get('owner'), args.get('location')
+        if owner is not None and location is not None:
+            devices = self.device_manager.get_user_devices_by_location(device_type, owner, location)
+        elif owner is not None:
+            devices = self.device_manager.get_user_devices(device_type, owner)
+        elif location is not None:
+            devices = self.device_manager.get_devices_by_location(device_type, location)
+        else:
+            devices = self.device_manager.snapshot(device_type)
+        return [device.to_dict() for device in devices.values()]
+
+    def update_device(self, args):
+        device_type, device = self.owned_device(args)
+        changes, = self.require(args, 'changes')
+        if not isinstance(changes, dict):
+            raise RequestError('bad_request', "changes must be an object")
+        try:
+            for attribute, value in changes.items():
+                validate_change(self.device_manager.device_classes[device_type], attribute, value)
+        except ValueError as e:
+            raise RequestError('invalid', str(e))
+        for attribute, value in changes.items():
+            SETTERS[attribute](device, value)
+        self.device_manager.save_device(device_type, device.name, device)
+        return device.to_dict()
+
+    def apply_scene(self, args):
+        owner, name = self.require(args, 'owner', 'name')
+        scene = self.device_manager.scenes.user_scenes(owner).get(name)
+        if scene is None:
+            raise RequestError('not_found', f"No scene named {name}")
+        try:
+            return self.device_manager.apply_scene(scene)
+        except ValueError as e:
+            raise RequestError('invalid', str(e))
+
+    def rules_engine(self):
+        if self.rules is None:
+            raise RequestError('unavailable', "Rules are not enabled on this server")
+        return self.rules
+
+    def add_rule(self, args):
+        name, conditions, actions = self.require(args, 'name', 'conditions', 'actions')
+        try:
+            rule = Rule(name, conditions, actions, args.get('owner'), args.get('min_interval', 1.0))
+            self.rules_engine().add_rule(rule)
+        except (KeyError, TypeError, ValueError) as e:
+            raise RequestError('invalid', str(e))
+        return rule.to_dict()
+
+    def remove_rule(self, args):
+        name, = self.require(args, 'name')
+        return self.rules_engine().remove_rule(name)
+
+    def list_rules(self, args):
+        owner = args.get('owner')
+        return [rule.to_dict() for rule in self.rules_engine().rules.values()
+                if owner is None or rule.owner == owner]
+
+    def schedules(self):
+        if self.scheduler is None:
+            raise RequestError('unavailable', "Schedules are not enabled on this server")
+        return self.scheduler
+
+    def add_schedule(self, args):
+        name, actions = self.require(args, 'name', 'actions')
+        try:
+            schedule = Schedule(name, actions, args.get('owner'), args.get('at'), args.get('days'), args.get('every'))
+            self.schedules().add(schedule)
+        except (KeyError, TypeError, ValueError) as e:
+            raise RequestError('invalid', str(e))
+        return dict(schedule.to_dict(), next_run=self.scheduler.next_due(name))
+
+    def remove_schedule(self, args):
+        name, = self.require(args, 'name')
+        return self.schedules().remove(name)
+
+    def list_schedules(self, args):
+        scheduler = self.schedules()
+        return [dict(schedule.to_dict(), next_run=scheduler.next_due(name))
+                for name, schedule in scheduler.user_schedules(args.get('owner')).items()]
+
+    def flush(self, args):
+        self.device_manager.flush()
+        return True
+
+    def batch(self, args):
+        requests, = self.require(args, 'requests')
+        with self.device_manager.batch():
+            return [self.handle(request) for request in requests]
+
+    def handle(self, request):
+        if not isinstance(request, dict):
+            return error(None, 'bad_request', "Request must be a JSON object")
+        request_id = request.get('id')
+        handler = self.handlers.get(request.get('op'))
+        if handler is None:
+            return error(request_id, 'unknown_op', f"Unknown op: {request.get('op')}")
+        args = request.get('args') or {}
+        try:
+            return ok(request_id, handler(args))
+        except RequestError as e:
+            return error(request_id, e.kind, str(e))
+        except Exception as e:
+            return error(request_id, 'internal', str(e))
+
+    def handle_lines(self, lines):
+        # Every request already pipelined in one read shares a single persistence commit
+        responses = []
+        with self.device_manager.batch():
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    responses.append(error(None, 'bad_request', f"Invalid JSON: {str(e)}"))
+                    continue
+                responses.append(self.handle(request))
+        if self.storage_errors:
+            message = '; '.join(self.storage_errors)
+            self.storage_errors.clear()
+            responses = [error(response['id'], 'storage', message) if response['ok'] else response
+                         for response in responses]
+        return responses
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        pending = b''
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                *lines, pending = (pending + chunk).split(b'\n')
+                if lines:
+                    responses = await loop.run_in_executor(self.executor, self.handle_lines, lines)
+                    writer.write(b''.join(json.dumps(response).encode() + b'\n' for response in responses))
+                    await writer.drain()
+                if len(pending) > MAX_LINE:
+                    response = error(None, 'bad_request', f"Request line longer than {MAX_LINE} bytes")
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, socket_path=None):
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            print(f"Serving on {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"Serving on {host}:{port}")
+        stop = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        except NotImplementedError:
+            pass
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            self.executor.shutdown()
+
+
+def run_server(host='127.0.0.1', port=8765, socket_path=None, storage='json', shards=0, tables=False):
+    if shards:
+        # Rules and schedules read live device objects, so they need the in-process manager
+        device_manager = ShardedDeviceManager(shards, 'data')
+        scheduler = None
+        server = ControlServer(device_manager)
+    else:
+        device_manager = DeviceManager(write_behind=True, storage=create_backend(storage, 'data', journal=True), lazy=True,
+                                       tables=tables)
+        scheduler = Scheduler(device_manager, 'data')
+        server = ControlServer(device_manager, RulesEngine(device_manager, 'data'), scheduler)
+    try:
+        asyncio.run(server.serve(host, port, socket_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if scheduler is not None:
+            scheduler.close()
+        device_manager.close()
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on with --serve")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port to listen on with --serve")
+    parser.add_argument('--socket', help="serve on this Unix socket instead of TCP")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="partition devices across this many worker processes (data/shards/), for very large fleets")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless Smart Home control server")
+    add_server_arguments(parser)
+    parser.add_argument('--storage', choices=['json', 'sqlite', 'binary'], default='json')
+    parser.add_argument('--tables', action='store_true', help="keep devices in array-backed tables")
+    args = parser.parse_args()
+    run_server(args.host, args.port, args.socket, args.storage, args.shards, args.tables)
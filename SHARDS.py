@@ -0,0 +1,329 @@
+import multiprocessing
+import os
+import signal
+import threading
+import zlib
+from contextlib import contextmanager
+from MANAGER import DeviceManager
+from REPORT import device_lines
+from SCENES import SETTERS, Scene, SceneStore
+from STORAGE import create_backend
+
+
+def shard_for(owner, name, shards):
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32(f'{owner}\0{name}'.encode()) % shards
+
+
+class Changes:
+    # Stands in for the event bus on a coordinator-side copy: setters report here, so a save
+    # sends only the attributes this copy changed and leaves the rest of the shard's device alone
+    __slots__ = ('attributes',)
+
+    def __init__(self):
+        self.attributes = set()
+
+    def publish(self, device, attribute, old, new):
+        self.attributes.add(attribute)
+
+
+class Shard:
+    # Runs inside a worker process around an ordinary DeviceManager; takes and returns plain records
+    def __init__(self, device_manager):
+        self.device_manager = device_manager
+
+    def records(self, devices):
+        return {name: device.to_dict() for name, device in devices.items()}
+
+    def names(self):
+        return {device_type: list(self.device_manager.snapshot(device_type))
+                for device_type in self.device_manager.device_classes}
+
+    def add(self, device_type, devices):
+        with self.device_manager.batch():
+            for name, location, owner in devices:
+                self.device_manager.add_device(device_type, name, location, owner)
+        return len(devices)
+
+    def remove(self, device_type, name):
+        return self.device_manager.remove_device(device_type, name)
+
+    def get(self, device_type, name):
+        device = self.device_manager.devices[device_type].get(name)
+        return device.to_dict() if device is not None else None
+
+    def user_devices(self, device_type, username):
+        return self.records(self.device_manager.get_user_devices(device_type, username))
+
+    def location_devices(self, device_type, location):
+        return self.records(self.device_manager.get_devices_by_location(device_type, location))
+
+    def user_location_devices(self, device_type, username, location):
+        return self.records(self.device_manager.get_user_devices_by_location(device_type, username, location))
+
+    def snapshot(self, device_type):
+        return self.records(self.device_manager.snapshot(device_type))
+
+    def put(self, saves):
+        # saves: {device_type: {name: attributes}}, usually just the ones the caller changed.
+        # Applied through the setters, so only the attributes that differ are journaled.
+        count = 0
+        with self.device_manager.batch():
+            for device_type, records in saves.items():
+                devices = self.device_manager.devices[device_type]
+                for name, record in records.items():
+                    device = devices.get(name)
+                    if device is None:
+                        continue
+                    for attribute, value in record.items():
+                        if attribute in SETTERS and getattr(device, attribute) != value:
+                            SETTERS[attribute](device, value)
+                    self.device_manager.save_device(device_type, name)
+                    count += 1
+        return count
+
+    def apply_scene(self, scene):
+        return Scene.from_dict(scene).apply(self.device_manager)
+
+    def render(self, device_type, username):
+        return ["\n".join(device_lines(name, device))
+                for name, device in self.device_manager.get_user_devices(device_type, username).items()]
+
+    def flush(self):
+        self.device_manager.flush()
+        return True
+
+
+def serve_shard(connection, directory):
+    # Ctrl-C reaches the whole process group; the coordinator decides when shards stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    device_manager = DeviceManager(storage=create_backend('json', directory, journal=True))
+    shard = Shard(device_manager)
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            op, args = request
+            try:
+                connection.send((True, getattr(shard, op)(*args)))
+            except Exception as e:
+                connection.send((False, e))
+    finally:
+        device_manager.close()
+        connection.close()
+
+
+class ShardView:
+    # Read-only stand-in for DeviceManager.devices[device_type]; lookups go to the owning shard
+    def __init__(self, coordinator, device_type):
+        self.coordinator = coordinator
+        self.device_type = device_type
+
+    def get(self, name, default=None):
+        device = self.coordinator.lookup_device(self.device_type, name)
+        return default if device is None else device
+
+    def __getitem__(self, name):
+        device = self.get(name)
+        if device is None:
+            raise KeyError(name)
+        return device
+
+    def __contains__(self, name):
+        return name in self.coordinator.placement[self.device_type]
+
+    def __iter__(self):
+        return iter(list(self.coordinator.placement[self.device_type]))
+
+    def __len__(self):
+        return len(self.coordinator.placement[self.device_type])
+
+
+class ShardedDeviceManager:
+    # Devices are partitioned by (owner, name) across worker processes, each with its own
+    # DeviceManager and files under data/shards/NN. Single-device calls go to one shard; lookups,
+    # scenes and report rendering go to every shard at once and the results are merged.
+    def __init__(self, shards=4, directory='data', error_handler=None):
+        self.shards = shards
+        self.directory = os.path.join(directory, 'shards')
+        self.error_handler = error_handler
+        self.scenes = SceneStore(directory)
+        self.connections = []
+        self.processes = []
+        self.locks = [threading.Lock() for _ in range(shards)]
+        for index in range(shards):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_shard, name=f'shard-{index}', daemon=True,
+                                              args=(child, os.path.join(self.directory, f'{index:02d}')))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self.device_classes = DeviceManager.DEVICE_CLASSES
+        self.devices = {device_type: ShardView(self, device_type) for device_type in self.device_classes}
+        # Which shard holds each name, so calls that only carry a name still go to one shard
+        self.placement = {device_type: {} for device_type in self.device_classes}
+        for index, names in enumerate(self.fan_out('names')):
+            for device_type, device_names in names.items():
+                for name in device_names:
+                    self.placement[device_type][name] = index
+        self.batch_state = threading.local()
+
+    def report_error(self, message):
+        if self.error_handler:
+            self.error_handler(message)
+        else:
+            print(message)
+
+    def call(self, index, op, *args):
+        with self.locks[index]:
+            self.connections[index].send((op, args))
+            ok, result = self.connections[index].recv()
+        if not ok:
+            raise result
+        return result
+
+    def fan_out(self, op, *args, requests=None):
+        # Every shard works at the same time; locks are taken in index order so concurrent
+        # fan-outs can't deadlock. requests maps shard index to its own args, for partitioned work.
+        targets = sorted(requests) if requests is not None else range(self.shards)
+        for index in targets:
+            self.locks[index].acquire()
+        try:
+            for index in targets:
+                self.connections[index].send((op, requests[index] if requests is not None else args))
+            replies = [self.connections[index].recv() for index in targets]
+        finally:
+            for index in targets:
+                self.locks[index].release()
+        for ok, result in replies:
+            if not ok:
+                raise result
+        return [result for ok, result in replies]
+
+    def adopt(self, device_type, records):
+        # Device copies for the caller, who passes the one it changed back to save_device
+        device_class = self.device_classes[device_type]
+        devices = {}
+        for name, record in records.items():
+            device = devices[name] = device_class.from_dict({**record, 'name': name})
+            device.bus = Changes()
+        return devices
+
+    def merged(self, device_type, op, *args):
+        records = {}
+        for part in self.fan_out(op, device_type, *args):
+            records.update(part)
+        return self.adopt(device_type, records)
+
+    def ensure_loaded(self, device_type):
+        pass
+
+    def add_device(self, device_type, name, location, owner):
+        self.add_devices(device_type, [(name, location, owner)])
+
+    def add_devices(self, device_type, devices):
+        # Bulk add: each shard receives its own slice in one request, all shards in parallel
+        placement = self.placement[device_type]
+        requests = {}
+        for name, location, owner in devices:
+            index = shard_for(owner, name, self.shards)
+            previous = placement.get(name)
+            if previous is not None and previous != index:
+                self.call(previous, 'remove', device_type, name)
+            placement[name] = index
+            requests.setdefault(index, (device_type, []))[1].append((name, location, owner))
+        self.fan_out('add', requests=requests)
+
+    def remove_device(self, device_type, name):
+        index = self.placement[device_type].pop(name, None)
+        if index is None:
+            return False
+        return self.call(index, 'remove', device_type, name)
+
+    def lookup_device(self, device_type, name):
+        index = self.placement[device_type].get(name)
+        if index is None:
+            return None
+        record = self.call(index, 'get', device_type, name)
+        if record is None:
+            return None
+        return self.adopt(device_type, {name: record})[name]
+
+    def get_device(self, device_type, name, username):
+        device = self.lookup_device(device_type, name)
+        return device if device is not None and device.owner == username else None
+
+    def get_user_devices(self, device_type, username):
+        return self.merged(device_type, 'user_devices', username)
+
+    def get_devices_by_location(self, device_type, location):
+        return self.merged(device_type, 'location_devices', location)
+
+    def get_user_devices_by_location(self, device_type, username, location):
+        return self.merged(device_type, 'user_location_devices', username, location)
+
+    def snapshot(self, device_type):
+        return self.merged(device_type, 'snapshot')
+
+    def render_user_devices(self, device_type, username):
+        # Report text for the user's devices, rendered by every shard in parallel
+        return [text for part in self.fan_out('render', device_type, username) for text in part]
+
+    def apply_scene(self, scene):
+        scene.validate(self)
+        return sum(self.fan_out('apply_scene', scene.to_dict()))
+
+    @contextmanager
+    def batch(self):
+        # Saves inside the block are sent together at the end, one request per shard
+        state = self.batch_state
+        outermost = getattr(state, 'pending', None) is None
+        if outermost:
+            state.pending = {}
+        try:
+            yield self
+        finally:
+            if outermost:
+                pending, state.pending = state.pending, None
+                if pending:
+                    self.fan_out('put', requests={index: (saves,) for index, saves in pending.items()})
+
+    def save_device(self, device_type, name, device=None):
+        if device is None:
+            raise ValueError(f"Saving {device_type} {name} on a sharded manager needs the changed device")
+        index = self.placement[device_type].get(name)
+        if index is None:
+            return
+        record = device.to_dict()
+        if isinstance(device.bus, Changes):
+            # A stale copy must not write back attributes another copy has changed since
+            record = {attribute: record[attribute] for attribute in device.bus.attributes if attribute in record}
+            device.bus.attributes.clear()
+            if not record:
+                return
+        pending = getattr(self.batch_state, 'pending', None)
+        if pending is not None:
+            pending.setdefault(index, {}).setdefault(device_type, {}).setdefault(name, {}).update(record)
+            return
+        try:
+            self.call(index, 'put', {device_type: {name: record}})
+        except Exception as e:
+            self.report_error(f"Failed to save {device_type}: {str(e)}")
+
+    def flush(self):
+        self.fan_out('flush')
+
+    def close(self):
+        for index, connection in enumerate(self.connections):
+            with self.locks[index]:
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
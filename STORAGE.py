@@ -0,0 +1,353 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from JOURNAL import DeviceJournal
+from BINARY import DeviceFile
+from USERS import ShardedUserFiles
+from METRICS import METRICS
+
+
+def build_devices(device_class, data):
+    return {name: device_class.from_dict({**record, 'name': name}) for name, record in data.items()}
+
+
+class JsonBackend:
+    def __init__(self, directory='data', journal=False, compact_threshold=1000):
+        self.directory = directory
+        self.journal = DeviceJournal(directory) if journal else None
+        self.incremental = journal
+        self.compact_threshold = compact_threshold
+        self.users = ShardedUserFiles(directory)
+
+    def snapshot_path(self, device_type):
+        return os.path.join(self.directory, f'{device_type}.json')
+
+    def initialize(self, device_classes):
+        os.makedirs(self.directory, exist_ok=True)
+        for device_type in device_classes:
+            filepath = self.snapshot_path(device_type)
+            if not os.path.exists(filepath):
+                with open(filepath, 'w') as f:
+                    json.dump({}, f, indent=4)
+        self.users.migrate_legacy()
+
+    def load(self, device_type):
+        with open(self.snapshot_path(device_type), 'r') as f:
+            data = json.load(f)
+        if self.journal:
+            self.journal.replay(device_type, data)
+        return data
+
+    def load_devices(self, device_type, device_class):
+        return build_devices(device_class, self.load(device_type))
+
+    def put(self, device_type, name, data):
+        self.journal.put(device_type, name, data)
+
+    def patch(self, device_type, name, changes):
+        self.journal.patch(device_type, name, changes)
+
+    def write_batch(self, device_type, items, removed=(), patches=()):
+        records = [{'op': 'put', 'name': name, 'data': data} for name, data in items]
+        records.extend({'op': 'patch', 'name': name, 'data': changes} for name, changes in patches)
+        records.extend({'op': 'remove', 'name': name} for name in removed)
+        self.journal.append_many(device_type, records)
+
+    def remove(self, device_type, name):
+        self.journal.remove(device_type, name)
+
+    def needs_compaction(self, device_type):
+        return self.journal is not None and self.journal.count(device_type) >= self.compact_threshold
+
+    def save_all(self, device_type, snapshot):
+        # Rotate before taking the snapshot: every record left in the rotated log describes a
+        # change made before the snapshot, so discarding it afterwards loses nothing
+        if self.journal:
+            with self.journal.lock:
+                self.journal.rotate(device_type)
+        data = {name: device.to_dict() for name, device in snapshot().items()}
+        filepath = self.snapshot_path(device_type)
+        tmp_path = filepath + '.tmp'
+        with METRICS.timer('storage.json_snapshot'), open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=4)
+            METRICS.count('storage.snapshot_bytes', f.tell())
+        os.replace(tmp_path, filepath)
+        if self.journal:
+            self.journal.discard_rotated(device_type)
+
+    def load_users(self):
+        return {**self.users.read(self.users.legacy_path), **self.users.load_all()}
+
+    def save_users(self, users):
+        self.users.put_many(users)
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def put_user(self, username, record, users=None):
+        self.users.put(username, record)
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+
+
+class SqliteBackend:
+    incremental = True
+
+    # Numbers get no type affinity, so SQLite keeps what was stored: 3 stays 3 and 72.5 stays 72.5
+    SQL_TYPES = {bool: 'INTEGER', int: '', float: '', str: 'TEXT'}
+
+    def __init__(self, path=os.path.join('data', 'home.db')):
+        self.path = path
+        self.lock = threading.Lock()
+        self.columns = {}
+        self.bool_columns = {}
+        self.real_columns = {}
+        self.statements = {}
+        self.conn = None
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Shared by the UI and write-behind threads; self.lock serialises access
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, record TEXT NOT NULL)')
+
+    def initialize(self, device_classes):
+        if self.conn is None:
+            self.connect()
+        with self.lock, self.conn:
+            for device_type, device_class in device_classes.items():
+                # The table layout follows what the class serialises, so new attributes need no schema code here
+                sample = device_class('', '', None).to_dict()
+                columns = [key for key in sample if key != 'name']
+                self.columns[device_type] = columns
+                self.bool_columns[device_type] = [key for key in columns if isinstance(sample[key], bool)]
+                definitions = ', '.join(
+                    f'{key} {self.SQL_TYPES.get(type(sample[key]), "TEXT")}' for key in columns)
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {device_type} (name TEXT PRIMARY KEY, {definitions})')
+                # Tables created before that declared numbers REAL and turned every int into a float
+                declared = {row[1]: row[2] for row in self.conn.execute(f'PRAGMA table_info({device_type})')}
+                self.real_columns[device_type] = [key for key in columns if declared.get(key) == 'REAL']
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {device_type}_owner ON {device_type} (owner)')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {device_type}_location ON {device_type} (location)')
+                names = ', '.join(['name'] + columns)
+                marks = ', '.join('?' * (len(columns) + 1))
+                self.statements[device_type] = {
+                    'select': f'SELECT {names} FROM {device_type}',
+                    'upsert': f'INSERT OR REPLACE INTO {device_type} ({names}) VALUES ({marks})',
+                    'delete': f'DELETE FROM {device_type} WHERE name = ?',
+                    'clear': f'DELETE FROM {device_type}',
+                }
+
+    def row(self, device_type, name, data):
+        return (name,) + tuple(data.get(key) for key in self.columns[device_type])
+
+    def load(self, device_type):
+        columns = ['name'] + self.columns[device_type]
+        with self.lock:
+            rows = self.conn.execute(self.statements[device_type]['select']).fetchall()
+        data = {}
+        for row in rows:
+            record = dict(zip(columns, row))
+            for key in self.bool_columns[device_type]:
+                record[key] = bool(record[key])
+            for key in self.real_columns[device_type]:
+                value = record[key]
+                if isinstance(value, float) and value.is_integer():
+                    record[key] = int(value)
+            data[record['name']] = record
+        return data
+
+    def load_devices(self, device_type, device_class):
+        return build_devices(device_class, self.load(device_type))
+
+    def put(self, device_type, name, data):
+        with self.lock, self.conn:
+            self.conn.execute(self.statements[device_type]['upsert'], self.row(device_type, name, data))
+
+    def update_statement(self, device_type, attributes):
+        key = ('update',) + attributes
+        statement = self.statements[device_type].get(key)
+        if statement is None:
+            assignments = ', '.join(f'{attribute} = ?' for attribute in attributes)
+            statement = self.statements[device_type][key] = f'UPDATE {device_type} SET {assignments} WHERE name = ?'
+        return statement
+
+    def patch(self, device_type, name, changes):
+        with self.lock, self.conn:
+            self.conn.execute(self.update_statement(device_type, tuple(changes)), (*changes.values(), name))
+
+    def write_batch(self, device_type, items, removed=(), patches=()):
+        rows = [self.row(device_type, name, data) for name, data in items]
+        # Patches touching the same attributes share one UPDATE statement
+        updates = {}
+        for name, changes in patches:
+            updates.setdefault(tuple(changes), []).append((*changes.values(), name))
+        with self.lock, self.conn:
+            self.conn.executemany(self.statements[device_type]['upsert'], rows)
+            for attributes, values in updates.items():
+                self.conn.executemany(self.update_statement(device_type, attributes), values)
+            self.conn.executemany(self.statements[device_type]['delete'], [(name,) for name in removed])
+
+    def remove(self, device_type, name):
+        with self.lock, self.conn:
+            self.conn.execute(self.statements[device_type]['delete'], (name,))
+
+    def needs_compaction(self, device_type):
+        return False
+
+    def save_all(self, device_type, snapshot):
+        # Snapshot inside the lock so a concurrent put can't be overwritten with older state
+        with METRICS.timer('storage.sqlite_snapshot'), self.lock, self.conn:
+            rows = [self.row(device_type, name, device.to_dict()) for name, device in snapshot().items()]
+            self.conn.execute(self.statements[device_type]['clear'])
+            self.conn.executemany(self.statements[device_type]['upsert'], rows)
+
+    def load_users(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT username, record FROM users').fetchall()
+        return {username: json.loads(record) for username, record in rows}
+
+    def save_users(self, users):
+        rows = [(username, json.dumps(record)) for username, record in users.items()]
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM users')
+            self.conn.executemany('INSERT INTO users (username, record) VALUES (?, ?)', rows)
+
+    def get_user(self, username):
+        with self.lock:
+            row = self.conn.execute('SELECT record FROM users WHERE username = ?', (username,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_user(self, username, record, users=None):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO users (username, record) VALUES (?, ?)',
+                              (username, json.dumps(record)))
+
+    def close(self):
+        if self.conn is not None:
+            with self.lock:
+                self.conn.close()
+            self.conn = None
+
+
+class BinaryBackend:
+    # Fixed-width records in <type>.bin (see BINARY.py): saves overwrite one slot in place, so
+    # there is no journal and nothing to compact; save_all still writes a compact copy
+    incremental = True
+
+    def __init__(self, directory='data'):
+        self.directory = directory
+        self.device_classes = {}
+        self.files = {}
+        self.lock = threading.Lock()
+        self.users = ShardedUserFiles(directory)
+
+    def initialize(self, device_classes):
+        os.makedirs(self.directory, exist_ok=True)
+        self.device_classes = dict(device_classes)
+        self.users.migrate_legacy()
+
+    def file(self, device_type):
+        # Opened on first use, so lazy loading doesn't scan types nobody has touched
+        device_file = self.files.get(device_type)
+        if device_file is None:
+            with self.lock:
+                device_file = self.files.get(device_type)
+                if device_file is None:
+                    device_file = self.files[device_type] = DeviceFile(
+                        os.path.join(self.directory, f'{device_type}.bin'), self.device_classes[device_type])
+        return device_file
+
+    def load(self, device_type):
+        return self.file(device_type).records()
+
+    def load_devices(self, device_type, device_class):
+        return self.file(device_type).devices(device_class)
+
+    def put(self, device_type, name, data):
+        self.file(device_type).put(name, data)
+
+    def patch(self, device_type, name, changes):
+        self.file(device_type).patch(name, changes)
+
+    def write_batch(self, device_type, items, removed=(), patches=()):
+        self.file(device_type).write_batch(items, removed, patches)
+
+    def remove(self, device_type, name):
+        self.file(device_type).remove(name)
+
+    def needs_compaction(self, device_type):
+        return False
+
+    def save_all(self, device_type, snapshot):
+        data = {name: device.to_dict() for name, device in snapshot().items()}
+        with METRICS.timer('storage.binary_snapshot'):
+            METRICS.count('storage.snapshot_bytes', self.file(device_type).rewrite(data))
+
+    def load_users(self):
+        return {**self.users.read(self.users.legacy_path), **self.users.load_all()}
+
+    def save_users(self, users):
+        self.users.put_many(users)
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def put_user(self, username, record, users=None):
+        self.users.put(username, record)
+
+    def close(self):
+        with self.lock:
+            for device_file in self.files.values():
+                device_file.close()
+            self.files = {}
+
+
+def create_backend(kind, directory='data', journal=False):
+    if kind == 'sqlite':
+        return SqliteBackend(os.path.join(directory, 'home.db'))
+    if kind == 'binary':
+        return BinaryBackend(directory)
+    return JsonBackend(directory, journal=journal)
+
+
+def migrate_json_to_sqlite(device_classes, directory='data', db_path=None):
+    source = JsonBackend(directory, journal=True)
+    target = SqliteBackend(db_path or os.path.join(directory, 'home.db'))
+    target.initialize(device_classes)
+    counts = {}
+    for device_type in device_classes:
+        try:
+            data = source.load(device_type)
+        except FileNotFoundError:
+            data = {}
+        target.write_batch(device_type, data.items())
+        counts[device_type] = len(data)
+    users = source.load_users()
+    target.save_users(users)
+    counts['users'] = len(users)
+    source.close()
+    target.close()
+    return counts
+
+
+if __name__ == '__main__':
+    from LIGHT import Light
+    from THERMOSTAT import Thermostat
+    from CAMERA import SecurityCamera
+    from FAN import Fan
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    counts = migrate_json_to_sqlite({
+        'lights': Light,
+        'thermostat': Thermostat,
+        'security_camera': SecurityCamera,
+        'fan': Fan,
+    }, directory)
+    for name, count in counts.items():
+        print(f"Migrated {count} {name}")
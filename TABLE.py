@@ -0,0 +1,240 @@
+from array import array
+from collections.abc import MutableMapping
+from DEVICE import STATUSES, VERSIONS
+from LIGHT import Light, pack_color, unpack_color
+from THERMOSTAT import Thermostat, MODES
+from CAMERA import SecurityCamera, RESOLUTIONS
+from FAN import Fan
+
+# (attribute, column kind, default); choice columns carry their allowed values.
+# Names are unique, so they live in the row index rather than a column.
+BASE_COLUMNS = (
+    ('location', 'text', 'Unknown'),
+    ('status', ('choice', STATUSES), 'off'),
+    ('owner', 'text', None),
+)
+
+COLUMNS = {
+    Light: (('brightness', 'number', 100), ('color', 'color', '#FFFFFF')),
+    Thermostat: (('temperature', 'number', 72), ('mode', ('choice', MODES), 'auto')),
+    SecurityCamera: (('recording', 'flag', False), ('resolution', ('choice', RESOLUTIONS), '1080p')),
+    Fan: (('speed', 'number', 0),),
+}
+
+TYPECODES = {'text': 'I', 'number': 'd', 'flag': 'B', 'color': 'I', 'choice': 'B'}
+
+
+class StringTable:
+    def __init__(self):
+        self.strings = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self.codes[value] = code
+        return code
+
+    def decode(self, code):
+        return self.strings[code]
+
+
+class Column:
+    def __init__(self, kind, strings):
+        if isinstance(kind, tuple):
+            kind, choices = kind
+            self.choices = choices
+            self.choice_codes = {value: code for code, value in enumerate(choices)}
+        self.kind = kind
+        self.strings = strings
+        self.values = array(TYPECODES[kind])
+
+    def encode(self, value):
+        if self.kind == 'text':
+            return self.strings.encode(value)
+        if self.kind == 'color':
+            return pack_color(value)
+        if self.kind == 'flag':
+            return 1 if value else 0
+        if self.kind == 'choice':
+            code = self.choice_codes.get(value)
+            if code is None:
+                raise ValueError(f"Invalid value: {value}")
+            return code
+        return value
+
+    def decode(self, code):
+        if self.kind == 'text':
+            return self.strings.decode(code)
+        if self.kind == 'color':
+            return unpack_color(code)
+        if self.kind == 'flag':
+            return bool(code)
+        if self.kind == 'choice':
+            return self.choices[code]
+        # Numbers are stored as doubles; whole ones come back as the ints they were
+        return int(code) if code.is_integer() else code
+
+    def get(self, row):
+        return self.decode(self.values[row])
+
+    def set(self, row, value):
+        self.values[row] = self.encode(value)
+
+
+def column_property(attribute):
+    def getter(view):
+        return view.table.columns[attribute].get(view.row)
+
+    def setter(view, value):
+        view.table.columns[attribute].set(view.row, value)
+
+    return property(getter, setter)
+
+
+# One view class per device class, so every table of a type hands out the same type
+VIEW_CLASSES = {}
+
+
+def make_view_class(device_class, attributes):
+    # Views subclass the device class, so isinstance checks, the setters and changed() all carry
+    # over; the slots they inherit stay empty, as every attribute is a property onto the table
+    def __init__(view, name, location, owner):
+        # Constructed like the device class: the view gets a one-row table of its own
+        table = DeviceTable(device_class)
+        view.table = table
+        view.row = table.add(name, location, owner).row
+
+    def to_dict(view):
+        data = {'name': view.name}
+        data.update((attribute, getattr(view, attribute)) for attribute in attributes)
+        return data
+
+    def touch(view):
+        view.table.versions[view.row] = next(VERSIONS)
+
+    def set_bus(view, bus):
+        view.table.bus = bus
+
+    namespace = {
+        '__slots__': ('table', 'row'),
+        '__init__': __init__,
+        'name': property(lambda view: view.table.names[view.row]),
+        'version': property(lambda view: view.table.versions[view.row]),
+        # One bus per table: the owning DeviceManager sets it through any view
+        'bus': property(lambda view: view.table.bus, set_bus),
+        'touch': touch,
+        'to_dict': to_dict,
+        'device_class': device_class,
+    }
+    for attribute in attributes:
+        namespace[attribute] = column_property(attribute)
+    return type(f'{device_class.__name__}View', (device_class,), namespace)
+
+
+def view_class(device_class):
+    cls = VIEW_CLASSES.get(device_class)
+    if cls is None:
+        specs = BASE_COLUMNS + COLUMNS[device_class]
+        cls = VIEW_CLASSES[device_class] = make_view_class(device_class, [attribute for attribute, kind, default in specs])
+    return cls
+
+
+class DeviceTable(MutableMapping):
+    # name -> view, usable wherever DeviceManager keeps a type's device dict. Assigning a device
+    # copies its state into a row; removed rows are reused by later adds rather than moved, so
+    # views of the devices still in the table stay valid.
+    def __init__(self, device_class):
+        self.device_class = device_class
+        self.strings = StringTable()
+        specs = BASE_COLUMNS + COLUMNS[device_class]
+        self.defaults = {attribute: default for attribute, kind, default in specs}
+        self.columns = {attribute: Column(kind, self.strings) for attribute, kind, default in specs}
+        self.view_class = view_class(device_class)
+        self.names = []
+        self.versions = array('Q')
+        self.rows = {}
+        self.free = []
+        self.bus = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, name):
+        return self.view(self.rows[name])
+
+    def __setitem__(self, name, device):
+        self.from_dict({**device.to_dict(), 'name': name})
+
+    def __delitem__(self, name):
+        if not self.remove(name):
+            raise KeyError(name)
+
+    def view(self, row):
+        view = self.view_class.__new__(self.view_class)
+        view.table = self
+        view.row = row
+        return view
+
+    def from_dict(self, data):
+        name = data['name']
+        row = self.rows.get(name)
+        if row is None and self.free:
+            row = self.rows[name] = self.free.pop()
+            self.names[row] = name
+        if row is None:
+            row = len(self.names)
+            for attribute, column in self.columns.items():
+                column.values.append(column.encode(data.get(attribute, self.defaults[attribute])))
+            self.names.append(name)
+            self.versions.append(next(VERSIONS))
+            self.rows[name] = row
+        else:
+            for attribute, column in self.columns.items():
+                column.set(row, data.get(attribute, self.defaults[attribute]))
+            self.versions[row] = next(VERSIONS)
+        return self.view(row)
+
+    def load(self, records):
+        # records: name -> record dict, as a storage backend's load() returns them
+        for name, record in records.items():
+            self.from_dict({**record, 'name': name})
+
+    def add(self, name, location, owner):
+        return self.from_dict({'name': name, 'location': location, 'owner': owner})
+
+    def get(self, name, default=None):
+        row = self.rows.get(name)
+        if row is None:
+            return default
+        return self.view(row)
+
+    def pop(self, name, *default):
+        # The removed device comes back as a plain object, since its row may be reused
+        row = self.rows.get(name)
+        if row is None:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        device = self.device_class.from_dict(self.view(row).to_dict())
+        self.remove(name)
+        return device
+
+    def remove(self, name):
+        row = self.rows.pop(name, None)
+        if row is None:
+            return False
+        self.names[row] = None
+        self.free.append(row)
+        return True
+
+    def to_dict(self):
+        return {name: view.to_dict() for name, view in self.items()}
@@ -0,0 +1,297 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+# Closed 1-minute and 1-hour aggregates on disk: series id, bucket start, count, sum, min, max
+RECORD = struct.Struct('<IdIddd')
+TIERS = {'minute': 60, 'hour': 3600}
+
+
+class Ring:
+    # Fixed-capacity ring over parallel array('d') columns; grows on demand, so a quiet
+    # device costs a few bytes rather than the full capacity
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.columns = [array('d') for _ in range(width)]
+        self.start = 0
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def append(self, *row):
+        if len(self) < self.capacity:
+            for column, value in zip(self.columns, row):
+                column.append(value)
+        else:
+            for column, value in zip(self.columns, row):
+                column[self.start] = value
+            self.start = (self.start + 1) % self.capacity
+
+    def row(self, index):
+        position = (self.start + index) % len(self)
+        return tuple(column[position] for column in self.columns)
+
+    def first_time(self):
+        return self.row(0)[0] if len(self) else None
+
+    def find(self, timestamp):
+        # First logical index whose timestamp is >= timestamp; column 0 is always time
+        times, low, high = self.columns[0], 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if times[(self.start + middle) % len(self)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def rows(self, start=None, end=None):
+        first = self.find(start) if start is not None else 0
+        last = self.find(end) if end is not None else len(self)
+        return [self.row(index) for index in range(first, last)]
+
+
+class Series:
+    __slots__ = ('id', 'raw', 'minute', 'hour', 'open', 'last')
+
+    def __init__(self, series_id, raw_capacity, minute_capacity, hour_capacity):
+        self.id = series_id
+        self.raw = Ring(raw_capacity, 2)
+        self.minute = Ring(minute_capacity, 5)
+        self.hour = Ring(hour_capacity, 5)
+        # Aggregates still being filled, per tier: [bucket start, count, sum, min, max]
+        self.open = {'minute': None, 'hour': None}
+        self.last = None
+
+
+def device_attributes(device_class):
+    sample = device_class('', '', None).to_dict()
+    return ['status'] + [key for key, value in sample.items() if isinstance(value, (bool, int, float))]
+
+
+def numeric(device, attribute):
+    value = getattr(device, attribute)
+    if attribute == 'status':
+        return 1.0 if value == 'on' else 0.0
+    return float(value)
+
+
+class TelemetryStore:
+    def __init__(self, directory='data', raw_capacity=512, minute_capacity=1440, hour_capacity=24 * 30,
+                 retention={'minute': 7 * 86400, 'hour': 365 * 86400}, clock=time.time):
+        self.directory = os.path.join(directory, 'telemetry')
+        self.capacities = (raw_capacity, minute_capacity, hour_capacity)
+        self.retention = retention
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.series = {}
+        self.ids = {}
+        self.attributes = {}
+        self.files = {}
+        # Series with a bucket still open, per tier, and the bucket start every one of them shares
+        self.opened = {tier: [] for tier in TIERS}
+        self.ticks = {tier: 0.0 for tier in TIERS}
+        os.makedirs(self.directory, exist_ok=True)
+        self.load_catalog()
+        for tier in TIERS:
+            self.trim(tier)
+            self.ticks[tier] = self.last_start(tier)
+
+    def catalog_path(self):
+        return os.path.join(self.directory, 'series.tsv')
+
+    def tier_path(self, tier):
+        return os.path.join(self.directory, f'{tier}.bin')
+
+    def load_catalog(self):
+        try:
+            with open(self.catalog_path(), 'r') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) == 4:
+                        self.ids[tuple(parts[1:])] = int(parts[0])
+        except FileNotFoundError:
+            pass
+
+    def series_for(self, key):
+        series = self.series.get(key)
+        if series is None:
+            series_id = self.ids.get(key)
+            if series_id is None:
+                series_id = len(self.ids)
+                self.ids[key] = series_id
+                with open(self.catalog_path(), 'a') as f:
+                    f.write('\t'.join([str(series_id), *key]) + '\n')
+            series = self.series[key] = Series(series_id, *self.capacities)
+        return series
+
+    def record_device(self, device_type, device):
+        # Called after every save; only attributes whose value changed are appended
+        device_class = type(device)
+        attributes = self.attributes.get(device_class)
+        if attributes is None:
+            attributes = self.attributes[device_class] = device_attributes(device_class)
+        with self.lock:
+            # Never behind a bucket already written, so the tier files stay in order if the clock steps back
+            now = max(self.clock(), self.ticks['minute'])
+            self.advance(now)
+            for attribute in attributes:
+                value = numeric(device, attribute)
+                series = self.series_for((device_type, device.name, attribute))
+                if series.last != value:
+                    self.append(series, now, value)
+
+    def append(self, series, timestamp, value):
+        if len(series.raw):
+            timestamp = max(timestamp, series.raw.row(len(series.raw) - 1)[0])
+        series.last = value
+        series.raw.append(timestamp, value)
+        self.fold(series, 'minute', timestamp, 1, value, value, value)
+
+    def advance(self, now):
+        # Every open bucket starts at the current tick, so closing them all when the tick moves on
+        # writes each tier file in bucket order; a quiet series can't append an old bucket later
+        for tier, width in TIERS.items():
+            tick = now - now % width
+            if tick > self.ticks[tier]:
+                opened, self.opened[tier] = self.opened[tier], []
+                for series in opened:
+                    if series.open[tier] is not None:
+                        self.close_bucket(series, tier)
+                self.ticks[tier] = tick
+                if tier == 'hour':
+                    # Hourly is often enough for retention measured in days
+                    for trimmed in TIERS:
+                        self.trim(trimmed)
+
+    def fold(self, series, tier, timestamp, count, total, low, high):
+        bucket = timestamp - timestamp % TIERS[tier]
+        current = series.open[tier]
+        if current is not None and current[0] != bucket:
+            self.close_bucket(series, tier)
+            current = None
+        if current is None:
+            series.open[tier] = [bucket, count, total, low, high]
+            self.opened[tier].append(series)
+        else:
+            current[1] += count
+            current[2] += total
+            current[3] = min(current[3], low)
+            current[4] = max(current[4], high)
+
+    def close_bucket(self, series, tier):
+        bucket = series.open[tier]
+        series.open[tier] = None
+        getattr(series, tier).append(*bucket)
+        self.write_record(tier, series.id, bucket)
+        if tier == 'minute':
+            self.fold(series, 'hour', *bucket)
+
+    def write_record(self, tier, series_id, bucket):
+        f = self.files.get(tier)
+        if f is None:
+            f = self.files[tier] = open(self.tier_path(tier), 'ab')
+        start, count, total, low, high = bucket
+        f.write(RECORD.pack(series_id, start, int(count), total, low, high))
+
+    def last_start(self, tier):
+        path = self.tier_path(tier)
+        if not os.path.exists(path) or os.path.getsize(path) < RECORD.size:
+            return 0.0
+        with open(path, 'rb') as f:
+            f.seek((os.path.getsize(path) // RECORD.size - 1) * RECORD.size)
+            return RECORD.unpack(f.read(RECORD.size))[1]
+
+    def trim(self, tier):
+        # Drops records past retention; advance() keeps the files in bucket order, so it's a prefix
+        path = self.tier_path(tier)
+        # The append handle would keep writing to the replaced file; write_record reopens it
+        f = self.files.pop(tier, None)
+        if f is not None:
+            f.close()
+        if not os.path.exists(path) or os.path.getsize(path) < RECORD.size:
+            return
+        cutoff = self.clock() - self.retention[tier]
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            first = self.search(mm, cutoff)
+            if first == 0:
+                return
+            remainder = mm[first * RECORD.size:len(mm) - len(mm) % RECORD.size]
+        with open(path + '.tmp', 'wb') as f:
+            f.write(remainder)
+        os.replace(path + '.tmp', path)
+
+    def search(self, mm, timestamp):
+        low, high = 0, len(mm) // RECORD.size
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('<d', mm, middle * RECORD.size + 4)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def read_disk(self, tier, series_id, start=None, end=None):
+        # Binary search to the start of the range, then read only records inside it
+        f = self.files.get(tier)
+        if f is not None:
+            f.flush()
+        path = self.tier_path(tier)
+        if not os.path.exists(path) or os.path.getsize(path) < RECORD.size:
+            return []
+        rows = []
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            index = self.search(mm, start) if start is not None else 0
+            for offset in range(index * RECORD.size, len(mm) - RECORD.size + 1, RECORD.size):
+                record = RECORD.unpack_from(mm, offset)
+                if end is not None and record[1] >= end:
+                    break
+                if record[0] == series_id:
+                    rows.append(record[1:])
+        return rows
+
+    def query(self, device_type, name, attribute, tier='raw', start=None, end=None):
+        # raw rows are (time, value); aggregate rows are (bucket start, count, sum, min, max)
+        key = (device_type, name, attribute)
+        with self.lock:
+            series = self.series.get(key)
+            series_id = self.ids.get(key)
+            if series_id is None:
+                return []
+            if tier == 'raw':
+                return series.raw.rows(start, end) if series else []
+            rows = getattr(series, tier).rows(start, end) if series else []
+            bucket = series.open[tier] if series else None
+            if bucket is not None and (start is None or bucket[0] >= start) and (end is None or bucket[0] < end):
+                rows.append(tuple(bucket))
+            oldest = rows[0][0] if rows else end
+        if start is None or oldest is None or start < oldest:
+            older = self.read_disk(tier, series_id, start, oldest)
+            rows = [row for row in older if oldest is None or row[0] < oldest] + rows
+        return rows
+
+    def history(self, device_type, name, attribute, start, end=None):
+        # (time, value) points from the finest tier that still covers start
+        with self.lock:
+            series = self.series.get((device_type, name, attribute))
+            raw_start = series.raw.first_time() if series else None
+        if raw_start is not None and raw_start <= start:
+            return self.query(device_type, name, attribute, 'raw', start, end)
+        span = (end or self.clock()) - start
+        tier = 'minute' if span <= 2 * 86400 else 'hour'
+        return [(row[0], row[2] / row[1]) for row in self.query(device_type, name, attribute, tier, start, end)
+                if row[1]]
+
+    def close(self):
+        with self.lock:
+            for tier in TIERS:
+                opened, self.opened[tier] = self.opened[tier], []
+                for series in opened:
+                    if series.open[tier] is not None:
+                        self.close_bucket(series, tier)
+            for f in self.files.values():
+                f.close()
+            self.files = {}
@@ -1,16 +1,25 @@
-from DEVICE import Device
+from DEVICE import Device, intern
+
+MODES = ('auto', 'heat', 'cool', 'off')
+
 
 class Thermostat(Device):
+    __slots__ = ('temperature', 'mode')
+
     def __init__(self, name, location, owner):
         super().__init__(name, location, owner)
         self.temperature = 72
         self.mode = 'auto'
 
     def set_temperature(self, temp):
+        old = self.temperature
         self.temperature = temp
+        self.changed('temperature', old, temp)
 
     def set_mode(self, mode):
-        self.mode = mode
+        old = self.mode
+        self.mode = intern(mode)
+        self.changed('mode', old, self.mode)
 
     def to_dict(self):
         data = super().to_dict()
@@ -24,5 +33,5 @@ class Thermostat(Device):
     def from_dict(cls, data):
         thermostat = super().from_dict(data)
         thermostat.temperature = data.get('temperature', 72)
-        thermostat.mode = data.get('mode', 'auto')
+        thermostat.mode = intern(data.get('mode', 'auto'))
         return thermostat
\ No newline at end of file
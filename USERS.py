@@ -0,0 +1,188 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import threading
+from collections import OrderedDict
+
+SCRYPT_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1}
+PBKDF2_ITERATIONS = 600000
+
+
+def hash_password(password, salt=None):
+    salt = salt or os.urandom(16)
+    if hasattr(hashlib, 'scrypt'):
+        n, r, p = SCRYPT_PARAMS['n'], SCRYPT_PARAMS['r'], SCRYPT_PARAMS['p']
+        digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, dklen=32)
+        return f"scrypt${n}${r}${p}${salt.hex()}${digest.hex()}"
+    # Python builds without OpenSSL scrypt support
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def check_password(password, stored):
+    algorithm, *fields = stored.split('$')
+    if algorithm == 'scrypt':
+        n, r, p, salt, expected = fields
+        digest = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(salt),
+                                n=int(n), r=int(r), p=int(p), dklen=len(expected) // 2)
+    elif algorithm == 'pbkdf2_sha256':
+        iterations, salt, expected = fields
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), int(iterations))
+    else:
+        raise ValueError(f"Unknown password hash: {algorithm}")
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+class ShardedUserFiles:
+    # Users spread over hash-bucketed JSON files so a login or registration reads and
+    # rewrites one small bucket instead of the whole user list
+    def __init__(self, directory='data', shards=256):
+        self.directory = os.path.join(directory, 'users')
+        self.legacy_path = os.path.join(directory, 'users.json')
+        self.shards = shards
+        self.lock = threading.Lock()
+
+    def shard_path(self, username):
+        bucket = int.from_bytes(hashlib.sha1(username.encode('utf-8')).digest()[:4], 'big') % self.shards
+        return os.path.join(self.directory, f'{bucket:03d}.json')
+
+    def read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write(self, path, users):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(users, f)
+        os.replace(tmp_path, path)
+
+    def get(self, username):
+        return self.read(self.shard_path(username)).get(username)
+
+    def put(self, username, record):
+        path = self.shard_path(username)
+        with self.lock:
+            users = self.read(path)
+            users[username] = record
+            self.write(path, users)
+
+    def put_many(self, users):
+        shards = {}
+        for username, record in users.items():
+            shards.setdefault(self.shard_path(username), {})[username] = record
+        with self.lock:
+            for path, records in shards.items():
+                self.write(path, {**self.read(path), **records})
+
+    def load_all(self):
+        users = {}
+        if os.path.isdir(self.directory):
+            for filename in sorted(os.listdir(self.directory)):
+                if filename.endswith('.json'):
+                    users.update(self.read(os.path.join(self.directory, filename)))
+        return users
+
+    def migrate_legacy(self):
+        # Moves an old single-file users.json into the buckets; records are hashed on next login
+        # or all at once with `python USERS.py rehash`
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self.legacy_path):
+            return 0
+        users = self.read(self.legacy_path)
+        self.put_many(users)
+        os.remove(self.legacy_path)
+        return len(users)
+
+
+class UserStore:
+    def __init__(self, storage, cache_size=1024):
+        self.storage = storage
+        self.cache_size = cache_size
+        # username -> (stored hash, keyed digest of a password that verified against it).
+        # A repeat login costs one HMAC instead of a KDF run; the key never leaves this process.
+        self.cache = OrderedDict()
+        self.cache_key = os.urandom(32)
+        self.lock = threading.Lock()
+        # Held across the existence check and the write so one username cannot register twice
+        self.register_lock = threading.Lock()
+
+    def quick_digest(self, username, password):
+        return hmac.new(self.cache_key, f"{username}\0{password}".encode('utf-8'), hashlib.sha256).digest()
+
+    def exists(self, username):
+        return self.storage.get_user(username) is not None
+
+    def register(self, username, password):
+        # Hash first: the KDF is slow and must not hold up other registrations
+        record = {'password_hash': hash_password(password)}
+        with self.register_lock:
+            if self.exists(username):
+                raise ValueError("Username already exists")
+            self.storage.put_user(username, record)
+
+    def verify(self, username, password):
+        record = self.storage.get_user(username)
+        if record is None:
+            return False
+        if 'password_hash' not in record:
+            # Plaintext record from before hashing; upgrade it on the first good login
+            # Bytes, since compare_digest refuses str with non-ASCII characters
+            if not hmac.compare_digest(str(record.get('password', '')).encode('utf-8'), password.encode('utf-8')):
+                return False
+            record = {key: value for key, value in record.items() if key != 'password'}
+            record['password_hash'] = hash_password(password)
+            self.storage.put_user(username, record)
+            return True
+        stored = record['password_hash']
+        digest = self.quick_digest(username, password)
+        with self.lock:
+            cached = self.cache.get(username)
+            if cached is not None and cached[0] == stored and hmac.compare_digest(cached[1], digest):
+                self.cache.move_to_end(username)
+                return True
+        if not check_password(password, stored):
+            return False
+        with self.lock:
+            self.cache[username] = (stored, digest)
+            self.cache.move_to_end(username)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return True
+
+    def rehash_all(self):
+        users = self.storage.load_users()
+        count = 0
+        for username, record in users.items():
+            if 'password_hash' not in record and 'password' in record:
+                record = {key: value for key, value in record.items() if key != 'password'}
+                record['password_hash'] = hash_password(users[username]['password'])
+                self.storage.put_user(username, record)
+                count += 1
+        return count
+
+
+def main(argv=None):
+    from STORAGE import create_backend
+    parser = argparse.ArgumentParser(description="Manage the Smart Home user store")
+    parser.add_argument('command', choices=['migrate', 'rehash'],
+                        help="migrate: move users.json into hashed buckets; rehash: also hash every plaintext password now")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--directory', default='data')
+    args = parser.parse_args(argv)
+    storage = create_backend(args.storage, args.directory)
+    if args.storage == 'sqlite':
+        storage.connect()
+    else:
+        print(f"Moved {storage.users.migrate_legacy()} users out of users.json")
+    if args.command == 'rehash':
+        print(f"Hashed {UserStore(storage).rehash_all()} plaintext passwords")
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from BINARY import DeviceFile, import_json
+from LIGHT import Light
+from MANAGER import DeviceManager
+from STORAGE import create_backend
+
+
+def timed(action, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = action()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def run(devices, updates):
+    # Same lights written both ways: the indent=4 JSON snapshot and the binary file
+    directory = f'data{devices}'
+    os.makedirs(directory)
+    rng = random.Random(0)
+    data = {}
+    for i in range(devices):
+        light = Light(f'l{i}', f'Room {i % 200}', f'user{i % 500}')
+        light.status = rng.choice(['on', 'off'])
+        light.brightness = rng.randrange(101)
+        data[light.name] = light.to_dict()
+    json_path = os.path.join(directory, 'lights.json')
+    with open(json_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    import_json({'lights': Light}, directory)
+    bin_path = os.path.join(directory, 'lights.bin')
+    results = {
+        'json_bytes': os.path.getsize(json_path),
+        'binary_bytes': sum(os.path.getsize(os.path.join(directory, name))
+                            for name in os.listdir(directory) if name.startswith('lights.') and 'json' not in name),
+    }
+
+    def load_json():
+        with open(json_path) as f:
+            return json.load(f)
+    results['json_load_s'], _ = timed(load_json)
+
+    def open_binary():
+        device_file = DeviceFile(bin_path, Light)
+        device_file.close()
+    results['binary_open_s'], _ = timed(open_binary)
+
+    # One device read straight after opening: JSON has to parse everything first
+    name = f'l{devices // 2}'
+    results['json_one_s'], _ = timed(lambda: load_json()[name])
+
+    def binary_one():
+        device_file = DeviceFile(bin_path, Light)
+        record = device_file.records()[name]
+        device_file.close()
+        return record
+    results['binary_one_s'], _ = timed(binary_one)
+
+    # End to end: every light becomes a device with its indexes, as the manager needs on first use
+    for kind in ('json', 'binary'):
+        def load_manager():
+            device_manager = DeviceManager(storage=create_backend(kind, directory), lazy=True)
+            device_manager.ensure_loaded('lights')
+            device_manager.close()
+        results[f'{kind}_manager_load_s'], _ = timed(load_manager)
+
+    # A single changed attribute, as the manager saves it: the JSON backend appends a patch to
+    # its journal, the binary backend rewrites the device's slot in place
+    names = list(data)
+    for kind in ('json', 'binary'):
+        storage = create_backend(kind, directory, journal=True)
+        storage.initialize({'lights': Light})
+        # The first write opens the journal or indexes the string table; time the steady state after it
+        storage.patch('lights', names[0], {'brightness': 0})
+
+        def update():
+            storage.patch('lights', rng.choice(names), {'brightness': rng.randrange(101)})
+        results[f'{kind}_update_s'], _ = timed(update, updates)
+        storage.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary device files against the JSON snapshot and journal: size, load and update")
+    parser.add_argument('--devices', default='1000,10000,100000', help="comma-separated fleet sizes")
+    parser.add_argument('--updates', type=int, default=1000, help="single-device updates timed per size")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        results = {count: run(count, args.updates) for count in (int(count) for count in args.devices.split(','))}
+        os.chdir('/')
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print(f"{'lights':>8}{'json KB':>10}{'bin KB':>9}{'json load':>11}{'bin open':>10}{'json one':>10}"
+          f"{'bin one':>10}{'json mgr':>10}{'bin mgr':>10}{'json upd':>10}{'bin upd':>10}")
+    for count, result in results.items():
+        print(f"{count:>8}{result['json_bytes'] / 1024:>10.0f}{result['binary_bytes'] / 1024:>9.0f}"
+              f"{result['json_load_s'] * 1e3:>9.1f}ms{result['binary_open_s'] * 1e3:>8.1f}ms"
+              f"{result['json_one_s'] * 1e3:>8.1f}ms{result['binary_one_s'] * 1e3:>8.1f}ms"
+              f"{result['json_manager_load_s'] * 1e3:>8.0f}ms{result['binary_manager_load_s'] * 1e3:>8.0f}ms"
+              f"{result['json_update_s'] * 1e6:>8.1f}us{result['binary_update_s'] * 1e6:>8.1f}us")
+
+
+if __name__ == '__main__':
+    main()
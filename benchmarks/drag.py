@@ -0,0 +1,85 @@
+import argparse
+import heapq
+import itertools
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MANAGER import DeviceManager
+from DISPATCH import Coalescer
+
+
+class FakeClock:
+    # Stands in for root.after: callbacks run when the simulated time passes their deadline
+    def __init__(self):
+        self.now = 0
+        self.queue = []
+        self.order = itertools.count()
+
+    def after(self, delay, callback):
+        heapq.heappush(self.queue, (self.now + delay, next(self.order), callback))
+
+    def advance(self, milliseconds):
+        deadline = self.now + milliseconds
+        while self.queue and self.queue[0][0] <= deadline:
+            self.now, order, callback = heapq.heappop(self.queue)
+            callback()
+        self.now = deadline
+
+
+def simulate(events, duration, interval):
+    # One slider drag: events evenly spread over duration ms, then a release
+    device_manager = DeviceManager(journal=True)
+    device_manager.add_device('lights', 'Lamp', 'Living Room', 'w')
+    device = device_manager.devices['lights']['Lamp']
+    writes = []
+    for method in ('put', 'patch'):
+        original = getattr(device_manager.storage, method)
+        setattr(device_manager.storage, method,
+                lambda *args, original=original: (writes.append(args), original(*args))[1])
+
+    clock = FakeClock()
+    dispatcher = Coalescer(clock.after, interval)
+    key = ('lights', 'Lamp', 'brightness')
+    writes.clear()
+    value = 0
+    for step in range(events):
+        value = step * 100 // max(events - 1, 1)
+        dispatcher.submit(key, lambda value=value: (device.set_brightness(value),
+                                                    device_manager.save_device('lights', 'Lamp')))
+        clock.advance(duration / events)
+    dispatcher.commit(key)
+    clock.advance(interval)
+    device_manager.close()
+    return len(writes), device.brightness, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a slider drag and check that persistence calls stay bounded")
+    parser.add_argument('--events', type=int, default=1000, help="slider callbacks during the drag")
+    parser.add_argument('--duration', type=float, default=2000, help="drag length in ms")
+    parser.add_argument('--interval', type=int, default=16, help="coalescing interval in ms")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        writes, final, expected = simulate(args.events, args.duration, args.interval)
+        os.chdir('/')
+    # Without coalescing every callback writes; with it, one write per interval plus the release
+    bound = int(args.duration // args.interval) + 2 if args.interval else args.events
+    print(f"{args.events} slider events over {args.duration:g} ms -> {writes} writes (bound {bound})")
+    failures = []
+    if writes > bound:
+        failures.append(f"{writes} writes exceeds {bound}")
+    if final != expected:
+        failures.append(f"final brightness {final}, expected {expected}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MANAGER import DeviceManager
+
+
+def run(devices, changes, subscribers):
+    # One burst of single-attribute changes inside a batch, as a scene, schedule tick or pipelined
+    # server read produces; compares the journal written as patches with whole-record puts
+    device_manager = DeviceManager(journal=True, compact_threshold=10 ** 9)
+    with device_manager.batch():
+        for i in range(devices):
+            device_manager.add_device('lights', f'l{i}', f'Room {i % 20}', 'owner')
+    calls = [0] * subscribers
+    delivered = [0] * subscribers
+    for index in range(subscribers):
+        def subscriber(events, index=index):
+            calls[index] += 1
+            delivered[index] += len(events)
+        device_manager.events.subscribe(subscriber)
+
+    rng = random.Random(0)
+    lights = device_manager.devices['lights']
+    plan = [(lights[f'l{rng.randrange(devices)}'], rng.randrange(101)) for _ in range(changes)]
+    path = device_manager.storage.journal.log_path('lights')
+    before = os.path.getsize(path)
+    started = time.perf_counter()
+    with device_manager.batch():
+        for device, brightness in plan:
+            device.set_brightness(brightness)
+            device_manager.save_device('lights', device.name)
+    elapsed = time.perf_counter() - started
+    patch_bytes = os.path.getsize(path) - before
+    saved = {device.name for device, brightness in plan}
+    put_bytes = sum(len(json.dumps({'op': 'put', 'name': name, 'data': lights[name].to_dict()},
+                                   separators=(',', ':'))) + 1 for name in saved)
+    device_manager.close()
+    return {
+        'changes': changes,
+        'us_per_change': elapsed / changes * 1e6,
+        'flushes_per_subscriber': calls,
+        'events_per_subscriber': delivered,
+        'devices_written': len(saved),
+        'patch_bytes': patch_bytes,
+        'put_bytes': put_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Change-event delivery and delta persistence for one burst of changes")
+    parser.add_argument('--devices', type=int, default=20000)
+    parser.add_argument('--changes', type=int, default=10000)
+    parser.add_argument('--subscribers', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        result = run(args.devices, args.changes, args.subscribers)
+        os.chdir('/')
+    if args.json:
+        print(json.dumps(result, indent=4))
+        return
+    print(f"{result['changes']} changes in one batch: {result['us_per_change']:.2f} us/change")
+    print(f"flushes per subscriber: {result['flushes_per_subscriber']}, "
+          f"events each: {result['events_per_subscriber']}")
+    print(f"journal for {result['devices_written']} devices: {result['patch_bytes']} bytes as patches, "
+          f"{result['put_bytes']} as whole records ({result['patch_bytes'] / result['put_bytes']:.0%})")
+
+
+if __name__ == '__main__':
+    main()
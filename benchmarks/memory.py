@@ -0,0 +1,113 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LIGHT import Light
+from THERMOSTAT import Thermostat
+from CAMERA import SecurityCamera
+from FAN import Fan
+from SCENES import SETTERS
+from TABLE import DeviceTable
+
+DEVICE_CLASSES = {
+    'lights': Light,
+    'thermostat': Thermostat,
+    'security_camera': SecurityCamera,
+    'fan': Fan,
+}
+
+
+def synthetic_records(device_type, count, owners=1000, locations=50):
+    # Round-trip through JSON so every string is a fresh object, as it is after load_devices
+    records = [{
+        'name': f'{device_type}-{i}',
+        'location': f'Room {i % locations}',
+        'status': 'on' if i % 2 else 'off',
+        'owner': f'user{i % owners}',
+    } for i in range(count)]
+    return json.loads(json.dumps(records))
+
+
+# A valid non-default value for every settable attribute
+CHANGES = {'status': 'on', 'brightness': 40, 'color': '#FF0000', 'temperature': 68, 'mode': 'heat',
+           'recording': True, 'resolution': '4K', 'speed': 3}
+
+
+def check_views():
+    # Every setter must work on a table view and leave it matching a device object given the same calls
+    for device_class in DEVICE_CLASSES.values():
+        device = device_class('check', 'Kitchen', 'owner')
+        view = DeviceTable(device_class).add('check', 'Kitchen', 'owner')
+        for attribute in device.to_dict():
+            if attribute in SETTERS:
+                version = view.version
+                SETTERS[attribute](device, CHANGES[attribute])
+                SETTERS[attribute](view, CHANGES[attribute])
+                assert view.version > version, f"{device_class.__name__}.{attribute} setter did not touch the view"
+        assert view.to_dict() == device.to_dict(), f"{device_class.__name__} view differs after setters"
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def run(count):
+    results = {}
+    for device_type, device_class in DEVICE_CLASSES.items():
+        records = synthetic_records(device_type, count)
+        results[device_type] = {
+            'legacy': measure(lambda: [legacy_from(device_class, record) for record in records]),
+            'objects': measure(lambda: [device_class.from_dict(record) for record in records]),
+            'table': measure(lambda: table_from(device_class, records)),
+        }
+    return results
+
+
+class LegacyDevice:
+    pass
+
+
+def legacy_from(device_class, record):
+    # Same attributes the classes held before __slots__, in a per-instance __dict__ with uninterned strings
+    device = LegacyDevice()
+    device.__dict__.update(device_class.from_dict(record).to_dict())
+    device.location = record['location']
+    device.owner = record['owner']
+    return device
+
+
+def table_from(device_class, records):
+    table = DeviceTable(device_class)
+    for record in records:
+        table.from_dict(record)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory footprint of device representations")
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+    check_views()
+    results = run(args.count)
+    if args.json:
+        print(json.dumps({'count': args.count, 'results': results}, indent=4))
+        return
+    print(f"{'type':<16}{'legacy':>14}{'objects':>14}{'table':>14}  (bytes per device, {args.count} devices)")
+    for device_type, sizes in results.items():
+        print(f"{device_type:<16}" + ''.join(f"{sizes[key] / args.count:>14.1f}" for key in ('legacy', 'objects', 'table')))
+
+
+if __name__ == '__main__':
+    main()
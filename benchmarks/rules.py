@@ -0,0 +1,100 @@
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MANAGER import DeviceManager
+from RULES import Rule, RulesEngine
+
+
+def run(rule_counts, devices, changes):
+    # Every changed thermostat is watched by exactly one rule at each count; the other rules watch
+    # idle thermostats that never change, so only the total number of rules grows
+    results = {}
+    for count in rule_counts:
+        device_manager = DeviceManager(journal=True)
+        with device_manager.batch():
+            for i in range(devices):
+                device_manager.add_device('thermostat', f't{i}', f'Room {i % 20}', 'owner')
+                device_manager.add_device('fan', f'f{i}', f'Room {i % 20}', 'owner')
+                if i % 2:
+                    device_manager.devices['thermostat'][f't{i}'].set_mode('cool')
+            for i in range(count - devices):
+                device_manager.add_device('thermostat', f'idle{i}', f'Room {i % 20}', 'owner')
+        engine = RulesEngine(device_manager, directory=None)
+        for i in range(count):
+            watched = f't{i}' if i < devices else f'idle{i - devices}'
+            engine.add_rule(Rule(f'rule{i}', [
+                {'device_type': 'thermostat', 'device': watched, 'attribute': 'temperature', 'op': '>', 'value': 80},
+                {'device_type': 'thermostat', 'device': watched, 'attribute': 'mode', 'op': '==', 'value': 'cool'},
+            ], [
+                {'device_type': 'fan', 'device': f'f{i % devices}', 'attribute': 'speed', 'value': 4},
+            ], min_interval=0), save=False)
+        # The same changes at every count
+        rng = random.Random(0)
+        thermostats = device_manager.devices['thermostat']
+        plan = [(thermostats[f't{rng.randrange(devices)}'], rng.randrange(60, 91)) for _ in range(changes)]
+        # Inside one batch saves only queue up; flushing the events after each change delivers it to
+        # the engine as a commit would, so the timing is the change plus rule dispatch
+        # The cyclic collector is paused while timing, as timeit does: a full collection walks every
+        # rule and device, which would charge the heap's size to dispatch
+        gc.disable()
+        with device_manager.batch():
+            started = time.perf_counter()
+            for device, temperature in plan:
+                device.set_temperature(temperature)
+                device_manager.save_device('thermostat', device.name, device)
+                device_manager.events.flush()
+            elapsed = time.perf_counter() - started
+        gc.enable()
+        results[count] = {'per_change_us': elapsed / changes * 1e6, **engine.stats}
+        device_manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that rule dispatch cost stays flat as the number of rules grows")
+    parser.add_argument('--rules', default='2000,10000,100000', help="comma-separated rule counts, each at least --devices")
+    parser.add_argument('--devices', type=int, default=2000, help="thermostats changed, one rule each")
+    parser.add_argument('--changes', type=int, default=20000)
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help="allowed ratio of the largest count's cost per change to the smallest's")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+    rule_counts = sorted(int(count) for count in args.rules.split(','))
+    if rule_counts[0] < args.devices:
+        parser.error("every rule count must be at least --devices")
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        results = run(rule_counts, args.devices, args.changes)
+        os.chdir('/')
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print(f"{'rules':>9}{'us/change':>12}{'evaluated':>12}{'fired':>10}")
+    for count, result in results.items():
+        print(f"{count:>9}{result['per_change_us']:>12.2f}{result['evaluated']:>12}{result['fired']:>10}")
+    smallest, largest = results[rule_counts[0]], results[rule_counts[-1]]
+    failures = []
+    if largest['evaluated'] != smallest['evaluated']:
+        failures.append(f"{largest['evaluated']} rules evaluated at {rule_counts[-1]} rules, "
+                        f"{smallest['evaluated']} at {rule_counts[0]}")
+    ratio = largest['per_change_us'] / smallest['per_change_us']
+    if ratio > args.tolerance:
+        failures.append(f"cost per change grew {ratio:.2f}x from {rule_counts[0]} to {rule_counts[-1]} rules "
+                        f"(tolerance {args.tolerance:g}x)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MANAGER import DeviceManager
+from SCHEDULER import Schedule, Scheduler
+
+
+def run(schedules, devices, churn):
+    device_manager = DeviceManager(journal=True)
+    with device_manager.batch():
+        for i in range(devices):
+            device_manager.add_device('lights', f'l{i}', f'Room {i % 20}', 'owner')
+    commits = []
+    for method in ('put', 'patch', 'write_batch'):
+        original = getattr(device_manager.storage, method)
+        setattr(device_manager.storage, method,
+                lambda *args, original=original: (commits.append(args[0]), original(*args))[1])
+
+    # Simulated day starting at local midnight; run_due is driven by hand, one call per minute
+    midnight = datetime(2024, 1, 1).timestamp()
+    clock = [midnight]
+    scheduler = Scheduler(device_manager, directory=None, clock=lambda: clock[0], start=False)
+    rng = random.Random(0)
+    started = time.perf_counter()
+    for i in range(schedules):
+        minute = rng.randrange(1440)
+        scheduler.add(Schedule(f's{i}', [{'device_type': 'lights', 'device': f'l{rng.randrange(devices)}',
+                                          'attribute': 'status', 'value': rng.choice(['on', 'off'])}],
+                               'owner', f'{minute // 60:02d}:{minute % 60:02d}'), save=False)
+    add_us = (time.perf_counter() - started) / schedules * 1e6
+
+    started = time.perf_counter()
+    for i in range(churn):
+        name = f's{rng.randrange(schedules)}'
+        schedule = scheduler.schedules[name]
+        minute = rng.randrange(1440)
+        schedule.at = f'{minute // 60:02d}:{minute % 60:02d}'
+        scheduler.add(schedule, save=False)
+    churn_us = (time.perf_counter() - started) / max(churn, 1) * 1e6
+
+    commits.clear()
+    busiest = 0
+    started = time.perf_counter()
+    for minute in range(1, 1441):
+        clock[0] = midnight + minute * 60
+        tick = time.perf_counter()
+        scheduler.run_due()
+        busiest = max(busiest, time.perf_counter() - tick)
+    elapsed = time.perf_counter() - started
+    device_manager.close()
+    return {
+        'schedules': schedules,
+        'add_us': add_us,
+        'reschedule_us': churn_us,
+        'fire_us': elapsed / max(scheduler.stats['fired'], 1) * 1e6,
+        'busiest_tick_ms': busiest * 1000,
+        'fired': scheduler.stats['fired'],
+        'ticks': scheduler.stats['ticks'],
+        'commits': len(commits),
+        'heap': len(scheduler.heap),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler cost for many daily schedules over one simulated day")
+    parser.add_argument('--schedules', default='1000,10000,100000', help="comma-separated schedule counts")
+    parser.add_argument('--devices', type=int, default=5000)
+    parser.add_argument('--churn', type=int, default=10000, help="schedules rescheduled before the day starts")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        results = [run(int(count), args.devices, args.churn) for count in args.schedules.split(',')]
+        os.chdir('/')
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print(f"{'schedules':>10}{'add us':>9}{'resched us':>12}{'fire us':>9}{'max tick ms':>13}"
+          f"{'fired':>9}{'ticks':>7}{'commits':>9}")
+    for result in results:
+        print(f"{result['schedules']:>10}{result['add_us']:>9.1f}{result['reschedule_us']:>12.1f}"
+              f"{result['fire_us']:>9.1f}{result['busiest_tick_ms']:>13.1f}{result['fired']:>9}"
+              f"{result['ticks']:>7}{result['commits']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MANAGER import DeviceManager
+from REPORT import text_sections
+from SCENES import Scene
+from SHARDS import ShardedDeviceManager
+
+
+def timed(action):
+    started = time.perf_counter()
+    result = action()
+    return time.perf_counter() - started, result
+
+
+def run(shards, devices, users, clients, updates):
+    # shards=0 is the in-process DeviceManager, for reference
+    directory = f'data{shards}'
+    if shards:
+        device_manager = ShardedDeviceManager(shards, directory)
+    else:
+        device_manager = DeviceManager(write_behind=True, journal=True)
+    owners = [f'user{i}' for i in range(users)]
+    fleet = [(f'l{i}', f'Room {i % 50}', owners[i % users]) for i in range(devices)]
+    results = {}
+
+    def build():
+        if shards:
+            device_manager.add_devices('lights', fleet)
+        else:
+            with device_manager.batch():
+                for name, location, owner in fleet:
+                    device_manager.add_device('lights', name, location, owner)
+    seconds, _ = timed(build)
+    results['build_per_s'] = devices / seconds
+
+    seconds, _ = timed(lambda: [device_manager.get_user_devices('lights', owner) for owner in owners])
+    results['user_lookups_per_s'] = users / seconds
+
+    seconds, _ = timed(lambda: ''.join(text_sections(device_manager, owners[0])))
+    results['report_s'] = seconds
+
+    scene = Scene('evening', owners[0]).add_action('lights', {'brightness': 30})
+    seconds, count = timed(lambda: device_manager.apply_scene(scene))
+    results['scene_devices_per_s'] = count / seconds
+
+    # Concurrent clients each changing random devices one at a time
+    def client(seed):
+        rng = random.Random(seed)
+        for _ in range(updates):
+            name, location, owner = fleet[rng.randrange(devices)]
+            device = device_manager.get_device('lights', name, owner)
+            device.set_brightness(rng.randrange(101))
+            device_manager.save_device('lights', name, device)
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results['updates_per_s'] = clients * updates / (time.perf_counter() - started)
+    device_manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the sharded DeviceManager against shard count")
+    parser.add_argument('--shards', default='0,1,2,4,8', help="comma-separated shard counts; 0 is in-process")
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=8, help="threads issuing single-device updates")
+    parser.add_argument('--updates', type=int, default=500, help="updates per client")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        results = {count: run(count, args.devices, args.users, args.clients, args.updates)
+                   for count in (int(count) for count in args.shards.split(','))}
+        os.chdir('/')
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print(f"{args.devices} lights, {args.users} users, {os.cpu_count()} CPUs")
+    print(f"{'shards':>7}{'build/s':>11}{'lookups/s':>11}{'report s':>10}{'scene/s':>11}{'updates/s':>11}")
+    for count, result in results.items():
+        print(f"{count or 'local':>7}{result['build_per_s']:>11.0f}{result['user_lookups_per_s']:>11.1f}"
+              f"{result['report_s']:>10.3f}{result['scene_devices_per_s']:>11.0f}{result['updates_per_s']:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MANAGER import DeviceManager
+from STORAGE import create_backend
+
+
+def check_indexes(device_manager, device_type):
+    devices = device_manager.devices[device_type]
+    indexed = set()
+    for owner, names in device_manager.owner_index[device_type].items():
+        for name in names:
+            assert devices[name].owner == owner, f"{name} indexed under wrong owner"
+            indexed.add(name)
+    assert indexed == set(devices), "owner index out of sync with devices"
+    for (owner, location), names in device_manager.owner_location_index[device_type].items():
+        for name in names:
+            assert (devices[name].owner, devices[name].location) == (owner, location)
+
+
+def run(threads, seconds, storage):
+    failures = []
+    counts = {'add': 0, 'remove': 0, 'read': 0}
+    counts_lock = threading.Lock()
+    device_manager = DeviceManager(write_behind=True, flush_interval=0.05,
+                                   storage=create_backend(storage, 'data', journal=True))
+    device_types = list(device_manager.device_classes)
+    owners = [f'user{i}' for i in range(8)]
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local = {'add': 0, 'remove': 0, 'read': 0}
+        try:
+            while time.perf_counter() < deadline:
+                device_type = rng.choice(device_types)
+                owner = rng.choice(owners)
+                action = rng.random()
+                if action < 0.4:
+                    device_manager.add_device(device_type, f'd{rng.randrange(500)}', f'Room {rng.randrange(5)}', owner)
+                    local['add'] += 1
+                elif action < 0.6:
+                    device_manager.remove_device(device_type, f'd{rng.randrange(500)}')
+                    local['remove'] += 1
+                else:
+                    for name, device in device_manager.get_user_devices(device_type, owner).items():
+                        assert device.owner == owner, f"{name} returned for the wrong owner"
+                        assert device.name == name
+                    for device in device_manager.snapshot(device_type).values():
+                        device.to_dict()
+                    local['read'] += 1
+        except Exception as e:
+            failures.append(repr(e))
+        with counts_lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    for device_type in device_types:
+        check_indexes(device_manager, device_type)
+    expected = {device_type: {name: device.to_dict() for name, device in device_manager.devices[device_type].items()}
+                for device_type in device_types}
+    device_manager.close()
+    reloaded = DeviceManager(storage=create_backend(storage, 'data', journal=True))
+    for device_type in device_types:
+        actual = {name: device.to_dict() for name, device in reloaded.devices[device_type].items()}
+        if actual != expected[device_type]:
+            failures.append(f"{device_type}: persisted state differs from memory after reload")
+    reloaded.close()
+    return counts, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer DeviceManager from many threads and check invariants")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        counts, failures = run(args.threads, args.seconds, args.storage)
+        os.chdir('/')
+    print(f"{counts['add']} adds, {counts['remove']} removes, {counts['read']} reads across {args.threads} threads")
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
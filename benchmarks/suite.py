@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MANAGER import DeviceManager
+from STORAGE import create_backend
+from REPORT import FragmentCache, text_sections
+from ANALYTICS import Analytics
+
+BENCHMARKS = ['build', 'save', 'load', 'get_user_devices', 'churn', 'round_trip', 'report', 'report_cached',
+              'analytics_build', 'analytics_query']
+
+
+def timed(action, repeat=1):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def open_manager(storage):
+    # Same storage configuration the GUI uses
+    return DeviceManager(write_behind=True, storage=create_backend(storage, 'data', journal=True), lazy=True)
+
+
+def build_fleet(device_manager, size, owners, locations=50):
+    # Spread size devices over the four types and insert them directly, as a load would
+    device_types = list(device_manager.device_classes)
+    for index, device_type in enumerate(device_types):
+        device_class = device_manager.device_classes[device_type]
+        count = size // len(device_types) + (1 if index < size % len(device_types) else 0)
+        devices = {}
+        for i in range(count):
+            device = device_class(f'{device_type}-{i}', f'Room {i % locations}', f'user{i % owners}')
+            devices[device.name] = device
+        with device_manager.locks[device_type].write():
+            device_manager.devices[device_type] = devices
+            device_manager.rebuild_indexes(device_type)
+            device_manager.versions[device_type] += 1
+        device_manager.loaded.add(device_type)
+
+
+def run_size(size, owners, storage, repeat, operations):
+    rng = random.Random(size)
+    results = {}
+    device_manager = open_manager(storage)
+    device_types = list(device_manager.device_classes)
+    results['build'] = timed(lambda: build_fleet(device_manager, size, owners))
+
+    def save():
+        for device_type in device_types:
+            device_manager.write_devices(device_type)
+    results['save'] = timed(save, repeat)
+    device_manager.close()
+
+    loaded = {}
+
+    def load():
+        if 'manager' in loaded:
+            loaded['manager'].close()
+        loaded['manager'] = open_manager(storage)
+        loaded['manager'].load_devices()
+    results['load'] = timed(load, repeat)
+    device_manager = loaded['manager']
+
+    lookups = [(rng.choice(device_types), f'user{rng.randrange(owners)}') for _ in range(operations)]
+
+    def get_user_devices():
+        for device_type, owner in lookups:
+            device_manager.get_user_devices(device_type, owner)
+    results['get_user_devices'] = timed(get_user_devices, repeat) / operations
+
+    churn_types = [rng.choice(device_types) for _ in range(operations)]
+
+    def churn():
+        with device_manager.batch():
+            for i, device_type in enumerate(churn_types):
+                device_manager.add_device(device_type, f'churn-{i}', 'Churn Room', f'user{i % owners}')
+            for i, device_type in enumerate(churn_types):
+                device_manager.remove_device(device_type, f'churn-{i}')
+    results['churn'] = timed(churn, repeat) / (2 * operations)
+    device_manager.flush()
+
+    def round_trip():
+        for device_type, device_class in device_manager.device_classes.items():
+            for device in device_manager.snapshot(device_type).values():
+                device_class.from_dict(device.to_dict())
+    results['round_trip'] = timed(round_trip, repeat) / size
+
+    report_owners = [f'user{rng.randrange(owners)}' for _ in range(min(owners, 20))]
+
+    def report(cache=None):
+        for owner in report_owners:
+            ''.join(text_sections(device_manager, owner, cache=cache))
+    results['report'] = timed(report, repeat) / len(report_owners)
+    cache = FragmentCache(max_entries=size + 1)
+    report(cache)
+    results['report_cached'] = timed(lambda: report(cache), repeat) / len(report_owners)
+
+    analytics = Analytics(device_manager)
+
+    def analytics_build():
+        analytics.stale.update(device_types)
+        for device_type in device_types:
+            analytics.table(device_type)
+    results['analytics_build'] = timed(analytics_build, repeat)
+
+    def analytics_query():
+        # The questions the Analytics report section answers, fleet-wide
+        analytics.mean('lights', 'brightness', by='location')
+        analytics.count('thermostat', [('mode', '==', 'heat'), ('temperature', '>', 80)])
+        for device_type in device_types:
+            analytics.count(device_type, [('status', '==', 'on')], by='owner')
+    results['analytics_query'] = timed(analytics_query, repeat)
+    device_manager.close()
+    return results
+
+
+def run(sizes, owners_per, storage, repeat, operations):
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                owners = max(1, size // owners_per)
+                results[str(size)] = run_size(size, owners, storage, repeat, operations)
+            finally:
+                os.chdir(cwd)
+    return results
+
+
+def compare(current, baseline, threshold):
+    # Returns (size, benchmark, baseline, current, ratio) for every timing slower than threshold allows
+    regressions = []
+    for size, timings in current['results'].items():
+        for name, seconds in timings.items():
+            before = baseline['results'].get(size, {}).get(name)
+            if before:
+                ratio = seconds / before
+                if ratio > 1 + threshold:
+                    regressions.append((size, name, before, seconds, ratio))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'size':>9}  {'benchmark':<18}{'seconds':>14}{'baseline':>14}{'ratio':>8}")
+    for size, timings in results['results'].items():
+        for name in BENCHMARKS:
+            if name not in timings:
+                continue
+            line = f"{size:>9}  {name:<18}{timings[name]:>14.6g}"
+            before = baseline['results'].get(size, {}).get(name) if baseline else None
+            if before:
+                line += f"{before:>14.6g}{timings[name] / before:>8.2f}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time DeviceManager, persistence and report hot paths on synthetic fleets")
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="comma-separated fleet sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument('--devices-per-owner', type=int, default=100)
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--repeat', type=int, default=3, help="best of N runs for each timing")
+    parser.add_argument('--operations', type=int, default=1000, help="lookups and churn operations per size")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="baseline JSON from an earlier --output run")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="flag timings more than this fraction slower than the baseline")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': args.storage,
+            'repeat': args.repeat,
+            'operations': args.operations,
+            'devices_per_owner': args.devices_per_owner,
+        },
+        'results': run(sizes, args.devices_per_owner, args.storage, args.repeat, args.operations),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for size, name, before, seconds, ratio in regressions:
+            print(f"REGRESSION: {name} at {size} devices took {seconds:.6g}s vs {before:.6g}s ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
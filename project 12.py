@@ -1,91 +1,50 @@
+import time
+IMPORT_STARTED = time.perf_counter()
 import tkinter as tk
 from tkinter import ttk, messagebox
 from tkinter.colorchooser import askcolor
+import argparse
 import json
 import os
+import queue
+import threading
 from datetime import datetime
 from DEVICE import Device
 from LIGHT import Light
-from THERMOSTAT import Thermostat
-from CAMERA import SecurityCamera
+from THERMOSTAT import Thermostat, MODES
+from CAMERA import SecurityCamera, RESOLUTIONS
 from FAN import Fan
-
-class DeviceManager:
-    def __init__(self):
-        self.devices = {
-            'lights': {},
-            'thermostat': {},
-            'security_camera': {},
-            'fan': {}
-        }
-        self.device_classes = {
-            'lights': Light,
-            'thermostat': Thermostat,
-            'security_camera': SecurityCamera,
-            'fan': Fan,
-        }
-        self.initialize_storage()
-        self.load_devices()
-
-    def initialize_storage(self):
-        os.makedirs('data', exist_ok=True)
-        for device_type in self.devices.keys():
-            filepath = os.path.join('data', f'{device_type}.json')
-            if not os.path.exists(filepath):
-                self.save_devices(device_type)
-
-    def remove_device(self, device_type, name):
-        if name in self.devices[device_type]:
-            del self.devices[device_type][name]
-            self.save_devices(device_type)
-            return True
-        return False
-
-    def get_device(self, device_type, name, username):
-        device = self.devices[device_type].get(name)
-        if device and device.owner == username:
-            return device
-        return None
-
-    def add_device(self, device_type, name, location, owner):
-        device_class = self.device_classes[device_type]
-        self.devices[device_type][name] = device_class(name, location, owner)
-        self.save_devices(device_type)
-
-    def get_user_devices(self, device_type, username):
-        return {name: device for name, device in self.devices[device_type].items() 
-            if device.owner == username}
-
-    def save_devices(self, device_type):
-        filepath = os.path.join('data', f'{device_type}.json')
-        try:
-            data = {name: device.to_dict() for name, device in self.devices[device_type].items()}
-            with open(filepath, 'w') as f:
-                json.dump(data, f, indent=4)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save {device_type}: {str(e)}")
-
-    def load_devices(self):
-        for device_type, device_class in self.device_classes.items  ():
-            filepath = os.path.join('data', f'{device_type}.json')
-            try:
-                with open(filepath, 'r') as f:
-                    data = json.load(f)
-                    self.devices[device_type] = {
-                    name: device_class.from_dict({**device_data, 'name': name})
-                    for name, device_data in data.items()
-                    }
-            except FileNotFoundError:
-                self.devices[device_type] = {}
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to load {device_type}: {str(e)}")
+from MANAGER import DeviceManager
+from STORAGE import create_backend
+from SCENES import Scene, scene_attributes, parse_value
+from SERVER import run_server, add_server_arguments
+from USERS import UserStore
+from ACTIVITY import ActivityLog, query_activity, add_query_arguments, run_query
+from REPORT import FragmentCache, text_sections, write_report, report_filename
+from METRICS import METRICS, timed
+from DISPATCH import Coalescer
+from ANALYTICS import Analytics
+from EVENTS import deltas
+from RULES import RulesEngine
+from SCHEDULER import Schedule, Scheduler
+from TELEMETRY import TelemetryStore, device_attributes
 
 class UI:
-    def __init__(self, root, device_manager):
+    def __init__(self, root, device_manager, activity_log=None, scheduler=None):
         self.root = root
         self.device_manager = device_manager
+        self.activity_log = activity_log or ActivityLog('data')
+        self.scheduler = scheduler or Scheduler(device_manager, 'data')
         self.current_user = None
         self.frames = {}
+        self.report_cache = FragmentCache()
+        self.analytics = Analytics(device_manager)
+        self.users = UserStore(device_manager.storage)
+        device_manager.events.subscribe(self.log_changes)
+        # Slider drags apply at most once per interval (ms) per device attribute; 0 applies immediately
+        self.dispatcher = Coalescer(root.after)
+        self.control_intervals = {'brightness': 16, 'temperature': 16, 'speed': 16,
+                                  'mode': 0, 'resolution': 0, 'recording': 0}
         # Updated color scheme to match second file
         self.colors = {
             'primary': "#464F5D",      # Slate Blue-Gray for buttons
@@ -98,24 +57,12 @@ class UI:
             'button_text': "#FFFFFF"   # White button text
         }
         self.setup_ui()
-        self.users = self.load_users()
 
     def setup_ui(self):
         self.root.title("Smart Home Automation")
         self.root.geometry("800x600")
         self.root.configure(bg=self.colors['background'])
 
-    def load_users(self):
-        try:
-            with open('data/users.json', 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
-
-    def save_users(self):
-        with open('data/users.json', 'w') as f:
-            json.dump(self.users, f, indent=4)
-
     def create_styled_button(self, parent, text, command, style='primary'):
         return tk.Button(
             parent,
@@ -182,12 +129,11 @@ class UI:
                 messagebox.showerror("Error", "All fields are required")
                 return
 
-            if username in self.users:
-                messagebox.showerror("Error", "Username already exists")
+            try:
+                self.users.register(username, password)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
                 return
-
-            self.users[username] = {'password': password}
-            self.save_users()
             messagebox.showinfo("Success", "Registration successful")
             self.show_login_screen()
 
@@ -214,7 +160,7 @@ class UI:
             username = username_var.get()
             password = password_var.get()
 
-            if username in self.users and self.users[username]['password'] == password:
+            if self.users.verify(username, password):
                 self.current_user = username
                 self.show_main_screen()
             else:
@@ -242,8 +188,16 @@ class UI:
                 lambda d=device_type: self.show_device_management(d)
             ).pack(pady=10)
 
+        self.create_styled_button(frame, "Scenes",
+            self.show_scenes_window).pack(pady=10)
+        self.create_styled_button(frame, "Schedules",
+            self.show_schedules_window).pack(pady=10)
         self.create_styled_button(frame, "Generate Status Report",
             self.generate_report, 'warning').pack(pady=10)
+        self.create_styled_button(frame, "Activity",
+            self.show_activity_window).pack(pady=10)
+        self.create_styled_button(frame, "Diagnostics",
+            self.show_diagnostics_window).pack(pady=10)
         self.create_styled_button(frame, "Logout",
             self.show_auth_screen, 'error').pack(pady=10)
 
@@ -312,134 +266,304 @@ class UI:
 
         window = tk.Toplevel(self.root)
         window.title(f"Control {device_type.title()}")
-        window.geometry("500x400")
+        window.geometry("500x600")
         window.configure(bg=self.colors['background'])
 
         frame = tk.Frame(window, bg=self.colors['background'])
         frame.pack(padx=20, pady=20, fill='both', expand=True)
 
-        device_var = tk.StringVar(value=list(devices.keys())[0])
-        tk.Label(frame, text="Select Device:", bg=self.colors['background'], fg=self.colors['text']).pack()
-        device_menu = ttk.Combobox(frame, textvariable=device_var, values=list(devices.keys()))
-        device_menu.pack(pady=10)
+        current = {'device': None}
+        device_var = tk.StringVar()
+
+        tk.Label(frame, text="Search Devices:", bg=self.colors['background'], fg=self.colors['text']).pack()
+        search_var = tk.StringVar()
+        ttk.Entry(frame, textvariable=search_var).pack(pady=5)
+        self.device_list(frame, sorted(devices), search_var, device_var)
 
         control_frame = tk.Frame(frame, bg=self.colors['background'])
-        control_frame.pack(pady=20)
+        control_frame.pack(pady=10)
+
+        power_var = tk.BooleanVar()
+
+        def on_power_change():
+            device = current['device']
+            device.toggle_power(power_var.get())
+            self.device_manager.save_device(device_type, device.name, device)
+            update_controls()
+
+        tk.Checkbutton(
+            control_frame,
+            text="Power",
+            variable=power_var,
+            command=on_power_change,
+            bg=self.colors['background']
+        ).pack(pady=10)
 
-        def update_controls(*args):
-            for widget in control_frame.winfo_children():
-                widget.destroy()
-
-            device = devices[device_var.get()]
-            power_var = tk.BooleanVar(value=device.status == 'on')
-
-            def on_power_change():
-                device.toggle_power(power_var.get())
-                self.device_manager.save_devices(device_type)
-                update_controls()
-
-            tk.Checkbutton(
-                control_frame,
-                text="Power",
-                variable=power_var,
-                command=on_power_change,
-                bg=self.colors['background']
-            ).pack(pady=10)
+        # One widget set per device class, built on first use and rebound to whichever device is
+        # selected; callbacks act on current['device'], so nothing is rebuilt or re-traced
+        panels = {}
+
+        def save(device):
+            self.device_manager.save_device(device_type, device.name, device)
 
-            if device.status == 'on':
-                if isinstance(device, Light):
-                    brightness = tk.Scale(
-                        control_frame,
-                        from_=0, to=100,
-                        orient='horizontal',
-                        label="Brightness",
-                        command=lambda v: (
-                            device.set_brightness(float(v)),
-                            self.device_manager.save_devices(device_type)
-                        )
-                    )
-                    brightness.set(device.brightness)
-                    brightness.pack(pady=10)
-
-                    self.create_styled_button(
-                        control_frame,
-                        "Change Color",
-                        lambda: self.show_color_picker(device_type, device_var.get())
-                    ).pack(pady=10)
-
-                elif isinstance(device, Thermostat):
-                    temp = tk.Scale(
-                        control_frame,
-                        from_=60, to=90,
-                        orient='horizontal',
-                        label="Temperature (°F)",
-                        command=lambda v: (
-                            device.set_temperature(float(v)),
-                            self.device_manager.save_devices(device_type)
-                        )
-                    )
-                    temp.set(device.temperature)
-                    temp.pack(pady=10)
-
-                    modes = ['auto', 'heat', 'cool', 'off']
-                    mode_var = tk.StringVar(value=device.mode)
-                    tk.Label(control_frame, text="Mode:", bg=self.colors['background']).pack()
-                    mode_menu = ttk.Combobox(
-                        control_frame,
-                        textvariable=mode_var,
-                        values=modes,
-                        state='readonly'
-                    )
-                    mode_menu.pack(pady=10)
-                    mode_var.trace('w', lambda *args: (
-                        device.set_mode(mode_var.get()),
-                        self.device_manager.save_devices(device_type)
-                    ))
-
-                elif isinstance(device, SecurityCamera):
-                    recording_var = tk.BooleanVar(value=device.recording)
-                    tk.Checkbutton(
-                        control_frame,
-                        text="Recording",
-                        variable=recording_var,
-                        command=lambda: (
-                            device.toggle_recording(recording_var.get()),
-                            self.device_manager.save_devices(device_type)
-                        ),
-                        bg=self.colors['background']
-                    ).pack(pady=10)
-
-                    resolutions = ['720p', '1080p', '4K']
-                    res_var = tk.StringVar(value=device.resolution)
-                    tk.Label(control_frame, text="Resolution:", bg=self.colors['background']).pack()
-                    res_menu = ttk.Combobox(
-                        control_frame,
-                        textvariable=res_var,
-                        values=resolutions,
-                        state='readonly'
-                    )
-                    res_menu.pack(pady=10)
-                    res_var.trace('w', lambda *args: (
-                        device.set_resolution(res_var.get()),
-                        self.device_manager.save_devices(device_type)
-                    ))
-
-                elif isinstance(device, Fan):
-                    speed = tk.Scale(
-                        control_frame,
-                        from_=0, to=5,
-                        orient='horizontal',
-                        label="Speed",
-                        command=lambda v: (
-                            device.set_speed(float(v)),
-                            self.device_manager.save_devices(device_type)
-                        )
-                    )
-                    speed.set(device.speed)
-                    speed.pack(pady=10)
+        def change(attribute, value, apply):
+            self.dispatch_change(device_type, current['device'], attribute, value, apply)
+
+        def commit_on_release(scale, attribute):
+            scale.bind('<ButtonRelease-1>', lambda event: self.dispatcher.commit(
+                (device_type, current['device'].name, attribute)))
+
+        def on_changes(events):
+            # Show rule and schedule changes as they land, on whichever thread they ran; the window
+            # already shows what the user changed here
+            device = current['device']
+            if device is None:
+                return
+            if any(event.source is not None and event.device_type == device_type and event.name == device.name
+                   for event in events):
+                try:
+                    window.after(0, update_controls)
+                except tk.TclError:
+                    pass
+
+        def closed(event):
+            if event.widget is window:
+                self.dispatcher.commit()
+                self.device_manager.events.unsubscribe(on_changes)
+
+        self.device_manager.events.subscribe(on_changes)
+        window.bind('<Destroy>', closed)
+
+        def light_panel(panel):
+            def on_brightness(value):
+                device, value = current['device'], float(value)
+                change('brightness', value, lambda: (device.set_brightness(value), save(device)))
+
+            brightness = tk.Scale(panel, from_=0, to=100, orient='horizontal', label="Brightness",
+                                  command=on_brightness)
+            brightness.pack(pady=10)
+            commit_on_release(brightness, 'brightness')
+            self.create_styled_button(
+                panel,
+                "Change Color",
+                lambda: self.show_color_picker(device_type, current['device'].name)
+            ).pack(pady=10)
+            return lambda device: brightness.set(device.brightness)
+
+        def thermostat_panel(panel):
+            def on_temperature(value):
+                device, value = current['device'], float(value)
+                change('temperature', value, lambda: (device.set_temperature(value), save(device)))
+
+            temp = tk.Scale(panel, from_=60, to=90, orient='horizontal', label="Temperature (°F)",
+                            command=on_temperature)
+            temp.pack(pady=10)
+            commit_on_release(temp, 'temperature')
+            mode_var = tk.StringVar()
+            tk.Label(panel, text="Mode:", bg=self.colors['background']).pack()
+            ttk.Combobox(panel, textvariable=mode_var, values=list(MODES), state='readonly').pack(pady=10)
+
+            def on_mode(*args):
+                device, value = current['device'], mode_var.get()
+                change('mode', value, lambda: (device.set_mode(value), save(device)))
+
+            mode_var.trace('w', on_mode)
+
+            def bind(device):
+                temp.set(device.temperature)
+                mode_var.set(device.mode)
+            return bind
+
+        def camera_panel(panel):
+            recording_var = tk.BooleanVar()
+
+            def on_recording():
+                device, value = current['device'], recording_var.get()
+                change('recording', value, lambda: (device.toggle_recording(value), save(device)))
+
+            tk.Checkbutton(panel, text="Recording", variable=recording_var, command=on_recording,
+                           bg=self.colors['background']).pack(pady=10)
+            res_var = tk.StringVar()
+            tk.Label(panel, text="Resolution:", bg=self.colors['background']).pack()
+            ttk.Combobox(panel, textvariable=res_var, values=list(RESOLUTIONS), state='readonly').pack(pady=10)
+
+            def on_resolution(*args):
+                device, value = current['device'], res_var.get()
+                change('resolution', value, lambda: (device.set_resolution(value), save(device)))
+
+            res_var.trace('w', on_resolution)
+
+            def bind(device):
+                recording_var.set(device.recording)
+                res_var.set(device.resolution)
+            return bind
+
+        def fan_panel(panel):
+            def on_speed(value):
+                device, value = current['device'], float(value)
+                change('speed', value, lambda: (device.set_speed(value), save(device)))
+
+            speed = tk.Scale(panel, from_=0, to=5, orient='horizontal', label="Speed", command=on_speed)
+            speed.pack(pady=10)
+            commit_on_release(speed, 'speed')
+            return lambda device: speed.set(device.speed)
+
+        builders = [(Light, light_panel), (Thermostat, thermostat_panel),
+                    (SecurityCamera, camera_panel), (Fan, fan_panel)]
+
+        def panel_for(device):
+            for device_class, build in builders:
+                if isinstance(device, device_class):
+                    if device_class not in panels:
+                        panel = tk.Frame(control_frame, bg=self.colors['background'])
+                        panels[device_class] = (panel, build(panel))
+                    return panels[device_class]
+            return None
+
+        @timed('ui.update_controls', profile=True)
+        def update_controls(*args):
+            device = devices.get(device_var.get())
+            if device is None:
+                return
+            current['device'] = device
+            power_var.set(device.status == 'on')
+            shown = panel_for(device) if device.status == 'on' else None
+            for panel, bind in panels.values():
+                if shown is None or panel is not shown[0]:
+                    panel.pack_forget()
+            if shown is not None:
+                panel, bind = shown
+                bind(device)
+                if not panel.winfo_ismapped():
+                    panel.pack()
+            if chart is not None:
+                attributes = device_attributes(type(device))
+                attribute_menu.configure(values=attributes)
+                if attribute_var.get() not in attributes:
+                    attribute_var.set(attributes[-1])
+                refresh_chart()
+
+        chart = None
+        telemetry = self.device_manager.telemetry
+        if telemetry is not None:
+            ranges = {'1 hour': 3600, '24 hours': 86400, '7 days': 7 * 86400, '30 days': 30 * 86400}
+            chart_frame = tk.Frame(frame, bg=self.colors['background'])
+            chart_frame.pack(pady=5)
+            attribute_var = tk.StringVar()
+            range_var = tk.StringVar(value='1 hour')
+            attribute_menu = ttk.Combobox(chart_frame, textvariable=attribute_var, state='readonly', width=12)
+            attribute_menu.pack(side='left', padx=5)
+            ttk.Combobox(chart_frame, textvariable=range_var, values=list(ranges), state='readonly',
+                         width=10).pack(side='left', padx=5)
+            chart = tk.Canvas(frame, width=440, height=140, bg=self.colors['surface'], highlightthickness=0)
+            chart.pack(pady=5)
+
+            def refresh_chart(*args):
+                device = current['device']
+                if device is None or not chart.winfo_exists():
+                    return
+                end = time.time()
+                start = end - ranges[range_var.get()]
+                points = telemetry.history(device_type, device.name, attribute_var.get(), start)
+                self.draw_history(chart, points, start, end)
+
+            def poll_chart():
+                if chart.winfo_exists():
+                    refresh_chart()
+                    window.after(2000, poll_chart)
+
+            attribute_var.trace('w', refresh_chart)
+            range_var.trace('w', refresh_chart)
+            window.after(2000, poll_chart)
 
         device_var.trace('w', update_controls)
-        update_controls()
+        device_var.set(sorted(devices)[0])
+
+    def draw_history(self, canvas, points, start, end):
+        canvas.delete('all')
+        width, height, margin = int(canvas['width']), int(canvas['height']), 20
+        if not points:
+            canvas.create_text(width // 2, height // 2, text="No history yet", fill=self.colors['text'])
+            return
+        # At most one point per pixel column; the store already downsampled long ranges
+        step = max(1, len(points) // (width - 2 * margin))
+        points = points[::step] + ([points[-1]] if (len(points) - 1) % step else [])
+        values = [value for timestamp, value in points]
+        low, high = min(values), max(values)
+        span = (high - low) or 1.0
+        coordinates = []
+        for timestamp, value in points:
+            x = margin + (max(timestamp, start) - start) / (end - start) * (width - 2 * margin)
+            y = height - margin - (value - low) / span * (height - 2 * margin)
+            coordinates.extend((x, y))
+        # Hold the last value until now, like a step chart
+        coordinates.extend((width - margin, coordinates[-1]))
+        canvas.create_line(*coordinates, fill="#60A5FA", width=2)
+        canvas.create_text(margin, margin // 2, text=f"{high:g}", anchor='w', fill=self.colors['text'])
+        canvas.create_text(margin, height - margin // 2, text=f"{low:g}", anchor='w', fill=self.colors['text'])
+
+    def dispatch_change(self, device_type, device, attribute, value, apply):
+        # Skips values the device already has (e.g. a Scale echoing a rebind) unless an update is
+        # still pending, in which case the latest value must win
+        key = (device_type, device.name, attribute)
+        if key not in self.dispatcher.pending and getattr(device, attribute) == value:
+            return
+        self.dispatcher.submit(key, apply, self.control_intervals.get(attribute))
+
+    def device_list(self, parent, names, search_var, selected_var, rows=8):
+        # Only the visible rows live in the Listbox; the scrollbar and wheel move a window over the
+        # filtered name list, so thousands of devices cost no more than eight
+        state = {'names': names, 'top': 0}
+        list_frame = tk.Frame(parent, bg=self.colors['background'])
+        list_frame.pack(pady=5)
+        listbox = tk.Listbox(list_frame, height=rows, width=40, exportselection=False,
+                             bg=self.colors['surface'], fg=self.colors['text'])
+        listbox.pack(side='left')
+        count_var = tk.StringVar()
+        tk.Label(parent, textvariable=count_var, bg=self.colors['background'], fg=self.colors['text']).pack()
+
+        def render():
+            visible = state['names'][state['top']:state['top'] + rows]
+            listbox.delete(0, tk.END)
+            if visible:
+                listbox.insert(tk.END, *visible)
+            if selected_var.get() in visible:
+                listbox.selection_set(visible.index(selected_var.get()))
+            total = len(state['names']) or 1
+            scrollbar.set(state['top'] / total, min(1.0, (state['top'] + rows) / total))
+            count_var.set(f"{len(state['names'])} of {len(names)} devices")
+
+        def scroll(action, amount, unit=None):
+            if action == 'moveto':
+                top = int(float(amount) * len(state['names']))
+            else:
+                top = state['top'] + int(amount) * (rows if unit == 'pages' else 1)
+            state['top'] = max(0, min(top, len(state['names']) - rows))
+            render()
+
+        def wheel(event):
+            scroll('scroll', -1 if event.num == 4 or event.delta > 0 else 1, 'units')
+            return 'break'
+
+        def on_select(event):
+            selection = listbox.curselection()
+            if selection:
+                selected_var.set(state['names'][state['top'] + selection[0]])
+
+        def on_search(*args):
+            query = search_var.get().strip().lower()
+            state['names'] = [name for name in names if query in name.lower()] if query else names
+            state['top'] = 0
+            render()
+
+        scrollbar = tk.Scrollbar(list_frame, orient='vertical', command=scroll)
+        scrollbar.pack(side='left', fill='y')
+        listbox.bind('<<ListboxSelect>>', on_select)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            listbox.bind(sequence, wheel)
+        search_var.trace('w', on_search)
+        selected_var.trace('w', lambda *args: render())
+        render()
 
     def show_color_picker(self, device_type, device_name):
         device = self.device_manager.devices[device_type][device_name]
@@ -459,7 +583,7 @@ class UI:
         def select_color(color):
             try:
                 device.set_color(color)
-                self.device_manager.save_devices(device_type)
+                self.device_manager.save_device(device_type, device_name, device)
                 self.log_status(f"Changed light {device_name} color to: {color}")
                 color_window.destroy()
             except Exception as e:
@@ -524,6 +648,221 @@ class UI:
         self.create_styled_button(frame, "Remove Device", remove_device, 'error').pack(pady=20)
         self.create_styled_button(frame, "Cancel", window.destroy, 'warning').pack()
 
+    def show_scenes_window(self):
+        window = tk.Toplevel(self.root)
+        window.title("Scenes")
+        window.geometry("500x550")
+        window.configure(bg=self.colors['background'])
+
+        frame = tk.Frame(window, bg=self.colors['background'])
+        frame.pack(padx=20, pady=20, fill='both', expand=True)
+
+        tk.Label(frame, text="Scenes", font=('Helvetica', 18, 'bold'),
+                bg=self.colors['background'], fg=self.colors['text']).pack(pady=10)
+
+        scene_list = tk.Listbox(frame, height=6, bg=self.colors['surface'], fg=self.colors['text'])
+        scene_list.pack(fill='x', pady=5)
+
+        def refresh():
+            scene_list.delete(0, tk.END)
+            for name in self.device_manager.scenes.user_scenes(self.current_user):
+                scene_list.insert(tk.END, name)
+
+        def selected_scene():
+            selection = scene_list.curselection()
+            if not selection:
+                messagebox.showerror("Error", "Select a scene first")
+                return None
+            return self.device_manager.scenes.user_scenes(self.current_user)[scene_list.get(selection[0])]
+
+        def apply_scene():
+            scene = selected_scene()
+            if scene is None:
+                return
+            try:
+                count = self.device_manager.apply_scene(scene)
+                self.log_status(f"Applied scene {scene.name} to {count} devices")
+                messagebox.showinfo("Success", f"Scene applied to {count} devices")
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to apply scene: {str(e)}")
+
+        def delete_scene():
+            scene = selected_scene()
+            if scene is not None and messagebox.askyesno("Confirm", f"Delete scene {scene.name}?"):
+                self.device_manager.scenes.remove(self.current_user, scene.name)
+                refresh()
+
+        button_frame = tk.Frame(frame, bg=self.colors['background'])
+        button_frame.pack(pady=5)
+        self.create_styled_button(button_frame, "Apply", apply_scene, 'success').pack(side='left', padx=5)
+        self.create_styled_button(button_frame, "Delete", delete_scene, 'error').pack(side='left', padx=5)
+
+        tk.Label(frame, text="New Scene", font=('Helvetica', 14, 'bold'),
+                bg=self.colors['background'], fg=self.colors['text']).pack(pady=10)
+
+        form = tk.Frame(frame, bg=self.colors['background'])
+        form.pack()
+        name_var = tk.StringVar()
+        type_var = tk.StringVar(value='lights')
+        location_var = tk.StringVar()
+        attribute_var = tk.StringVar()
+        value_var = tk.StringVar()
+
+        fields = [
+            ("Scene Name:", ttk.Entry(form, textvariable=name_var)),
+            ("Device Type:", ttk.Combobox(form, textvariable=type_var, state='readonly',
+                                          values=list(self.device_manager.device_classes))),
+            ("Location (optional):", ttk.Entry(form, textvariable=location_var)),
+            ("Attribute:", ttk.Combobox(form, textvariable=attribute_var, state='readonly')),
+            ("Value:", ttk.Entry(form, textvariable=value_var)),
+        ]
+        for row, (label, widget) in enumerate(fields):
+            tk.Label(form, text=label, bg=self.colors['background'], fg=self.colors['text']).grid(
+                row=row, column=0, sticky='e', pady=3)
+            widget.grid(row=row, column=1, pady=3)
+        attribute_menu = fields[3][1]
+
+        def update_attributes(*args):
+            attributes = scene_attributes(self.device_manager.device_classes[type_var.get()])
+            attribute_menu.configure(values=attributes)
+            attribute_var.set(attributes[0])
+
+        def create_scene():
+            name = name_var.get().strip()
+            attribute = attribute_var.get()
+            if not name or not value_var.get().strip():
+                messagebox.showerror("Error", "Scene name and value are required")
+                return
+            try:
+                scene = Scene(name, self.current_user).add_action(
+                    type_var.get(),
+                    {attribute: parse_value(attribute, value_var.get())},
+                    location_var.get().strip() or None
+                )
+                scene.validate(self.device_manager)
+            except Exception as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.device_manager.scenes.add(scene)
+            self.log_status(f"Created scene: {name}")
+            refresh()
+
+        type_var.trace('w', update_attributes)
+        update_attributes()
+        refresh()
+
+        self.create_styled_button(frame, "Save Scene", create_scene, 'success').pack(pady=10)
+        self.create_styled_button(frame, "Close", window.destroy, 'warning').pack()
+
+    def show_schedules_window(self):
+        window = tk.Toplevel(self.root)
+        window.title("Schedules")
+        window.geometry("500x600")
+        window.configure(bg=self.colors['background'])
+
+        frame = tk.Frame(window, bg=self.colors['background'])
+        frame.pack(padx=20, pady=20, fill='both', expand=True)
+
+        tk.Label(frame, text="Schedules", font=('Helvetica', 18, 'bold'),
+                bg=self.colors['background'], fg=self.colors['text']).pack(pady=10)
+
+        schedule_list = tk.Listbox(frame, height=8, bg=self.colors['surface'], fg=self.colors['text'])
+        schedule_list.pack(fill='x', pady=5)
+        names = []
+
+        def refresh():
+            schedule_list.delete(0, tk.END)
+            names.clear()
+            for name, schedule in sorted(self.scheduler.user_schedules(self.current_user).items()):
+                due = self.scheduler.next_due(name)
+                when = datetime.fromtimestamp(due).strftime('%a %H:%M') if due else '-'
+                action = schedule.actions[0]
+                schedule_list.insert(tk.END, f"{name}: {action['device']} {action['attribute']}="
+                                             f"{action['value']} ({schedule.describe()}, next {when})")
+                names.append(name)
+
+        def delete_schedule():
+            selection = schedule_list.curselection()
+            if not selection:
+                messagebox.showerror("Error", "Select a schedule first")
+                return
+            name = names[selection[0]]
+            if messagebox.askyesno("Confirm", f"Delete schedule {name}?"):
+                self.scheduler.remove(name)
+                self.log_status(f"Deleted schedule: {name}")
+                refresh()
+
+        self.create_styled_button(frame, "Delete", delete_schedule, 'error').pack(pady=5)
+
+        tk.Label(frame, text="New Schedule", font=('Helvetica', 14, 'bold'),
+                bg=self.colors['background'], fg=self.colors['text']).pack(pady=10)
+
+        form = tk.Frame(frame, bg=self.colors['background'])
+        form.pack()
+        name_var = tk.StringVar()
+        type_var = tk.StringVar(value='lights')
+        device_var = tk.StringVar()
+        attribute_var = tk.StringVar()
+        value_var = tk.StringVar()
+        time_var = tk.StringVar(value='23:00')
+        days_var = tk.StringVar()
+
+        fields = [
+            ("Schedule Name:", ttk.Entry(form, textvariable=name_var)),
+            ("Device Type:", ttk.Combobox(form, textvariable=type_var, state='readonly',
+                                          values=list(self.device_manager.device_classes))),
+            ("Device:", ttk.Combobox(form, textvariable=device_var, state='readonly')),
+            ("Attribute:", ttk.Combobox(form, textvariable=attribute_var, state='readonly')),
+            ("Value:", ttk.Entry(form, textvariable=value_var)),
+            ("Time (HH:MM):", ttk.Entry(form, textvariable=time_var)),
+            ("Days (e.g. mon,fri):", ttk.Entry(form, textvariable=days_var)),
+        ]
+        for row, (label, widget) in enumerate(fields):
+            tk.Label(form, text=label, bg=self.colors['background'], fg=self.colors['text']).grid(
+                row=row, column=0, sticky='e', pady=3)
+            widget.grid(row=row, column=1, pady=3)
+        device_menu = fields[2][1]
+        attribute_menu = fields[3][1]
+
+        def update_type(*args):
+            device_type = type_var.get()
+            devices = sorted(self.device_manager.get_user_devices(device_type, self.current_user))
+            device_menu.configure(values=devices)
+            device_var.set(devices[0] if devices else '')
+            attributes = scene_attributes(self.device_manager.device_classes[device_type])
+            attribute_menu.configure(values=attributes)
+            attribute_var.set(attributes[0])
+
+        def create_schedule():
+            name = name_var.get().strip()
+            attribute = attribute_var.get()
+            if not name or not device_var.get() or not value_var.get().strip():
+                messagebox.showerror("Error", "Schedule name, device and value are required")
+                return
+            existing = self.scheduler.schedules.get(name)
+            if existing is not None and existing.owner != self.current_user:
+                messagebox.showerror("Error", "Schedule name already exists")
+                return
+            days = [day.strip().lower()[:3] for day in days_var.get().split(',') if day.strip()]
+            try:
+                action = {'device_type': type_var.get(), 'device': device_var.get(),
+                          'attribute': attribute, 'value': parse_value(attribute, value_var.get())}
+                self.scheduler.add(Schedule(name, [action], self.current_user, time_var.get().strip(),
+                                            days or None))
+            except Exception as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.log_status(f"Created schedule: {name}")
+            refresh()
+
+        type_var.trace('w', update_type)
+        update_type()
+        refresh()
+
+        self.create_styled_button(frame, "Save Schedule", create_schedule, 'success').pack(pady=10)
+        self.create_styled_button(frame, "Close", window.destroy, 'warning').pack()
+
+    @timed('ui.generate_report')
     def generate_report(self):
         try:
             window = tk.Toplevel(self.root)
@@ -536,94 +875,325 @@ class UI:
 
             text_widget = tk.Text(frame, wrap=tk.WORD, bg=self.colors['surface'], fg=self.colors['text'])
             text_widget.pack(fill='both', expand=True, pady=10)
-
-            report = [
-                "=== Smart Home Status Report ===",
-                f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                f"Generated by: {self.current_user}\n"
-            ]
-
-            device_types = {
-                'lights': 'Lights',
-                'thermostat': 'Thermostat',
-                'security_camera': 'Security Camera',
-                'fan': 'Fan'
-            }
-
-            has_devices = False
-            for device_type, display_name in device_types.items():
-                devices = self.device_manager.get_user_devices(device_type, self.current_user)
-                report.append(f"\n=== {display_name} ===")
-                
-                if not devices:
-                    report.append("No devices found")
-                    continue
-                    
-                has_devices = True
-                for name, device in devices.items():
-                    report.extend([
-                        f"\nDevice: {name}",
-                        f"Location: {device.location}",
-                        f"Status: {device.status}"
-                    ])
-
-                    if isinstance(device, Light):
-                        report.extend([
-                            f"Brightness: {device.brightness}%",
-                            f"Color: {device.color}"
-                        ])
-                    elif isinstance(device, Thermostat):
-                        report.extend([
-                            f"Temperature: {device.temperature}°F",
-                            f"Mode: {device.mode}"
-                        ])
-                    elif isinstance(device, SecurityCamera):
-                        report.extend([
-                            f"Recording: {'Yes' if device.recording else 'No'}",
-                            f"Resolution: {device.resolution}"
-                        ])
-                    elif isinstance(device, Fan):
-                        report.extend([
-                            f"Speed: {device.speed}"
-                        ])
-
-            report_text = "\n".join(report)
-            text_widget.insert('1.0', report_text)
             text_widget.config(state='disabled')
 
-            def save_report():
-                filename = f"smart_home_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+            stats_var = tk.StringVar(value="Generating...")
+            tk.Label(frame, textvariable=stats_var, bg=self.colors['background'], fg=self.colors['text']).pack()
+            stats_before = self.report_cache.stats()
+
+            generated_at = datetime.now()
+            username = self.current_user
+            chunks = queue.Queue()
+            cancelled = threading.Event()
+            window.bind('<Destroy>', lambda event: cancelled.set() if event.widget is window else None)
+
+            # The report is built on a worker thread and handed to the Text widget a few
+            # chunks per tick, so a large household never freezes the window. The worker is
+            # what "profile next action" captures, since that is where the report is rendered.
+            @timed('report.produce', profile=True)
+            def render():
+                for chunk in text_sections(self.device_manager, username, generated_at, cache=self.report_cache,
+                                           analytics=self.analytics):
+                    if cancelled.is_set():
+                        return
+                    chunks.put(chunk)
+
+            def produce():
+                try:
+                    render()
+                except Exception as e:
+                    chunks.put(e)
+                chunks.put(None)
+
+            def drain():
+                if cancelled.is_set():
+                    return
+                text_widget.config(state='normal')
+                try:
+                    for _ in range(20):
+                        chunk = chunks.get_nowait()
+                        if chunk is None:
+                            stats = self.report_cache.stats()
+                            stats_var.set(
+                                f"Cached: {stats['hits'] - stats_before['hits']}, "
+                                f"new: {stats['misses'] - stats_before['misses']}, "
+                                f"re-rendered: {stats['rerendered'] - stats_before['rerendered']}"
+                            )
+                            return
+                        if isinstance(chunk, Exception):
+                            messagebox.showerror("Error", f"Failed to generate report: {str(chunk)}")
+                            return
+                        text_widget.insert(tk.END, chunk)
+                except queue.Empty:
+                    pass
+                finally:
+                    text_widget.config(state='disabled')
+                self.root.after(30, drain)
+
+            threading.Thread(target=produce, name="report", daemon=True).start()
+            drain()
+
+            def save_report(report_format):
+                filename = report_filename(report_format)
                 filepath = os.path.join('data', filename)
-                with open(filepath, 'w') as f:
-                    f.write(report_text)
-                messagebox.showinfo("Success", f"Report saved as {filename}")
+
+                def write():
+                    try:
+                        with METRICS.timer(f'report.save_{report_format}'):
+                            write_report(filepath, report_format, self.device_manager, username, generated_at,
+                                         cache=self.report_cache, analytics=self.analytics)
+                        self.root.after(0, lambda: messagebox.showinfo("Success", f"Report saved as {filename}"))
+                    except Exception as e:
+                        message = f"Failed to save report: {str(e)}"
+                        self.root.after(0, lambda: messagebox.showerror("Error", message))
+
+                threading.Thread(target=write, name="report-save", daemon=True).start()
 
             button_frame = tk.Frame(frame, bg=self.colors['background'])
             button_frame.pack(pady=10)
                 
-            self.create_styled_button(button_frame, "Save Report", save_report, 'success').pack(side='left', padx=5)
+            self.create_styled_button(button_frame, "Save Report",
+                lambda: save_report('text'), 'success').pack(side='left', padx=5)
+            self.create_styled_button(button_frame, "Save CSV",
+                lambda: save_report('csv'), 'success').pack(side='left', padx=5)
+            self.create_styled_button(button_frame, "Save JSON Lines",
+                lambda: save_report('jsonl'), 'success').pack(side='left', padx=5)
             self.create_styled_button(button_frame, "Close", window.destroy, 'warning').pack(side='left', padx=5)
 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to generate report: {str(e)}")
                                  
+    def show_activity_window(self):
+        window = tk.Toplevel(self.root)
+        window.title("Activity")
+        window.geometry("800x600")
+        window.configure(bg=self.colors['background'])
+
+        frame = tk.Frame(window, bg=self.colors['background'])
+        frame.pack(padx=20, pady=20, fill='both', expand=True)
+
+        form = tk.Frame(frame, bg=self.colors['background'])
+        form.pack()
+        since_var = tk.StringVar(value=datetime.now().strftime('%Y-%m-%d'))
+        until_var = tk.StringVar()
+        device_var = tk.StringVar()
+        for column, (label, variable) in enumerate((("From:", since_var), ("To:", until_var),
+                                                    ("Device:", device_var))):
+            tk.Label(form, text=label, bg=self.colors['background'], fg=self.colors['text']).grid(
+                row=0, column=column * 2, padx=3)
+            ttk.Entry(form, textvariable=variable, width=18).grid(row=0, column=column * 2 + 1, padx=3)
+
+        text_widget = tk.Text(frame, wrap=tk.WORD, bg=self.colors['surface'], fg=self.colors['text'])
+        text_widget.pack(fill='both', expand=True, pady=10)
+        text_widget.config(state='disabled')
+        count_var = tk.StringVar()
+        tk.Label(frame, textvariable=count_var, bg=self.colors['background'], fg=self.colors['text']).pack()
+
+        log_path = self.activity_log.path if self.activity_log else os.path.join('data', 'status_report.txt')
+        username = self.current_user
+
+        # Only the index buckets overlapping the range are read, on a worker thread
+        def search():
+            since, until, device = since_var.get().strip(), until_var.get().strip(), device_var.get().strip()
+            count_var.set("Searching...")
+
+            def run():
+                try:
+                    if self.activity_log:
+                        self.activity_log.flush()
+                    lines = list(query_activity(log_path, since or None, until or None, username, device or None))
+                    self.root.after(0, lambda: show(lines))
+                except Exception as e:
+                    message = f"Failed to query activity: {str(e)}"
+                    self.root.after(0, lambda: messagebox.showerror("Error", message))
+
+            threading.Thread(target=run, name="activity-query", daemon=True).start()
+
+        def show(lines):
+            if not window.winfo_exists():
+                return
+            text_widget.config(state='normal')
+            text_widget.delete('1.0', tk.END)
+            text_widget.insert(tk.END, "\n".join(lines[-2000:]))
+            text_widget.config(state='disabled')
+            shown = min(len(lines), 2000)
+            count_var.set(f"{len(lines)} events" + (f" (showing last {shown})" if shown < len(lines) else ""))
+
+        button_frame = tk.Frame(frame, bg=self.colors['background'])
+        button_frame.pack(pady=10)
+        self.create_styled_button(button_frame, "Search", search, 'success').pack(side='left', padx=5)
+        self.create_styled_button(button_frame, "Close", window.destroy, 'warning').pack(side='left', padx=5)
+        search()
+
+    def show_diagnostics_window(self):
+        window = tk.Toplevel(self.root)
+        window.title("Diagnostics")
+        window.geometry("800x600")
+        window.configure(bg=self.colors['background'])
+
+        frame = tk.Frame(window, bg=self.colors['background'])
+        frame.pack(padx=20, pady=20, fill='both', expand=True)
+
+        enabled_var = tk.BooleanVar(value=METRICS.enabled)
+
+        def toggle():
+            METRICS.enabled = enabled_var.get()
+            refresh()
+
+        tk.Checkbutton(frame, text="Collect timings", variable=enabled_var, command=toggle,
+                      bg=self.colors['background'], fg=self.colors['text'],
+                      selectcolor=self.colors['surface']).pack()
+
+        text_widget = tk.Text(frame, wrap=tk.NONE, font=('Courier', 10),
+                              bg=self.colors['surface'], fg=self.colors['text'])
+        text_widget.pack(fill='both', expand=True, pady=10)
+        status_var = tk.StringVar()
+        tk.Label(frame, textvariable=status_var, bg=self.colors['background'], fg=self.colors['text']).pack()
+
+        def refresh():
+            if not window.winfo_exists():
+                return
+            snapshot = METRICS.snapshot()
+            lines = [f"{'timer':<34}{'calls':>8}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}{'total ms':>12}"]
+            for name, timer in snapshot['timers'].items():
+                lines.append(f"{name:<34}{timer['count']:>8}{timer['mean_ms']:>10.3f}{timer['p95_ms']:>10g}"
+                             f"{timer['max_ms']:>10.2f}{timer['total_ms']:>12.1f}")
+            if snapshot['counters']:
+                lines.append("")
+                lines.extend(f"{name:<34}{value:>12}" for name, value in snapshot['counters'].items())
+            if snapshot['last_profile']:
+                lines.append(f"\nLast profile: {snapshot['last_profile']}")
+            text_widget.config(state='normal')
+            text_widget.delete('1.0', tk.END)
+            text_widget.insert(tk.END, "\n".join(lines))
+            text_widget.config(state='disabled')
+
+        def poll():
+            if window.winfo_exists():
+                refresh()
+                window.after(1000, poll)
+
+        def save_snapshot():
+            path = os.path.join('data', f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            try:
+                METRICS.dump(path)
+                status_var.set(f"Saved {path}")
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save metrics: {str(e)}")
+
+        def profile_next():
+            enabled_var.set(True)
+            METRICS.enabled = True
+            METRICS.arm_profile()
+            status_var.set("The next control update or report will be profiled")
+
+        def reset():
+            METRICS.reset()
+            refresh()
+
+        button_frame = tk.Frame(frame, bg=self.colors['background'])
+        button_frame.pack(pady=10)
+        self.create_styled_button(button_frame, "Save JSON", save_snapshot, 'success').pack(side='left', padx=5)
+        self.create_styled_button(button_frame, "Profile Next Action", profile_next).pack(side='left', padx=5)
+        self.create_styled_button(button_frame, "Reset", reset, 'error').pack(side='left', padx=5)
+        self.create_styled_button(button_frame, "Close", window.destroy, 'warning').pack(side='left', padx=5)
+        poll()
+
+    @timed('ui.log_status')
     def log_status(self, message):
-        try:
-            with open(os.path.join('data', 'status_report.txt'), 'a') as f:
-                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {self.current_user}: {message}\n")
-        except Exception as e:
-            print(f"Failed to log status: {str(e)}")
+        self.activity_log.log(self.current_user, message)
+
+    def log_changes(self, events):
+        # Screens log what the user does themselves; changes made by rules and schedules, including
+        # rules fired by a change on this thread, are logged here, one line per device and source,
+        # under the device's owner
+        by_source = {}
+        for event in events:
+            if event.source is not None:
+                by_source.setdefault(event.source, []).append(event)
+        for source, automated in by_source.items():
+            for device_type, devices in deltas(automated).items():
+                for name, changes in devices.items():
+                    device = self.device_manager.devices[device_type].get(name)
+                    if changes and device is not None:
+                        summary = ', '.join(f"{attribute}={value}" for attribute, value in changes.items())
+                        self.activity_log.log(device.owner, f"Automation ({source}) changed {device_type} {name}: "
+                                                            f"{summary}")
 
 class HomeAutomationSystem:
-    def __init__(self):
+    def __init__(self, storage='json', profile_startup=False, tables=False):
+        timings = [('imports', time.perf_counter() - IMPORT_STARTED)]
+        started = time.perf_counter()
         self.root = tk.Tk()
-        self.device_manager = DeviceManager()
-        self.ui = UI(self.root, self.device_manager)
+        timings.append(('tk', time.perf_counter() - started))
+        started = time.perf_counter()
+        # Device types are loaded the first time a screen, lookup or report needs them
+        self.device_manager = DeviceManager(
+            write_behind=True,
+            storage=create_backend(storage, 'data', journal=True),
+            # Schedules fire on their own thread, so errors are shown from the Tk event loop
+            error_handler=lambda message: self.root.after(0, messagebox.showerror, "Error", message),
+            lazy=True,
+            telemetry=TelemetryStore('data'),
+            tables=tables
+        )
+        self.activity_log = ActivityLog('data')
+        self.rules = RulesEngine(self.device_manager, 'data')
+        self.scheduler = Scheduler(self.device_manager, 'data')
+        timings.append(('storage init', time.perf_counter() - started))
+        started = time.perf_counter()
+        self.ui = UI(self.root, self.device_manager, self.activity_log, self.scheduler)
         self.ui.show_auth_screen()
+        self.root.protocol("WM_DELETE_WINDOW", self.shutdown)
+        if profile_startup:
+            self.root.update()
+            timings.append(('first paint', time.perf_counter() - started))
+            self.print_startup_profile(timings)
+
+    def print_startup_profile(self, timings):
+        print("Startup profile:")
+        for phase, seconds in timings:
+            print(f"  {phase:<14}{seconds * 1000:9.1f} ms")
+        print(f"  {'total':<14}{sum(seconds for phase, seconds in timings) * 1000:9.1f} ms")
+        loaded = ', '.join(sorted(self.device_manager.loaded)) or 'none'
+        print(f"  device types loaded before first paint: {loaded}")
+
+    def shutdown(self):
+        self.scheduler.close()
+        self.device_manager.close()
+        self.activity_log.close()
+        self.root.destroy()
 
     def run(self):
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.scheduler.close()
+            self.device_manager.close()
+            self.activity_log.close()
 
 if __name__ == "__main__":
-    app = HomeAutomationSystem()
-    app.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Smart Home Automation")
+    parser.add_argument('--storage', choices=['json', 'sqlite', 'binary'], default='json',
+                        help="device and user storage backend (run STORAGE.py once to migrate JSON data to sqlite, "
+                             "or BINARY.py import for binary)")
+    parser.add_argument('--tables', action='store_true',
+                        help="keep devices in array-backed tables (less memory for very large fleets)")
+    parser.add_argument('--serve', action='store_true',
+                        help="run the headless JSON control server instead of the GUI")
+    parser.add_argument('--metrics', action='store_true',
+                        help="collect hot-path timings from startup (also switchable in Diagnostics)")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print how long imports, storage init and the first paint took")
+    add_server_arguments(parser)
+    commands = parser.add_subparsers(dest='command')
+    add_query_arguments(commands.add_parser('activity', help="query the activity log and exit"))
+    args = parser.parse_args()
+    METRICS.enabled = args.metrics
+    if args.command == 'activity':
+        run_query(args)
+    elif args.serve:
+        run_server(args.host, args.port, args.socket, args.storage, args.shards, args.tables)
+    else:
+        app = HomeAutomationSystem(storage=args.storage, profile_startup=args.profile_startup, tables=args.tables)
+        app.run()
\ No newline at end of file